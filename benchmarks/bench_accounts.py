@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Multi-account benchmark
+Polling several Klereo accounts from one process over a shared connection pool
+vs. one client (session, connection pool) per account, as with one add-on
+container per account. Also checks pool routing, the freshness of pools
+shared between accounts and the staggered schedule.
+Exits non-zero on failure.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from common import report
+from fake_klereo import FakeKlereoServer
+from klereo_accounts import KlereoAccounts
+from klereo_async_api import AsyncKlereoAPI
+from klereo_fetcher import PoolDetailsFetcher
+from klereo_scheduler import MaintenanceCalendar, PollScheduler, stagger
+
+def account_pools(accounts: int, pools: int) -> dict:
+    """Pool ids per login; each account also sees the first pool of the next one"""
+    pool_ids = {}
+    for a in range(accounts):
+        pool_ids[f"user{a}"] = [str(10000 + a * pools + p) for p in range(pools)]
+        if a < accounts - 1:
+            pool_ids[f"user{a}"].append(str(10000 + (a + 1) * pools))
+    return pool_ids
+
+def describe(klereo: FakeKlereoServer, elapsed: float) -> str:
+    logins = sorted(klereo.login_times)
+    gaps = [b - a for a, b in zip(logins, logins[1:])]
+    return (f"{elapsed * 1000:7.0f} ms  connections={len(klereo.connections):3d}  "
+            f"peak in flight={klereo.peak_in_flight:3d}  "
+            f"min login gap={min(gaps) * 1000 if gaps else 0:6.0f} ms  "
+            f"requests={sum(klereo.requests.values())}")
+
+def reset(klereo: FakeKlereoServer) -> None:
+    klereo.requests.clear()
+    klereo.connections.clear()
+    klereo.login_times.clear()
+    klereo.peak_in_flight = 0
+
+async def separate_clients(klereo: FakeKlereoServer, logins: list, logger: logging.Logger) -> str:
+    """One client per account, all starting at once"""
+    reset(klereo)
+    clients = []
+    for login in logins:
+        client = AsyncKlereoAPI(login, 'password', logger=logger)
+        client.API_ROOT = klereo.api_root
+        clients.append(client)
+    
+    async def poll(client: AsyncKlereoAPI) -> None:
+        await client.test_connection()
+        fetcher = PoolDetailsFetcher(client.get_pool_probes, logger=logger)
+        await fetcher.fetch_all(list(await client.get_pools()))
+    
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(poll(client) for client in clients))
+        return describe(klereo, time.perf_counter() - start)
+    finally:
+        for client in clients:
+            await client.close()
+
+async def shared_accounts(klereo: FakeKlereoServer, logins: list, login_spacing: float,
+                          logger: logging.Logger) -> tuple:
+    """KlereoAccounts over one connection pool, logins spaced out"""
+    reset(klereo)
+    accounts = KlereoAccounts([(login, 'password') for login in logins], logger=logger,
+                              login_spacing=login_spacing)
+    for account in accounts.accounts:
+        account.client.API_ROOT = klereo.api_root
+    
+    start = time.perf_counter()
+    try:
+        await accounts.test_connection()
+        pools = await accounts.get_pools()
+        result = await PoolDetailsFetcher(accounts.get_pool_probes, logger=logger).fetch_all(list(pools))
+        summary = describe(klereo, time.perf_counter() - start)
+        fresh = [accounts.pool_details_fresh_until(account) for account in accounts.accounts]
+        return summary, pools, result, dict(klereo.requests), fresh
+    finally:
+        await accounts.close()
+
+def check_schedule(accounts: int, interval: float) -> bool:
+    """First poll of each account after discovery, evenly spread over the interval"""
+    now = 1_700_000_000.0
+    due = []
+    for offset in stagger(accounts, interval):
+        scheduler = PollScheduler(interval, 1800, MaintenanceCalendar({}))
+        scheduler.mark_update(now + offset)
+        # Pool details fetched at discovery expire before the first poll
+        due.append(scheduler.next_update_at(now + AsyncKlereoAPI.POOL_DETAILS_REFRESH_INTERVAL) - now)
+    gaps = [b - a for a, b in zip(due, due[1:])]
+    ok = all(abs(gap - interval / accounts) < 1e-6 for gap in gaps)
+    return report("staggered polls", ok, "first polls at " + ", ".join(f"+{d:.0f}s" for d in due))
+
+async def main(args) -> int:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.CRITICAL)
+    
+    pools = account_pools(args.accounts, args.pools)
+    logins = list(pools)
+    unique_pools = {pool_id for ids in pools.values() for pool_id in ids}
+    
+    with FakeKlereoServer(latency=args.latency, account_pools=pools) as klereo:
+        print(f"{args.accounts} accounts x {args.pools} pools ({len(unique_pools)} distinct), "
+              f"{args.latency * 1000:.0f} ms upstream latency")
+        print(f"separate  {await separate_clients(klereo, logins, logger)}")
+        summary, routed, result, requests, fresh = await shared_accounts(klereo, logins, args.login_spacing, logger)
+        print(f"shared    {summary}")
+    
+    results = [
+        report("every pool routed once", set(routed) == unique_pools and result.succeeded == len(unique_pools),
+               f"{result.succeeded} pools fetched, {requests.get('GetPoolDetails.php', 0)} detail requests"),
+        report("one login per account", requests.get('GetJWT.php', 0) == args.accounts,
+               f"{requests.get('GetJWT.php', 0)} logins"),
+        report("shared pools fresh for every account", None not in fresh,
+               f"{sum(until is not None for until in fresh)}/{len(fresh)} accounts with fresh details"),
+        check_schedule(args.accounts, args.interval)
+    ]
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=5)
+    parser.add_argument('--pools', type=int, default=4, help='pools per account')
+    parser.add_argument('--latency', type=float, default=0.05, help='upstream latency per request (s)')
+    parser.add_argument('--login-spacing', type=float, default=0.2, help='delay between logins (s)')
+    parser.add_argument('--interval', type=float, default=600, help='update interval (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+End-to-end add-on benchmark
+Runs KlereoAddon itself against the replay server (fixtures/GetPoolDetails.json)
+and the stub Home Assistant API for 1 to 1000 pools. Per pool count it reports
+startup time, full update cycle latency, throughput, memory retained by the
+add-on and upstream requests per cycle; a last scenario injects upstream
+errors. Results can be saved and later compared against, so regressions are
+caught offline.
+Exits non-zero on failure or regression.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from common import expire_pool_details, load_addon_class, report
+from fake_klereo import ADDON_BIN, SAMPLE_POOL_DETAILS, FakeKlereoServer
+from klereo_async_api import AsyncKlereoAPI
+from stub_ha import StubHAServer
+
+# Metrics where a value higher than the baseline by more than the tolerance
+# is a regression
+REGRESSION_METRICS = ('startup_ms', 'cycle_ms', 'retained_kb', 'klereo_requests')
+
+def configure(klereo: FakeKlereoServer, ha_server: StubHAServer, args) -> None:
+    """Point the add-on configuration (read from the environment) at the local servers"""
+    AsyncKlereoAPI.API_ROOT = klereo.api_root
+    os.environ.update({
+        'KLEREO_USERNAME': 'bench',
+        'KLEREO_PASSWORD': 'bench',
+        'HOMEASSISTANT_URL': ha_server.url,
+        'HOMEASSISTANT_TOKEN': 'token',
+        'HA_TRANSPORT': args.transport,
+        'MAX_CONCURRENT_REQUESTS': str(args.concurrency),
+        'PERSISTENT_CACHE': 'false',
+        'METRICS': 'false'
+    })
+
+async def start(addon_class: type):
+    """Create the add-on and run its startup until the first states are published"""
+    addon = addon_class()
+    addon._stop_event = asyncio.Event()
+    await addon._initialize_clients()
+    await addon._initial_discovery()
+    return addon
+
+async def timed_run(addon_class: type, klereo: FakeKlereoServer, ha_server: StubHAServer, cycles: int) -> dict:
+    """Startup plus cycles update cycles with every pool and state changed"""
+    klereo.requests.clear()
+    ha_server.requests.clear()
+    
+    begin = time.perf_counter()
+    addon = await start(addon_class)
+    startup = time.perf_counter() - begin
+    
+    durations = []
+    requests = states = 0
+    try:
+        account = addon.api_client.accounts[0]
+        for _ in range(cycles):
+            klereo.advance()
+            expire_pool_details(addon)
+            klereo.requests.clear()
+            pushed = ha_server.requests['states']
+            
+            begin = time.perf_counter()
+            await addon._update_cycle(account)
+            durations.append(time.perf_counter() - begin)
+            
+            requests = max(requests, sum(klereo.requests.values()))
+            states = ha_server.requests['states'] - pushed
+        fetched = addon.ha_integration.fetcher.last_cycle_duration
+    finally:
+        await addon._cleanup()
+    
+    cycle = statistics.median(durations)
+    pools = len(klereo.pool_ids())
+    return {
+        'startup_ms': round(startup * 1000, 1),
+        'cycle_ms': round(cycle * 1000, 1),
+        'fetch_ms': round(fetched * 1000, 1),
+        'pools_per_s': round(pools / cycle, 1),
+        'states_per_s': round(states / cycle, 1),
+        'klereo_requests': requests,
+        'states': states
+    }
+
+async def retained_memory(addon_class: type, klereo: FakeKlereoServer) -> tuple:
+    """(total, history) KB allocated by add-on code and still held after startup and one cycle
+    
+    Measured in a separate run, since tracing slows everything down. Only
+    allocations made directly by add-on code count, which leaves out the
+    local servers running in this process. history is the part held by the
+    preallocated probe history ring buffers.
+    """
+    tracemalloc.start()
+    try:
+        addon = await start(addon_class)
+        try:
+            klereo.advance()
+            expire_pool_details(addon)
+            await addon._update_cycle(addon.api_client.accounts[0])
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            await addon._cleanup()
+    finally:
+        tracemalloc.stop()
+    
+    def kb(pattern: str) -> float:
+        traces = snapshot.filter_traces([tracemalloc.Filter(True, pattern)])
+        return round(sum(stat.size for stat in traces.statistics('filename')) / 1024, 1)
+    
+    addon_code = os.path.join(os.path.abspath(ADDON_BIN), '*')
+    return kb(addon_code), kb(os.path.join(os.path.abspath(ADDON_BIN), 'klereo_history.py'))
+
+async def scenario(name: str, pools: int, addon_class: type, args, error_rate: float = 0.0) -> tuple:
+    """Run one pool count; returns (metrics, passed checks)"""
+    with FakeKlereoServer(pool_count=pools, latency=args.latency, fixture=SAMPLE_POOL_DETAILS) as klereo, \
+            StubHAServer(latency=args.ha_latency) as ha_server:
+        configure(klereo, ha_server, args)
+        klereo.jitter = args.latency * 0.5
+        klereo.error_rate = error_rate
+        klereo.fault_endpoints = {'GetPoolDetails.php'}
+        
+        metrics = await timed_run(addon_class, klereo, ha_server, args.cycles)
+        klereo.error_rate = 0.0
+        metrics['retained_kb'], metrics['history_kb'] = await retained_memory(addon_class, klereo)
+        probes = len(klereo.fixture['response']['probes'])
+    
+    print(f"{name:<12} startup {metrics['startup_ms']:8.1f} ms  cycle {metrics['cycle_ms']:8.1f} ms  "
+          f"{metrics['pools_per_s']:7.1f} pools/s  {metrics['states_per_s']:8.1f} states/s  "
+          f"requests/cycle {metrics['klereo_requests']:5d}  "
+          f"retained {metrics['retained_kb']:8.1f} KB ({metrics['history_kb']:.0f} KB history)")
+    
+    # Every probe state plus the circuit breaker and connectivity diagnostics
+    expected = pools * probes + 2
+    checks = [report(f"{name} pushes every changed state", metrics['states'] == expected,
+                     f"{metrics['states']}/{expected}")]
+    if not error_rate:
+        # One details request per pool; token and index come from the cache
+        checks.append(report(f"{name} one request per pool", metrics['klereo_requests'] == pools,
+                             f"{metrics['klereo_requests']} requests"))
+    return metrics, all(checks)
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Check every metric against the saved baseline"""
+    ok = True
+    for name, metrics in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            if metric not in previous:
+                continue
+            limit = previous[metric] * (1 + tolerance)
+            ok &= report(f"{name} {metric}", metrics[metric] <= limit,
+                         f"{metrics[metric]} vs baseline {previous[metric]}")
+    return ok
+
+async def main(args) -> int:
+    logging.getLogger('bench').setLevel(logging.CRITICAL)
+    addon_class = load_addon_class()
+    print(f"{args.latency * 1000:.0f} ms upstream latency, {args.ha_latency * 1000:.0f} ms HA latency, "
+          f"concurrency {args.concurrency}, {args.transport} transport, median of {args.cycles} cycles")
+    
+    results = {}
+    passed = True
+    for pools in args.pools:
+        results[f"{pools} pools"], ok = await scenario(f"{pools} pools", pools, addon_class, args)
+        passed &= ok
+    if args.error_rate:
+        pools = args.pools[min(1, len(args.pools) - 1)]
+        name = f"{pools} pools {args.error_rate:.0%} errors"
+        results[name], ok = await scenario(name, pools, addon_class, args, error_rate=args.error_rate)
+        passed &= ok
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            passed &= compare(results, json.load(f), args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+    
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=lambda value: [int(n) for n in value.split(',')], default=[1, 10, 100, 1000],
+                        help='comma-separated pool counts')
+    parser.add_argument('--cycles', type=int, default=3, help='update cycles per pool count')
+    parser.add_argument('--latency', type=float, default=0.01, help='upstream latency per request (s)')
+    parser.add_argument('--ha-latency', type=float, default=0.002, help='stub HA latency per request (s)')
+    parser.add_argument('--concurrency', type=int, default=4, help='max_concurrent_requests')
+    parser.add_argument('--transport', choices=('rest', 'websocket'), default='rest')
+    parser.add_argument('--error-rate', type=float, default=0.2,
+                        help='share of failing pool detail requests in the error scenario (0 to skip)')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown vs. baseline')
+    parser.add_argument('--save', help='write the results to this file')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Incremental discovery benchmark
+Registry calls and discovery time on a first start, on a restart with the
+persisted registration state, and for a cycle after pools and probes were
+added, renamed and removed in Klereo.
+Exits non-zero on failure.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from common import report
+from fake_klereo import FakeKlereoServer
+from ha_integration import HomeAssistantIntegration
+from klereo_async_api import AsyncKlereoAPI
+from klereo_discovery import RegistrationStore
+from stub_ha import StubHAServer
+
+REGISTRY_CALLS = ('device_registry', 'entity_registry', 'delete_states')
+
+def registry_calls(server: StubHAServer) -> dict:
+    return {name: server.requests[name] for name in REGISTRY_CALLS}
+
+async def start(klereo: FakeKlereoServer, server: StubHAServer, store_path: str,
+                logger: logging.Logger) -> tuple:
+    """Run startup discovery; returns (integration, api, seconds, registry calls)"""
+    server.requests.clear()
+    api = AsyncKlereoAPI('bench', 'bench', logger=logger)
+    api.API_ROOT = klereo.api_root
+    ha = HomeAssistantIntegration(server.url, 'token', api_client=api, logger=logger,
+                                  registration_store=RegistrationStore(store_path, namespace=server.url,
+                                                                       logger=logger))
+    await api.test_connection()
+    begin = time.perf_counter()
+    await ha.discover_and_register_pools()
+    elapsed = time.perf_counter() - begin
+    ha.save_registrations()
+    return ha, api, elapsed, registry_calls(server)
+
+async def main(args) -> int:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.CRITICAL)
+    results = []
+    
+    pool_ids = [str(10000 + i) for i in range(args.pools)]
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeKlereoServer(probes_per_pool=args.probes, account_pools={'bench': pool_ids}) as klereo, \
+            StubHAServer(latency=args.latency) as server:
+        store_path = os.path.join(tmp, 'klereo_registrations.json')
+        entities = args.pools * args.probes
+        print(f"{args.pools} pools x {args.probes} probes, {args.latency * 1000:.0f} ms HA latency per call")
+        
+        ha, api, elapsed, calls = await start(klereo, server, store_path, logger)
+        await ha.cleanup()
+        await api.close()
+        print(f"first start  discovery {elapsed * 1000:7.1f} ms  {calls}")
+        results.append(report("first start registers everything",
+                              calls['device_registry'] == args.pools and calls['entity_registry'] == entities))
+        
+        ha, api, elapsed, calls = await start(klereo, server, store_path, logger)
+        print(f"restart      discovery {elapsed * 1000:7.1f} ms  {calls}")
+        results.append(report("restart makes no registry calls", not any(calls.values())))
+        
+        try:
+            # Steady state: unchanged index and probes
+            await ha.update_all_sensors()
+            results.append(report("unchanged cycle makes no registry calls",
+                                  not any(registry_calls(server).values())))
+            
+            # Klereo changes: one pool added, one removed, one renamed, one probe more per pool
+            added, removed, renamed = str(10000 + args.pools), pool_ids[-1], pool_ids[0]
+            klereo.account_pools['bench'] = pool_ids[:-1] + [added]
+            klereo.pool_names[renamed] = 'Renamed pool'
+            klereo.probes_per_pool = args.probes + 1
+            api.clear_cache()
+            server.requests.clear()
+            
+            begin = time.perf_counter()
+            await ha.update_all_sensors()
+            elapsed = time.perf_counter() - begin
+            calls = registry_calls(server)
+            print(f"changes      cycle     {elapsed * 1000:7.1f} ms  {calls}")
+            
+            # The new probe of every remaining pool plus all probes of the new pool
+            expected_entities = (args.pools - 1) + (args.probes + 1)
+            results.append(report("only the diff is applied",
+                                  calls == {'device_registry': 2, 'entity_registry': expected_entities,
+                                            'delete_states': args.probes},
+                                  f"expected 2 devices, {expected_entities} entities, {args.probes} removals"))
+            ha.save_registrations()
+        finally:
+            await ha.cleanup()
+            await api.close()
+        
+        devices, stored_entities = RegistrationStore(store_path, namespace=server.url, logger=logger).load()
+        results.append(report("persisted state matches Klereo",
+                              len(devices) == args.pools and len(stored_entities) == args.pools * (args.probes + 1),
+                              f"{len(devices)} devices, {len(stored_entities)} entities"))
+    
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=int, default=20)
+    parser.add_argument('--probes', type=int, default=5, help='probes per pool')
+    parser.add_argument('--latency', type=float, default=0.005, help='stub HA latency per request (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
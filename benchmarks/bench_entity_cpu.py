@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Per-cycle CPU cost of building Home Assistant state updates
+Compares the former per-update string matching with precomputed entity
+descriptors, and times a full update_sensor_states cycle with HTTP stubbed out.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import timeit
+
+import fake_klereo  # noqa: F401  (sets up the add-on import path)
+from fake_klereo import PROBE_TEMPLATES
+from ha_integration import HomeAssistantIntegration
+from klereo_entities import EntityDescriptorCache, classify_probe
+
+def legacy_classify(probe_name: str, table: dict) -> str:
+    """The if/elif substring cascade previously run per update"""
+    name = probe_name.lower()
+    if 'temperature' in name or 'temp' in name:
+        return table['temperature']
+    elif 'ph' in name:
+        return table['ph']
+    elif 'chlorine' in name or 'cl' in name:
+        return table['chlorine']
+    elif 'orp' in name or 'redox' in name:
+        return table['orp']
+    elif 'level' in name or 'water' in name:
+        return table['level']
+    return table[None]
+
+DEVICE_CLASSES = {'temperature': 'temperature', 'ph': None, 'chlorine': None, 'orp': None, 'level': None, None: None}
+KINDS = {'temperature': 'temperature', 'ph': 'ph', 'chlorine': 'chlorine', 'orp': 'orp', 'level': 'level', None: None}
+
+def legacy_entity_id(pool_id: str, probe_name: str) -> str:
+    sanitized_name = probe_name.lower().replace(' ', '_').replace('-', '_')
+    return f"sensor.klereo_{pool_id}_{sanitized_name}"
+
+def legacy_cycle(pool_probes: dict) -> list:
+    """Build every state payload the way update_sensor_state(s) used to"""
+    payloads = []
+    for pool_id, probes in pool_probes.items():
+        for probe in probes:
+            name = probe['name']
+            legacy_entity_id(pool_id, name)  # update_sensor_states result key
+            entity_id = legacy_entity_id(pool_id, name)
+            legacy_classify(name, KINDS)  # deadband lookup
+            payloads.append({
+                'entity_id': entity_id,
+                'state': probe.get('filteredValue', 0),
+                'attributes': {
+                    'unit_of_measurement': probe.get('unit', ''),
+                    'friendly_name': probe.get('name', ''),
+                    'device_class': legacy_classify(name, DEVICE_CLASSES)
+                }
+            })
+            payloads.append(f"states/{entity_id}")
+    return payloads
+
+def descriptor_cycle(cache: EntityDescriptorCache, pool_probes: dict) -> list:
+    """Build every state payload from precomputed descriptors"""
+    payloads = []
+    for pool_id, probes in pool_probes.items():
+        for probe in probes:
+            descriptor = cache.get(pool_id, probe)
+            payloads.append(descriptor.state_data(probe.get('filteredValue', 0)))
+            payloads.append(descriptor.state_endpoint)
+    return payloads
+
+def make_pool_probes(pool_count: int) -> dict:
+    """Build {pool_id: [probe, ...]} from the fake server's probe templates"""
+    return {
+        str(10000 + i): [dict(template, logicalId=logical_id) for logical_id, template in enumerate(PROBE_TEMPLATES)]
+        for i in range(pool_count)
+    }
+
+async def full_cycle(pool_probes: dict, rounds: int) -> float:
+    """Average CPU time of update_sensor_states with a no-op HTTP layer"""
+    ha = HomeAssistantIntegration('http://stub', 'token', api_client=None,
+                                  logger=logging.getLogger('bench'), state_heartbeat=0)
+    
+    async def no_http(endpoint, method='GET', data=None):
+        return {'result': 'ok'}
+    ha._make_ha_request = no_http
+    
+    await ha.update_sensor_states(pool_probes)  # registration and descriptor build
+    start = time.process_time()
+    for _ in range(rounds):
+        await ha.update_sensor_states(pool_probes)
+    return (time.process_time() - start) / rounds
+
+def main(args) -> None:
+    logging.getLogger('bench').setLevel(logging.CRITICAL)
+    
+    # The table-driven classifier must agree with the cascade it replaced
+    names = [template['name'] for template in PROBE_TEMPLATES]
+    for name in names + ['Air Temp', 'Redox', 'Salt Level', 'Filtration Pressure', 'CL libre', 'Phosphate']:
+        kind, device_class, _ = classify_probe(name)
+        assert (kind, device_class) == (legacy_classify(name, KINDS), legacy_classify(name, DEVICE_CLASSES)), name
+    
+    for pool_count in args.pools:
+        pool_probes = make_pool_probes(pool_count)
+        entities = sum(len(probes) for probes in pool_probes.values())
+        cache = EntityDescriptorCache(lambda pool_id: f"klereo_pool_{pool_id}")
+        descriptor_cycle(cache, pool_probes)  # built at discovery
+        
+        legacy = min(timeit.repeat(lambda: legacy_cycle(pool_probes), number=args.rounds, repeat=3)) / args.rounds
+        cached = min(timeit.repeat(lambda: descriptor_cycle(cache, pool_probes), number=args.rounds,
+                                   repeat=3)) / args.rounds
+        full = asyncio.run(full_cycle(pool_probes, args.rounds))
+        
+        print(f"entities={entities:5d}  payloads legacy={legacy * 1e6:8.1f} us  "
+              f"descriptors={cached * 1e6:8.1f} us  ({legacy / cached:4.1f}x)  "
+              f"full cycle={full * 1e3:7.2f} ms CPU")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--rounds', type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Event-loop responsiveness benchmark
+Compares the blocking KlereoAPI with AsyncKlereoAPI against a slow fake upstream
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from fake_klereo import FakeKlereoServer
+from klereo_async_api import AsyncKlereoAPI
+
+TICK = 0.01  # heartbeat period in seconds
+
+async def heartbeat(lags: list, stop: asyncio.Event) -> None:
+    """Record how late the loop wakes a periodic task"""
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK
+        await asyncio.sleep(TICK)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+async def run_sync_cycle(api) -> None:
+    """Poll the way the add-on used to: blocking calls straight from a coroutine"""
+    pools = api.get_pools()
+    for pool_id in pools:
+        api.get_pool_probes(pool_id)
+
+async def run_async_cycle(api) -> None:
+    """Poll with the asyncio client"""
+    pools = await api.get_pools()
+    for pool_id in pools:
+        await api.get_pool_probes(pool_id)
+
+async def measure(label: str, api, cycle) -> None:
+    """Run one cycle while a heartbeat samples loop lag"""
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    await asyncio.sleep(TICK * 2)
+    
+    start = time.perf_counter()
+    await cycle(api)
+    elapsed = time.perf_counter() - start
+    
+    stop.set()
+    await beat
+    
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p95 = lags_ms[int(len(lags_ms) * 0.95) - 1] if len(lags_ms) > 1 else lags_ms[0]
+    print(f"{label:<14} cycle={elapsed * 1000:8.1f} ms  heartbeats={len(lags):4d}  "
+          f"lag max={lags_ms[-1]:8.1f} ms  p95={p95:8.1f} ms  mean={statistics.mean(lags_ms):6.1f} ms")
+
+async def main(args) -> None:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.ERROR)
+    
+    with FakeKlereoServer(pool_count=args.pools, latency=args.latency) as server:
+        try:
+            from klereo_api import KlereoAPI
+        except ImportError:
+            print("requests not installed, skipping blocking client")
+        else:
+            sync_api = KlereoAPI('bench', 'bench', logger=logger)
+            sync_api.API_ROOT = server.api_root
+            await measure('KlereoAPI', sync_api, run_sync_cycle)
+        
+        async_api = AsyncKlereoAPI('bench', 'bench', logger=logger)
+        async_api.API_ROOT = server.api_root
+        try:
+            await measure('AsyncKlereoAPI', async_api, run_async_cycle)
+        finally:
+            await async_api.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.3, help='upstream latency per request (s)')
+    asyncio.run(main(parser.parse_args()))
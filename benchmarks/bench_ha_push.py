@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Home Assistant state push benchmark
+Compares serial update_sensor_state calls with the concurrent update_sensor_states pipeline
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import fake_klereo  # noqa: F401  (sets up the add-on import path)
+from ha_integration import HomeAssistantIntegration
+from stub_ha import StubHAServer
+
+PROBES_PER_POOL = 5
+
+def make_pool_probes(entity_count: int, value: float) -> dict:
+    """Build {pool_id: [probe, ...]} totalling entity_count probes"""
+    pool_probes = {}
+    for i in range(entity_count):
+        pool_id = str(10000 + i // PROBES_PER_POOL)
+        probe = {'logicalId': i, 'name': f"Probe {i}", 'filteredValue': value, 'unit': 'pH', 'type': 'ph'}
+        pool_probes.setdefault(pool_id, []).append(probe)
+    return pool_probes
+
+async def bench(server: StubHAServer, entity_count: int, logger: logging.Logger) -> None:
+    """Time one serial and one concurrent push of entity_count states"""
+    ha = HomeAssistantIntegration(server.url, 'token', api_client=None, logger=logger)
+    pool_probes = make_pool_probes(entity_count, 7.2)
+    try:
+        # Register entities up front so only state pushes are timed
+        for pool_id, probes in pool_probes.items():
+            for probe in probes:
+                await ha.register_sensor_entity(pool_id, probe)
+        
+        start = time.perf_counter()
+        for pool_id, probes in pool_probes.items():
+            for probe in probes:
+                await ha.update_sensor_state(pool_id, probe)
+        serial = time.perf_counter() - start
+        
+        # Change every value past the pH deadband so nothing is suppressed
+        results = await ha.update_sensor_states(make_pool_probes(entity_count, 7.4))
+        concurrent = ha.last_push_duration
+        ok = sum(1 for success in results.values() if success)
+        
+        print(f"entities={entity_count:4d}  serial={serial * 1000:8.1f} ms  "
+              f"concurrent={concurrent * 1000:8.1f} ms  speedup={serial / concurrent:5.1f}x  ok={ok}")
+    finally:
+        await ha.cleanup()
+
+async def main(args) -> None:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.ERROR)
+    
+    with StubHAServer(latency=args.latency) as server:
+        print(f"{args.latency * 1000:.0f} ms HA latency, push concurrency "
+              f"{HomeAssistantIntegration.DEFAULT_PUSH_CONCURRENCY}")
+        for entity_count in args.entities:
+            await bench(server, entity_count, logger)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entities', type=int, nargs='+', default=[5, 50, 500])
+    parser.add_argument('--latency', type=float, default=0.005, help='HA latency per request (s)')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Home Assistant transport benchmark
+Per-cycle state push latency with ha_transport rest vs. websocket (state
+writes go over HTTP either way, since Home Assistant has no WebSocket
+command for them), round trip of the connection check over a new HTTP
+request vs. the persistent WebSocket, plus reconnect and REST fallback
+checks. The stub only answers WebSocket commands Home Assistant Core has.
+Exits non-zero on failure.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+import fake_klereo  # noqa: F401  (sets up the add-on import path)
+from bench_ha_push import make_pool_probes
+from common import report
+from ha_integration import HomeAssistantIntegration
+from stub_ha import StubHAServer
+
+async def cycle_time(server: StubHAServer, transport: str, entity_count: int, cycles: int,
+                     logger: logging.Logger) -> float:
+    """Mean update_sensor_states duration after registration"""
+    ha = HomeAssistantIntegration(server.url, 'token', api_client=None, logger=logger,
+                                  state_heartbeat=0, transport=transport)
+    pool_probes = make_pool_probes(entity_count, 7.2)
+    try:
+        if not await ha.test_ha_connection():
+            raise SystemExit(f"{transport}: connection failed")
+        await ha.update_sensor_states(pool_probes)  # registers entities
+        
+        durations = []
+        for _ in range(cycles):
+            await ha.update_sensor_states(pool_probes)
+            durations.append(ha.last_push_duration)
+        return sum(durations) / len(durations)
+    finally:
+        await ha.cleanup()
+
+async def config_time(server: StubHAServer, transport: str, calls: int, logger: logging.Logger) -> float:
+    """Mean duration of one get_config round trip, after the first"""
+    ha = HomeAssistantIntegration(server.url, 'token', api_client=None, logger=logger, transport=transport)
+    try:
+        await ha._make_ha_request('config')
+        start = time.perf_counter()
+        for _ in range(calls):
+            await ha._make_ha_request('config')
+        return (time.perf_counter() - start) / calls
+    finally:
+        await ha.cleanup()
+
+async def check_reconnect(server: StubHAServer, logger: logging.Logger) -> bool:
+    """Drop the connection server-side and check the connection again"""
+    ha = HomeAssistantIntegration(server.url, 'token', api_client=None, logger=logger, transport='websocket')
+    try:
+        await ha.test_ha_connection()
+        server.drop_websockets()
+        await asyncio.sleep(0.1)
+        ok = await ha.test_ha_connection() and ha.websocket.reconnects == 1
+        return report("reconnect after server drop", ok, f"reconnects={ha.websocket.reconnects}")
+    finally:
+        await ha.cleanup()
+
+async def check_fallback(latency: float, logger: logging.Logger) -> bool:
+    """A Home Assistant answering unknown_command: the check falls back to REST"""
+    with StubHAServer(latency=latency, ws_commands=()) as server:
+        ha = HomeAssistantIntegration(server.url, 'token', api_client=None, logger=logger,
+                                      state_heartbeat=0, transport='websocket')
+        try:
+            first = await ha.test_ha_connection()
+            second = await ha.test_ha_connection()
+        finally:
+            await ha.cleanup()
+        ok = first and second and server.requests['ws:get_config'] == 1 and server.requests['config'] == 2
+        return report("REST fallback for unknown commands", ok,
+                      f"ws get_config={server.requests['ws:get_config']}, rest config={server.requests['config']}")
+
+async def main(args) -> int:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.CRITICAL)
+    
+    with StubHAServer(latency=args.latency) as server:
+        print(f"{args.latency * 1000:.0f} ms HA latency per request, push concurrency "
+              f"{HomeAssistantIntegration.DEFAULT_PUSH_CONCURRENCY}")
+        for entity_count in args.entities:
+            rest = await cycle_time(server, 'rest', entity_count, args.cycles, logger)
+            websocket = await cycle_time(server, 'websocket', entity_count, args.cycles, logger)
+            print(f"entities={entity_count:4d}  push rest={rest * 1000:8.1f} ms  websocket={websocket * 1000:8.1f} ms")
+        
+        server.requests.clear()
+        rest = await config_time(server, 'rest', args.calls, logger)
+        websocket = await config_time(server, 'websocket', args.calls, logger)
+        print(f"get_config round trip  rest={rest * 1000:6.2f} ms  websocket={websocket * 1000:6.2f} ms "
+              f"({server.requests['ws:get_config']} over the socket)")
+        
+        results = [await check_reconnect(server, logger)]
+    results.append(await check_fallback(args.latency, logger))
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entities', type=int, nargs='+', default=[5, 50, 500])
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--calls', type=int, default=200, help='get_config calls timed per transport')
+    parser.add_argument('--latency', type=float, default=0.005, help='stub HA latency per request (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
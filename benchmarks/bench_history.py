@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Probe history benchmark
+Append throughput and memory bound of the ring buffers, streaming downsampling
+against a naive recomputation, memory-mapped persistence, backfill of
+hourly statistics after a Home Assistant outage, and no re-import of them
+after a restart.
+Exits non-zero on failure.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import report
+import fake_klereo  # noqa: F401  (sets up the add-on import path)
+from ha_integration import HomeAssistantIntegration
+from klereo_history import Downsampler, ProbeHistory, RingBuffer
+from stub_ha import StubHAServer
+
+def bench_append(samples: int, capacity: int) -> bool:
+    """Throughput and memory of appending far more samples than the capacity"""
+    now = time.time() - samples * 600
+    history = ProbeHistory(capacity=capacity)
+    start = time.perf_counter()
+    for i in range(samples):
+        history.record('1', 1, 7.0 + (i % 100) / 100, now + i * 600)
+    elapsed = time.perf_counter() - start
+    
+    tracemalloc.start()
+    history = ProbeHistory(capacity=capacity)
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(samples):
+        history.record('1', 1, 7.0 + (i % 100) / 100, now + i * 600)
+    grown = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    
+    expected = (RingBuffer.HEADER + 2 * capacity) * 8
+    print(f"append: {samples} samples in {elapsed * 1000:.0f} ms ({elapsed / samples * 1e6:.2f} us/sample)")
+    return report("memory bounded by capacity", grown < expected + 64 * 1024,
+                  f"grew {grown / 1024:.0f} KB for a {expected / 1024:.0f} KB buffer")
+
+def check_downsampling(samples: int) -> bool:
+    """Streaming buckets against min/max/mean recomputed from all samples"""
+    downsampler = Downsampler(3600, keep=10 ** 6)
+    rng = random.Random(42)
+    timestamp = 1_700_000_000.0
+    raw = []
+    for _ in range(samples):
+        timestamp += rng.uniform(60, 900)
+        value = rng.uniform(6.8, 7.8)
+        raw.append((timestamp, value))
+        downsampler.add(timestamp, value)
+    
+    buckets = {}
+    for timestamp, value in raw:
+        buckets.setdefault(downsampler.bucket_start(timestamp), []).append(value)
+    
+    streamed = list(downsampler.completed) + [downsampler.current()]
+    ok = len(streamed) == len(buckets) and all(
+        bucket['min'] == min(buckets[bucket['start']])
+        and bucket['max'] == max(buckets[bucket['start']])
+        and abs(bucket['mean'] - sum(buckets[bucket['start']]) / len(buckets[bucket['start']])) < 1e-9
+        for bucket in streamed)
+    return report("streaming min/max/mean", ok, f"{len(streamed)} hourly buckets from {samples} samples")
+
+def check_persistence(capacity: int) -> bool:
+    """Memory-mapped buffers reload with their samples and windows"""
+    with tempfile.TemporaryDirectory() as directory:
+        history = ProbeHistory(capacity=capacity, directory=directory)
+        start = time.time() - 3 * 3600
+        for i in range(capacity + 10):
+            history.record('1', 2, float(i), start + i)
+        expected = history.samples('1', 2)
+        history.close()
+        
+        reopened = ProbeHistory(capacity=capacity, directory=directory)
+        ok = reopened.samples('1', 2) == expected and len(expected) == capacity \
+            and reopened.statistics('1', 2, '1h') is not None
+        reopened.close()
+    return report("memory-mapped reload", ok, f"{len(expected)} samples")
+
+async def check_backfill(logger: logging.Logger) -> bool:
+    """Hours recorded while Home Assistant is down are imported once it is back"""
+    history = ProbeHistory(capacity=1024)
+    hour = 3600
+    start = (time.time() // hour - 12) * hour
+    
+    # Twelve hours of samples, one every 10 minutes
+    pool_probes = {'1': [{'logicalId': 0, 'name': 'pH', 'unit': 'pH', 'filteredValue': 7.2}]}
+    with StubHAServer() as server:
+        ha = HomeAssistantIntegration(server.url, 'token', api_client=None, logger=logger, history=history)
+        try:
+            for i in range(6 * 6):
+                pool_probes['1'][0]['filteredValue'] = 7.0 + i / 100
+                ha.record_history(pool_probes, start + i * 600)
+            first = await ha.import_statistics()
+            
+            # Home Assistant goes away for six hours
+            await ha._statistics_socket.close()
+            ha._statistics_socket.url = 'ws://127.0.0.1:9/api/websocket'
+            ha._statistics_socket.retry_policy.max_attempts = 1
+            for i in range(6 * 6, 6 * 12):
+                ha.record_history(pool_probes, start + i * 600)
+            during = await ha.import_statistics()
+            
+            # and comes back
+            ha._statistics_socket.url = f"{server.url.replace('http', 'ws', 1)}/api/websocket"
+            after = await ha.import_statistics()
+        finally:
+            await ha.cleanup()
+        
+        imported = sum(len(rows) for rows in server.statistics.values())
+    return report("backfill after HA outage", first == 5 and during == 0 and after == 6 and imported == 11,
+                  f"imported {first}, {during} while down, {after} after; {imported} hours in HA")
+
+async def check_import_restart(logger: logging.Logger) -> bool:
+    """Hours imported before a restart aren't sent again after it"""
+    hour = 3600
+    start = (time.time() // hour - 8) * hour
+    pool_probes = {'1': [{'logicalId': 0, 'name': 'pH', 'unit': 'pH', 'filteredValue': 7.2}]}
+    
+    async def run(directory: str, samples: range) -> int:
+        history = ProbeHistory(capacity=1024, directory=directory)
+        ha = HomeAssistantIntegration(server.url, 'token', api_client=None, logger=logger, history=history)
+        try:
+            for i in samples:
+                ha.record_history(pool_probes, start + i * 600)
+            return await ha.import_statistics()
+        finally:
+            await ha.cleanup()
+            history.close()
+    
+    with tempfile.TemporaryDirectory() as directory, StubHAServer() as server:
+        first = await run(directory, range(6 * 6))
+        # The first sample after the restart completes one more hour, the only one to send
+        restarted = await run(directory, range(6 * 6, 6 * 6 + 1))
+        later = await run(directory, range(6 * 6 + 1, 6 * 7 + 1))
+    return report("no re-import after a restart", first == 5 and restarted == 1 and later == 1,
+                  f"imported {first}, {restarted} after the restart, {later} an hour later")
+
+async def main(args) -> int:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.CRITICAL)
+    
+    results = [
+        bench_append(args.samples, args.capacity),
+        check_downsampling(args.samples // 10),
+        check_persistence(args.capacity),
+        await check_backfill(logger),
+        await check_import_restart(logger)
+    ]
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--samples', type=int, default=200_000)
+    parser.add_argument('--capacity', type=int, default=ProbeHistory.DEFAULT_CAPACITY)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Logging pipeline benchmark
+Event loop time per log call and loop lag with a slow log device, direct
+handlers (the former basicConfig setup) vs. the queue pipeline of
+klereo_logging; cost of disabled debug calls with f-strings vs. lazy
+arguments; repeated message rate limiting and the rotated file size bound.
+Exits non-zero on failure.
+    
+    python3 bench_logging.py --write-delay 0.002
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from common import report
+import fake_klereo  # noqa: F401  (makes the add-on modules importable)
+from klereo_logging import setup_logging
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class SlowStream(io.StringIO):
+    """Stream whose flushes take as long as a busy SD card"""
+    
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+    
+    def flush(self) -> None:
+        time.sleep(self.delay)
+
+def reset_root() -> logging.Logger:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    return root
+
+async def log_cycle(logger: logging.Logger, states: int) -> dict:
+    """Log one state line per entity, as a debug-level update cycle does, while sampling loop lag"""
+    lags = []
+    stop = asyncio.Event()
+    
+    async def heartbeat() -> None:
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            expected = loop.time() + 0.005
+            await asyncio.sleep(0.005)
+            lags.append(max(0.0, loop.time() - expected))
+    
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.02)
+    start = time.perf_counter()
+    for index in range(states):
+        logger.debug("State updated: %s = %s", f"Probe {index}", 7.2)
+        if index % 20 == 0:
+            await asyncio.sleep(0)  # pushes are interleaved with awaits
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    return {'per_call': elapsed / states, 'max_lag': max(lags or [0.0])}
+
+async def main(args) -> int:
+    results = []
+    logger = logging.getLogger('klereo')
+    
+    with tempfile.TemporaryDirectory() as directory:
+        # Former setup: handlers run in the event loop
+        root = reset_root()
+        root.setLevel(logging.DEBUG)
+        direct_stream = SlowStream(args.write_delay)
+        handler = logging.StreamHandler(direct_stream)
+        handler.setFormatter(logging.Formatter(FORMAT))
+        root.addHandler(handler)
+        direct = await log_cycle(logger, args.states)
+        
+        # Queue pipeline: the writer thread does the slow writes
+        reset_root()
+        queued_stream = SlowStream(args.write_delay)
+        writer = setup_logging(logging.DEBUG, os.path.join(directory, 'klereo.log'), stream=queued_stream)
+        queued = await log_cycle(logger, args.states)
+        drain_start = time.perf_counter()
+        writer.stop()
+        drained = time.perf_counter() - drain_start
+        written = queued_stream.getvalue().count('State updated')
+        
+        print(f"{args.states} debug lines, {args.write_delay * 1000:.1f} ms per write")
+        print(f"  direct handlers  {direct['per_call'] * 1e6:8.1f} us per call in the loop, "
+              f"max loop lag {direct['max_lag'] * 1000:7.1f} ms")
+        print(f"  queue pipeline   {queued['per_call'] * 1e6:8.1f} us per call in the loop, "
+              f"max loop lag {queued['max_lag'] * 1000:7.1f} ms (writer drained in {drained:.1f} s)")
+        results.append(report("log calls don't wait for the device", queued['per_call'] < direct['per_call'] / 10,
+                              f"{direct['per_call'] / queued['per_call']:.0f}x less loop time per call"))
+        results.append(report("every record written by the writer", written == args.states,
+                              f"{written}/{args.states}"))
+        
+        # Disabled debug calls: f-string formats anyway, lazy arguments don't
+        reset_root()
+        writer = setup_logging(logging.INFO, None, stream=io.StringIO())
+        name, value = 'pH', 7.2
+        number = 200_000
+        eager = timeit.timeit(lambda: logger.debug(f"State updated: {name} = {value}"), number=number) / number
+        lazy = timeit.timeit(lambda: logger.debug("State updated: %s = %s", name, value), number=number) / number
+        print(f"disabled debug call: f-string {eager * 1e9:.0f} ns, lazy {lazy * 1e9:.0f} ns")
+        results.append(report("disabled debug calls skip formatting", lazy < eager,
+                              f"{eager / lazy:.1f}x cheaper"))
+        writer.stop()
+        
+        # Repeated messages
+        reset_root()
+        stream = io.StringIO()
+        writer = setup_logging(logging.DEBUG, None, stream=stream, repeat_window=0.5)
+        for _ in range(1000):
+            logger.debug("Maintenance ongoing, skipping request")
+        for pool in range(5):
+            logger.debug("State updated: %s = %s", f"Pool {pool} pH", 7.2)
+        time.sleep(0.6)
+        logger.debug("Maintenance ongoing, skipping request")
+        writer.stop()
+        lines = stream.getvalue().splitlines()
+        maintenance = [line for line in lines if 'Maintenance ongoing' in line]
+        results.append(report("repeated message rate limited", len(maintenance) == 2
+                              and maintenance[-1].endswith('(repeated 999 more times)'),
+                              f"1001 calls -> {len(maintenance)} lines"))
+        results.append(report("distinct messages not rate limited",
+                              sum(1 for line in lines if 'State updated' in line) == 5))
+        
+        # A writer that can't keep up drops records rather than blocking the loop
+        reset_root()
+        stream = SlowStream(0.01)
+        writer = setup_logging(logging.DEBUG, None, stream=stream, queue_size=10)
+        start = time.perf_counter()
+        for index in range(200):
+            logger.debug("State updated: %s = %s", f"Probe {index}", 7.2)
+        burst = time.perf_counter() - start
+        time.sleep(0.3)
+        logger.warning("Burst over")
+        writer.stop()
+        lines = stream.getvalue().splitlines()
+        dropped = [line for line in lines if 'records dropped' in line]
+        lost = 200 - sum(1 for line in lines if 'State updated' in line)
+        counted = sum(int(line.split(', ')[-1].split()[0]) for line in dropped)
+        results.append(report("full queue drops instead of blocking", burst < 0.1 and len(dropped) == 1
+                              and counted == lost,
+                              f"200 records in {burst * 1000:.1f} ms, {lost} lost, "
+                              f"{dropped[0].split(' - ')[-1] if dropped else 'no notice'}"))
+        
+        # Rotation keeps the log directory bounded
+        reset_root()
+        path = os.path.join(directory, 'rotated.log')
+        writer = setup_logging(logging.DEBUG, path, max_bytes=64 * 1024, backups=2, stream=io.StringIO(),
+                                 queue_size=50_000)
+        for index in range(20_000):
+            logger.debug("State updated: %s = %s", f"Probe {index}", 7.2)
+        writer.stop()
+        files = [name for name in os.listdir(directory) if name.startswith('rotated.log')]
+        total = sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        results.append(report("rotated log stays bounded", total <= 3 * 64 * 1024 and len(files) == 3,
+                              f"{len(files)} files, {total / 1024:.0f} KB for ~{20_000 * 80 / 1024:.0f} KB logged"))
+        reset_root()
+    
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=500, help='debug lines per cycle')
+    parser.add_argument('--write-delay', type=float, default=0.002, help='time per log write (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
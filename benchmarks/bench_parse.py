@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Pool details parsing benchmark
+Memory held per cached pool and parse time for the sample GetPoolDetails.php
+payload in fixtures/: the response body kept in the cache with probe dicts
+rebuilt on every read, vs. records (probes, outputs, setpoints) projected once
+at parse time, with the stdlib json decoder and orjson when installed.
+Exits non-zero on failure.
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from common import report
+from fake_klereo import SAMPLE_POOL_DETAILS
+import klereo_probes
+from klereo_probes import PoolDetails, parse_pool_details
+
+def legacy_extract_probes(pool_details: dict) -> list:
+    """Probe dicts as the client built them from the cached body on every read"""
+    return [{
+        'logicalId': probe.get('logicalId'),
+        'name': probe.get('name'),
+        'filteredValue': probe.get('filteredValue'),
+        'unit': probe.get('unit'),
+        'type': probe.get('type')
+    } for probe in pool_details.get('probes', ())]
+
+def payloads(count: int) -> list:
+    """One encoded response per pool, as read off the socket"""
+    with open(SAMPLE_POOL_DETAILS, 'rb') as f:
+        body = json.load(f)
+    result = []
+    for i in range(count):
+        body['response']['idSystem'] = 10000 + i
+        result.append(json.dumps(body, ensure_ascii=False).encode())
+    return result
+
+def retained(build) -> tuple:
+    """(bytes still allocated after build() returns, its result)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, value
+
+def per_call(function, items: list, repeat: int) -> float:
+    """Mean microseconds per call of function over items"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            function(item)
+    return (time.perf_counter() - start) / (repeat * len(items)) * 1e6
+
+def main(args) -> int:
+    raw = payloads(args.pools)
+    print(f"{args.pools} pools, sample payload {len(raw[0])} bytes, "
+          f"{len(json.loads(raw[0])['response']['probes'])} probes per pool")
+    
+    # What the cache holds per pool
+    legacy_bytes, legacy_cache = retained(lambda: [json.loads(data)['response'] for data in raw])
+    record_bytes, record_cache = retained(lambda: [parse_pool_details(klereo_probes.loads(data)['response'])
+                                                   for data in raw])
+    print(f"cached per pool   body={legacy_bytes / args.pools:8.0f} B  "
+          f"records={record_bytes / args.pools:8.0f} B  ({legacy_bytes / record_bytes:.0f}x less)")
+    
+    # Decode and project, once per fetch
+    decoders = [('json', json.loads)]
+    if klereo_probes.orjson is not None:
+        decoders.append(('orjson', klereo_probes.orjson.loads))
+    for name, decode in decoders:
+        decode_only = per_call(lambda data: decode(data)['response'], raw, args.repeat)
+        with_records = per_call(lambda data: parse_pool_details(decode(data)['response']), raw, args.repeat)
+        print(f"parse  {name:<7}   decode={decode_only:8.1f} us  decode+records={with_records:8.1f} us")
+    
+    # Every cycle's read of the cached pool
+    rebuild = per_call(legacy_extract_probes, legacy_cache, args.repeat * 10)
+    reuse = per_call(lambda details: list(details.probes), record_cache, args.repeat * 10)
+    print(f"get_pool_probes   rebuild dicts={rebuild:6.2f} us  records={reuse:6.2f} us")
+    print(f"add-on JSON backend: {klereo_probes.JSON_BACKEND}")
+    
+    same = all([record.to_dict() for record in details.probes] == legacy_extract_probes(body)
+               for details, body in zip(record_cache, legacy_cache))
+    first = record_cache[0].probes[0]
+    results = [
+        report("records match the legacy probe dicts", same),
+        report("records read like probe dicts",
+               first['name'] == first.name and first.get('unit', '') == first.unit
+               and first.get('statistics', False) is False),
+        report("records survive cache persistence",
+               PoolDetails.from_row(json.loads(json.dumps(record_cache[0].to_row()))) == record_cache[0]),
+        report("outputs and setpoints parsed",
+               len(record_cache[0].outputs) == len(legacy_cache[0].get('outs', ()))
+               and bool(record_cache[0].setpoints),
+               f"{len(record_cache[0].outputs)} outputs, {len(record_cache[0].setpoints)} setpoints"),
+        report("records hold less memory than the body", record_bytes < legacy_bytes,
+               f"{record_bytes / args.pools:.0f} B vs {legacy_bytes / args.pools:.0f} B per pool")
+    ]
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20, help='timing repetitions per pool')
+    sys.exit(main(parser.parse_args()))
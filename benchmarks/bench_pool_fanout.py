@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Pool detail fan-out benchmark
+Measures per-cycle wall-clock time of PoolDetailsFetcher for several concurrency caps
+"""
+
+import argparse
+import asyncio
+import logging
+
+from fake_klereo import FakeKlereoServer
+from klereo_async_api import AsyncKlereoAPI
+from klereo_fetcher import PoolDetailsFetcher
+
+async def run_cycle(server: FakeKlereoServer, concurrency: int, logger: logging.Logger) -> None:
+    """Fetch all pools once with a cold pool-details cache"""
+    api = AsyncKlereoAPI('bench', 'bench', logger=logger)
+    api.API_ROOT = server.api_root
+    try:
+        pools = await api.get_pools()
+        fetcher = PoolDetailsFetcher(api.get_pool_probes, max_concurrency=concurrency, logger=logger)
+        result = await fetcher.fetch_all(list(pools))
+        print(f"concurrency={concurrency:3d}  pools={result.succeeded}/{result.total}  "
+              f"cycle={result.duration * 1000:8.1f} ms")
+    finally:
+        await api.close()
+
+async def main(args) -> None:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.ERROR)
+    
+    with FakeKlereoServer(pool_count=args.pools, latency=args.latency) as server:
+        print(f"{args.pools} pools, {args.latency * 1000:.0f} ms upstream latency")
+        for concurrency in args.concurrency:
+            await run_cycle(server, concurrency, logger)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.1, help='upstream latency per request (s)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+State restore benchmark
+Publishes the states of every pool, then restarts the stub Home Assistant
+(its states are gone, as after a real restart) and measures how long the
+add-on takes to notice and republish all of them from its snapshot, over
+REST and the WebSocket transport. Verifies that every state comes back with
+its last value and that Klereo isn't called, and that with the WebSocket
+the add-on waits for the homeassistant_started event instead of polling.
+Exits non-zero on failure.
+    
+    python3 bench_restore.py --pools 20,100 --ha-latency 0.002
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from common import report
+from fake_klereo import FakeKlereoServer
+from stub_ha import StubHAServer
+from ha_integration import HomeAssistantIntegration
+from klereo_async_api import AsyncKlereoAPI
+
+def probe_states(ha_server: StubHAServer) -> dict:
+    """State per probe entity in the stub"""
+    return {entity_id: state['state'] for entity_id, state in list(ha_server.states.items())
+            if entity_id.startswith('sensor.klereo_') and 'api_' not in entity_id}
+
+async def watching(ha_server: StubHAServer, transport: str) -> None:
+    """Wait until the restart watch is subscribed to the started event, over the WebSocket"""
+    while transport == 'websocket' and not ha_server.requests['ws:subscribe_events']:
+        await asyncio.sleep(0.002)
+
+async def run(pools: int, transport: str, args, logger: logging.Logger) -> bool:
+    with FakeKlereoServer(pool_count=pools) as klereo, StubHAServer(latency=args.ha_latency) as ha_server:
+        api = AsyncKlereoAPI('bench', 'bench', logger=logger)
+        api.API_ROOT = klereo.api_root
+        ha = HomeAssistantIntegration(ha_server.url, 'token', api_client=api, logger=logger, transport=transport)
+        ha.RESTART_CHECK_INTERVAL = args.check_interval
+        try:
+            await ha.discover_and_register_pools()
+            await ha.update_all_sensors()
+            before = probe_states(ha_server)
+            
+            ha.start_restart_watch()
+            await watching(ha_server, transport)
+            klereo.requests.clear()
+            ha_server.restart()
+            start = time.perf_counter()
+            deadline = start + args.timeout
+            while len(probe_states(ha_server)) < len(before) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.002)
+            elapsed = time.perf_counter() - start
+            after = probe_states(ha_server)
+            # The diagnostic entities follow the probe states
+            while ha.last_restore is None and time.perf_counter() < deadline:
+                await asyncio.sleep(0.002)
+        finally:
+            await ha.cleanup()
+            await api.close()
+    
+    label = f"{pools * klereo.probes_per_pool} states, {transport}"
+    restore = ha.last_restore or {}
+    trigger = f"a {args.check_interval * 1000:.0f} ms check interval" if transport == 'rest' else "the reconnect"
+    print(f"{label:<24} back after {elapsed * 1000:7.1f} ms "
+          f"(restore {restore.get('duration', 0) * 1000:6.1f} ms after {trigger}, "
+          f"{ha.push_concurrency} pushes in flight)")
+    results = [
+        report(f"{label}: all restored with their values", after == before, f"{len(after)}/{len(before)}"),
+        report(f"{label}: within a second of the check", restore.get('duration', 1) < 1.0,
+               f"{restore.get('duration', 0) * 1000:.0f} ms"),
+        report(f"{label}: no Klereo request", not sum(klereo.requests.values()), str(dict(klereo.requests)))
+    ]
+    return all(results)
+
+async def idle_watch(transport: str, args, logger: logging.Logger) -> bool:
+    """Restart checks made while nothing happens; with the WebSocket, a restore on the started event"""
+    with FakeKlereoServer(pool_count=1) as klereo, StubHAServer(latency=args.ha_latency) as ha_server:
+        api = AsyncKlereoAPI('bench', 'bench', logger=logger)
+        api.API_ROOT = klereo.api_root
+        ha = HomeAssistantIntegration(ha_server.url, 'token', api_client=api, logger=logger, transport=transport)
+        ha.RESTART_CHECK_INTERVAL = args.check_interval
+        try:
+            await ha.discover_and_register_pools()
+            await ha.update_all_sensors()
+            before = probe_states(ha_server)
+            ha.start_restart_watch()
+            await watching(ha_server, transport)
+            
+            ha_server.requests.clear()
+            await asyncio.sleep(args.idle)
+            checks = ha_server.requests['get_states']
+            if transport == 'rest':
+                return report(f"{transport}: polls for restarts", checks > 0,
+                              f"{checks} checks in {args.idle:.1f} s")
+            
+            # States gone with the socket still up, then the event
+            ha_server.states.clear()
+            fired = ha_server.fire_event('homeassistant_started')
+            deadline = time.perf_counter() + args.timeout
+            while len(probe_states(ha_server)) < len(before) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.002)
+            return all([
+                report(f"{transport}: no polling while idle", checks == 0, f"{checks} checks in {args.idle:.1f} s"),
+                report(f"{transport}: restored on homeassistant_started",
+                       fired == 1 and probe_states(ha_server) == before,
+                       f"{len(probe_states(ha_server))}/{len(before)} states")
+            ])
+        finally:
+            await ha.cleanup()
+            await api.close()
+
+async def main(args) -> int:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.CRITICAL)
+    
+    results = []
+    for pools in args.pools:
+        for transport in ('rest', 'websocket'):
+            results.append(await run(pools, transport, args, logger))
+    for transport in ('rest', 'websocket'):
+        results.append(await idle_watch(transport, args, logger))
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pools', type=lambda value: [int(count) for count in value.split(',')], default=[20, 100],
+                        help='comma-separated pool counts')
+    parser.add_argument('--ha-latency', type=float, default=0.002, help='Home Assistant latency per call (s)')
+    parser.add_argument('--check-interval', type=float, default=0.1, help='restart check interval (s)')
+    parser.add_argument('--idle', type=float, default=0.5, help='idle time watched for restart checks (s)')
+    parser.add_argument('--timeout', type=float, default=10.0, help='give up waiting after (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark
+Time to the first and to all published states, for the sequential startup
+path and the streaming one (concurrent handshakes, per-pool publishing), each
+as a cold start and a warm start that reuses the persistent cache
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from fake_klereo import FakeKlereoServer
+from ha_integration import HomeAssistantIntegration
+from klereo_async_api import AsyncKlereoAPI
+from klereo_cache import CacheStore
+from stub_ha import StubHAServer
+
+async def start_once(label: str, klereo: FakeKlereoServer, ha_server: StubHAServer,
+                     cache_path: str, streaming: bool, logger: logging.Logger) -> None:
+    """Run the add-on startup sequence until all first states are published
+    
+    Sequential is the previous startup path: Klereo login, then the Home
+    Assistant connection test, then discovery of every pool, then a full
+    update. Streaming runs both handshakes concurrently and publishes each
+    pool as soon as its details arrive.
+    """
+    klereo.requests.clear()
+    ha_server.requests.clear()
+    
+    start = time.monotonic()
+    api = AsyncKlereoAPI('bench', 'bench', logger=logger,
+                         cache_store=CacheStore(cache_path, namespace='bench', logger=logger))
+    api.API_ROOT = klereo.api_root
+    ha = HomeAssistantIntegration(ha_server.url, 'token', api_client=api, logger=logger)
+    try:
+        if streaming:
+            await asyncio.gather(api.test_connection(), ha.test_ha_connection())
+            await ha.discover_and_register_pools(publish_states=True)
+        else:
+            await api.test_connection()
+            await ha.test_ha_connection()
+            await ha.discover_and_register_pools()
+            await ha.update_all_sensors()
+        elapsed = time.monotonic() - start
+        first = ha.first_push_at - start
+        api.save_cache()
+    finally:
+        await ha.cleanup()
+        await api.close()
+    
+    print(f"{label:<16} first state {first * 1000:8.1f} ms  all states {elapsed * 1000:8.1f} ms  "
+          f"klereo requests={sum(klereo.requests.values()):3d}  states pushed={ha_server.requests['states']}")
+
+async def main(args) -> None:
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.ERROR)
+    
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeKlereoServer(pool_count=args.pools, latency=args.latency) as klereo, \
+            StubHAServer(latency=args.ha_latency) as ha_server:
+        print(f"{args.pools} pools, {args.latency * 1000:.0f} ms upstream latency, "
+              f"{args.ha_latency * 1000:.0f} ms HA latency")
+        for streaming in (False, True):
+            mode = 'streaming' if streaming else 'sequential'
+            cache_path = os.path.join(tmp, f'klereo_cache_{mode}.json')
+            await start_once(f'{mode} cold', klereo, ha_server, cache_path, streaming, logger)
+            await start_once(f'{mode} warm', klereo, ha_server, cache_path, streaming, logger)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pools', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.3, help='upstream latency per request (s)')
+    parser.add_argument('--ha-latency', type=float, default=0.05, help='stub HA latency per request (s)')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Pool control check against a real broker
+Publishes switch and number commands like Home Assistant would and verifies,
+against the replayed fixtures/GetPoolDetails.json, that bursts of toggles
+coalesce into one SetOut.php call (or none when they end where they
+started), writes to one pool respect the rate limit while other pools don't
+wait, states are shown optimistically and not flipped back by a refresh that
+predates the write, and only the written pool is fetched again.
+Exits non-zero on failure.
+    
+    docker run --rm -p 1883:1883 eclipse-mosquitto:2 mosquitto -c /mosquitto-no-auth.conf
+    python3 check_controls.py
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+import aiomqtt
+
+from common import report
+from fake_klereo import SAMPLE_POOL_DETAILS, FakeKlereoServer
+from ha_mqtt import MQTTIntegration
+from klereo_async_api import AsyncKlereoAPI
+
+class StateWatcher:
+    """Records (time, payload) of every state message, like Home Assistant's view of the entities"""
+    
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.states = {}
+        self._ready = asyncio.Event()
+        self._task = None
+    
+    async def _watch(self) -> None:
+        async with aiomqtt.Client(self.host, self.port, identifier='klereo-check-watcher') as client:
+            await client.subscribe(f"{MQTTIntegration.BASE_TOPIC}/+/+/state")
+            self._ready.set()
+            async for message in client.messages:
+                self.states.setdefault(str(message.topic), []).append((time.monotonic(), message.payload.decode()))
+    
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._watch())
+        await self._ready.wait()
+    
+    async def stop(self) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+    
+    def payloads(self, pool_id: str, control: str, since: float = 0) -> list:
+        return [payload for at, payload in self.states.get(f"klereo/{pool_id}/{control}/state", []) if at >= since]
+    
+    def first(self, pool_id: str, control: str, payload: str, since: float) -> float:
+        """Time of the first message with payload after since, or None"""
+        for at, value in self.states.get(f"klereo/{pool_id}/{control}/state", []):
+            if at >= since and value == payload:
+                return at
+        return None
+
+async def settle(mqtt: MQTTIntegration, timeout: float = 30) -> None:
+    """Wait until the command queue sent everything and refreshed its pools"""
+    deadline = time.monotonic() + timeout
+    await asyncio.sleep(0.1)
+    while (mqtt.control.pending() or mqtt.control._workers) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+
+async def main(args) -> int:
+    logger = logging.getLogger('check')
+    logger.setLevel(logging.CRITICAL)
+    prefix = 'klereo-check-controls'
+    results = []
+    
+    with FakeKlereoServer(pool_count=args.pools, latency=args.latency, fixture=SAMPLE_POOL_DETAILS) as klereo:
+        api = AsyncKlereoAPI('check', 'check', logger=logger)
+        api.API_ROOT = klereo.api_root
+        mqtt = MQTTIntegration(args.host, api, mqtt_port=args.port, discovery_prefix=prefix,
+                               logger=logger, controls=True)
+        mqtt.control.min_interval = args.min_interval
+        watcher = StateWatcher(args.host, args.port)
+        await watcher.start()
+        try:
+            if not report("broker connection", await mqtt.test_ha_connection(), f"{args.host}:{args.port}"):
+                return 1
+            await mqtt.discover_and_register_pools(publish_states=True)
+            outputs = sum(1 for entity in mqtt.registered_entities.values() if entity.get('component') == 'switch')
+            numbers = sum(1 for entity in mqtt.registered_entities.values() if entity.get('component') == 'number')
+            results.append(report("switch and number entities registered", outputs and numbers,
+                                  f"{outputs} switches, {numbers} numbers for {args.pools} pools"))
+            
+            pool, other = klereo.pool_ids()[0], klereo.pool_ids()[1]
+            async with aiomqtt.Client(args.host, args.port, identifier='klereo-check-commands') as ha:
+                async def command(pool_id: str, control: str, *payloads: str) -> float:
+                    sent = time.monotonic()
+                    for payload in payloads:
+                        await ha.publish(f"klereo/{pool_id}/{control}/set", payload, qos=1)
+                    return sent
+                
+                # A burst of toggles ending ON: one write, one refresh of that pool only
+                klereo.requests.clear()
+                klereo.pool_requests.clear()
+                sent = await command(pool, 'out_0', *(['ON', 'OFF'] * args.toggles), 'ON')
+                await settle(mqtt)
+                writes = [c for c in klereo.commands if c[2] == 'SetOut.php']
+                results.append(report(f"{args.toggles * 2 + 1} toggles -> one SetOut call", len(writes) == 1,
+                                      f"{len(writes)} calls, newState={writes[-1][3]['newState'] if writes else '-'}"))
+                shown = watcher.first(pool, 'out_0', 'ON', sent)
+                results.append(report("new state shown", shown is not None,
+                                      f"{(shown - sent) * 1000:.0f} ms after the first command" if shown else ''))
+                results.append(report("only the written pool is refreshed",
+                                      dict(klereo.pool_requests) == {pool: 1} and not klereo.requests['GetIndex.php'],
+                                      f"details requests {dict(klereo.pool_requests)}"))
+                
+                # A burst ending where it started: no write at all
+                klereo.commands.clear()
+                await command(pool, 'out_2', *(['ON', 'OFF'] * args.toggles))
+                await settle(mqtt)
+                results.append(report("toggles back to the current state -> no call", not klereo.commands,
+                                      f"{len(klereo.commands)} calls"))
+                
+                # Per-pool rate limit: three outputs of one pool, one output of another
+                klereo.commands.clear()
+                await command(pool, 'out_4', 'ON')
+                await command(pool, 'out_6', 'ON')
+                await command(pool, 'out_8', 'ON')
+                await command(other, 'out_0', 'ON')
+                await settle(mqtt)
+                times = {}
+                for at, pool_id, _, form in klereo.commands:
+                    times.setdefault(pool_id, []).append(at)
+                gaps = [b - a for a, b in zip(times.get(pool, []), times.get(pool, [])[1:])]
+                results.append(report("writes to one pool spaced by the rate limit",
+                                       len(gaps) == 2 and min(gaps) >= args.min_interval * 0.95,
+                                       f"gaps {', '.join(f'{gap:.2f}' for gap in gaps)} s "
+                                       f"(limit {args.min_interval:.2f} s)"))
+                results.append(report("other pools don't wait",
+                                       times.get(other) and times[other][0] < times[pool][1],
+                                       f"{other} written {(times[other][0] - times[pool][0]) * 1000:.0f} ms "
+                                       f"after the first {pool} write" if times.get(other) else 'no write'))
+                
+                # A pool that executes the command later: the refresh still sees
+                # OFF, the entity must stay ON
+                klereo.commands.clear()
+                klereo.apply_delay = args.apply_delay
+                sent = await command(other, 'out_2', 'ON')
+                await settle(mqtt)
+                flipped = 'OFF' in watcher.payloads(other, 'out_2', since=sent)
+                results.append(report("optimistic state survives a stale refresh", not flipped,
+                                       ' -> '.join(watcher.payloads(other, 'out_2', since=sent))))
+                klereo.apply_delay = 0.0
+                
+                # Setpoints: in range written, out of range rejected
+                klereo.commands.clear()
+                await command(pool, 'param_pH_Setpoint', '7.4')
+                await command(pool, 'param_ORP_Setpoint', '5000')
+                await settle(mqtt)
+                params = [c[3] for c in klereo.commands if c[2] == 'SetParam.php']
+                results.append(report("setpoint written, out of range rejected",
+                                      [(p['paramID'], p['newValue']) for p in params] == [('pH_Setpoint', '7.4')],
+                                      f"{[(p['paramID'], p['newValue']) for p in params]}"))
+                results.append(report("setpoint state published", '7.4' in watcher.payloads(pool, 'param_pH_Setpoint'),
+                                      watcher.payloads(pool, 'param_pH_Setpoint')[-1:] and
+                                      watcher.payloads(pool, 'param_pH_Setpoint')[-1]))
+            
+            print(f"\nqueue stats: {mqtt.control.stats}")
+        finally:
+            # Clear the retained configs and states so the broker stays clean
+            for entity_id in list(mqtt.registered_entities):
+                await mqtt.unregister_entity(entity_id)
+            await mqtt.cleanup()
+            await api.close()
+            await watcher.stop()
+    
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--pools', type=int, default=3)
+    parser.add_argument('--toggles', type=int, default=5, help='ON/OFF pairs per burst')
+    parser.add_argument('--latency', type=float, default=0.05, help='upstream latency per request (s)')
+    parser.add_argument('--min-interval', type=float, default=0.5, help='per-pool rate limit for the check (s)')
+    parser.add_argument('--apply-delay', type=float, default=2.0,
+                        help='time the fake pool takes to execute a command in the optimistic check (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Health check verification
+Runs KlereoAddon's health check against the local fake servers and verifies
+that it costs no upstream request while the add-on is busy anyway (compared
+with the former connection tests), that an idle upstream gets one cheap
+probe, that an outage and the recovery show up on the connectivity entity
+and on /health, and that only a stalled add-on makes /health answer 503.
+Exits non-zero on failure.
+    
+    python3 check_health.py --pools 3
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import timeit
+
+import aiohttp
+
+from common import expire_pool_details, load_addon_class, report
+from fake_klereo import FakeKlereoServer
+from stub_ha import StubHAServer
+from klereo_async_api import AsyncKlereoAPI
+from klereo_health import UpstreamHealth
+from klereo_metrics import MetricsServer
+from klereo_resilience import RetryPolicy
+
+def upstream_requests(klereo: FakeKlereoServer, ha_server: StubHAServer) -> dict:
+    """Requests made to either side, leaving out the diagnostic state pushes"""
+    counts = {f"klereo:{endpoint}": count for endpoint, count in klereo.requests.items() if count}
+    counts.update({f"ha:{endpoint}": count for endpoint, count in ha_server.requests.items()
+                   if count and endpoint != 'states'})
+    return counts
+
+def clear(klereo: FakeKlereoServer, ha_server: StubHAServer) -> None:
+    klereo.requests.clear()
+    ha_server.requests.clear()
+
+async def get_health(session: aiohttp.ClientSession, url: str) -> tuple:
+    async with session.get(url) as response:
+        return response.status, await response.json()
+
+async def main(args) -> int:
+    logger = logging.getLogger('check')
+    logger.setLevel(logging.CRITICAL)
+    results = []
+    
+    # Cost of recording one outcome, paid by every request
+    tracker = UpstreamHealth()
+    number = 200_000
+    per_record = timeit.timeit(lambda: tracker.record(True), number=number) / number
+    per_snapshot = timeit.timeit(tracker.snapshot, number=1000) / 1000
+    results.append(report("outcome recording overhead", per_record < 5e-6,
+                           f"{per_record * 1e9:.0f} ns per request, snapshot {per_snapshot * 1e6:.0f} us"))
+    
+    with FakeKlereoServer(pool_count=args.pools) as klereo, StubHAServer() as ha_server:
+        AsyncKlereoAPI.API_ROOT = klereo.api_root
+        os.environ.update({
+            'KLEREO_USERNAME': 'check',
+            'KLEREO_PASSWORD': 'check',
+            'HOMEASSISTANT_URL': ha_server.url,
+            'HOMEASSISTANT_TOKEN': 'token',
+            'PERSISTENT_CACHE': 'false',
+            'HISTORY_SIZE': '0',
+            'METRICS': 'false'
+        })
+        
+        addon = load_addon_class('check')()
+        addon._stop_event = asyncio.Event()
+        server = MetricsServer(host='127.0.0.1', port=args.port, logger=logger, metrics=False)
+        server.add_route('GET', '/health', addon.health.handle_request)
+        await server.start()
+        url = f"http://127.0.0.1:{args.port}/health"
+        
+        try:
+            await addon._initialize_clients()
+            await addon._initial_discovery()
+            account = addon.api_client.accounts[0]
+            account.client.retry_policy = RetryPolicy(base_delay=0.01)
+            
+            async with aiohttp.ClientSession() as session:
+                # Former health check: connection tests right after a cycle
+                await addon._update_cycle(account)
+                clear(klereo, ha_server)
+                await account.client.test_connection()
+                await addon.ha_integration.test_ha_connection()
+                legacy = upstream_requests(klereo, ha_server)
+                
+                # Passive health check right after a cycle
+                await addon._update_cycle(account)
+                clear(klereo, ha_server)
+                healthy = await addon._health_check(account) and await addon._ha_health_check()
+                passive = upstream_requests(klereo, ha_server)
+                results.append(report("busy add-on: no health check requests", healthy and not passive,
+                                      f"{sum(passive.values())} requests (connection tests: "
+                                      f"{sum(legacy.values())} {legacy})"))
+                
+                # An idle upstream gets one cheap probe
+                for tracker in (account.client.health, addon.ha_integration.health):
+                    tracker.last_request -= addon.PROBE_AFTER_IDLE + 1
+                clear(klereo, ha_server)
+                healthy = await addon._health_check(account) and await addon._ha_health_check()
+                probed = upstream_requests(klereo, ha_server)
+                results.append(report("idle upstreams probed once each",
+                                      healthy and probed == {'klereo:GetIndex.php': 1, 'ha:config': 1},
+                                      str(probed)))
+                
+                status, health = await get_health(session, url)
+                results.append(report("/health healthy", status == 200 and health['status'] == 'healthy',
+                                      f"HTTP {status} {health['status']}"))
+                
+                # Klereo outage, seen from the cycle's own failed requests
+                klereo.fail_status = 503
+                expire_pool_details(addon)
+                start = time.perf_counter()
+                await addon._update_cycle(account)
+                outage = time.perf_counter() - start
+                connected = ha_server.states.get('binary_sensor.klereo_api_connected', {})
+                results.append(report("outage turns the connectivity entity off", connected.get('state') == 'off',
+                                      f"state {connected.get('state')}, last error "
+                                      f"{connected.get('attributes', {}).get('last_error')!r} "
+                                      f"after a {outage:.1f} s cycle"))
+                
+                status, health = await get_health(session, url)
+                results.append(report("/health degraded, not restarted",
+                                      status == 200 and health['status'] == 'degraded'
+                                      and not health['components']['klereo']['healthy'],
+                                      f"HTTP {status} {health['status']}"))
+                
+                # Recovery on the next cycle
+                klereo.fail_status = None
+                await addon._update_cycle(account)
+                connected = ha_server.states.get('binary_sensor.klereo_api_connected', {})
+                status, health = await get_health(session, url)
+                results.append(report("recovery turns it back on", connected.get('state') == 'on'
+                                      and health['status'] == 'healthy',
+                                      f"state {connected.get('state')}, /health {health['status']}"))
+                
+                # A job that never finishes gets the add-on restarted
+                addon.health.stall_timeout = 0.2
+                with addon.health.busy('update_cycle'):
+                    status, health = await get_health(session, url)
+                    busy_ok = status == 200
+                    await asyncio.sleep(0.3)
+                    status, health = await get_health(session, url)
+                results.append(report("stalled cycle answers 503", busy_ok and status == 503
+                                      and health['busy']['job'] == 'update_cycle',
+                                      f"HTTP {status} {health['status']} ({health['busy']})"))
+                status, health = await get_health(session, url)
+                results.append(report("finished cycle answers 200 again", status == 200, f"HTTP {status}"))
+        finally:
+            await server.stop()
+            await addon._cleanup()
+    
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pools', type=int, default=3)
+    parser.add_argument('--port', type=int, default=18081, help='port for the /health endpoint')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+MQTT output backend check against a real broker
+Runs discovery and update cycles through MQTTIntegration, verifies the
+retained discovery configs and state messages seen by a subscriber, and
+compares the push time with the REST backend against the stub HA server.
+Exits non-zero on failure.
+    
+    docker run --rm -p 1883:1883 eclipse-mosquitto:2 mosquitto -c /mosquitto-no-auth.conf
+    python3 check_mqtt.py --pools 20
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+import aiomqtt
+
+from common import report
+from fake_klereo import FakeKlereoServer
+from ha_integration import HomeAssistantIntegration
+from ha_mqtt import MQTTIntegration
+from klereo_async_api import AsyncKlereoAPI
+from stub_ha import StubHAServer
+
+async def collect(host: str, port: int, prefix: str, duration: float) -> dict:
+    """Retained messages a fresh subscriber receives within duration seconds"""
+    messages = {}
+    async with aiomqtt.Client(host, port, identifier='klereo-check-retained') as client:
+        await client.subscribe(f"{prefix}/sensor/#")
+        await client.subscribe(f"{prefix}/binary_sensor/#")
+        await client.subscribe(f"{MQTTIntegration.BASE_TOPIC}/#")
+        try:
+            async with asyncio.timeout(duration):
+                async for message in client.messages:
+                    if message.retain:
+                        messages[str(message.topic)] = message.payload.decode()
+        except TimeoutError:
+            pass
+    return messages
+
+async def push_cycles(integration: HomeAssistantIntegration, cycles: int) -> float:
+    """Discover, then run update cycles; returns the mean push duration"""
+    await integration.discover_and_register_pools()
+    durations = []
+    for _ in range(cycles):
+        await integration.update_all_sensors()
+        durations.append(integration.last_push_duration)
+    return sum(durations) / len(durations)
+
+async def main(args) -> int:
+    logger = logging.getLogger('check')
+    logger.setLevel(logging.CRITICAL)
+    prefix = f"klereo-check-{args.pools}"
+    results = []
+    
+    with FakeKlereoServer(pool_count=args.pools) as klereo, StubHAServer(latency=args.ha_latency) as ha:
+        entities = args.pools * klereo.probes_per_pool
+        
+        api = AsyncKlereoAPI('check', 'check', logger=logger)
+        api.API_ROOT = klereo.api_root
+        mqtt = MQTTIntegration(args.host, api, mqtt_port=args.port, discovery_prefix=prefix,
+                               logger=logger, state_heartbeat=0)
+        rest = HomeAssistantIntegration(ha.url, 'token', api, logger=logger, state_heartbeat=0)
+        try:
+            if not report("broker connection", await mqtt.test_ha_connection(), f"{args.host}:{args.port}"):
+                return 1
+            mqtt_push = await push_cycles(mqtt, args.cycles)
+            await mqtt.update_diagnostic_states()
+            rest_push = await push_cycles(rest, args.cycles)
+        finally:
+            await mqtt.cleanup()
+            await rest.cleanup()
+            await api.close()
+    
+    retained = await collect(args.host, args.port, prefix, args.wait)
+    configs = [topic for topic in retained if topic.startswith(f"{prefix}/") and topic.endswith('/config')]
+    states = [topic for topic in retained if topic.endswith('/state') and '/diagnostics/' not in topic]
+    
+    results.append(report("retained discovery configs", len(configs) == entities + 2,
+                          f"{len(configs)} (expected {entities} probes + 2 diagnostics)"))
+    results.append(report("retained state messages", len(states) >= entities, f"{len(states)}"))
+    results.append(report("availability after shutdown", retained.get(mqtt.availability_topic) == 'offline',
+                          retained.get(mqtt.availability_topic, 'missing')))
+    
+    print(f"\n{entities} entities, mean push per cycle: mqtt={mqtt_push * 1000:.1f} ms  "
+          f"rest={rest_push * 1000:.1f} ms ({args.ha_latency * 1000:.0f} ms HA latency)")
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--pools', type=int, default=20)
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--ha-latency', type=float, default=0.005, help='stub HA latency per request (s)')
+    parser.add_argument('--wait', type=float, default=1.0, help='time to collect retained messages (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
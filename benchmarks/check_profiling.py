@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Profiling hooks check
+Measures what the always-on instrumentation costs (spans, slow callback
+detector) and verifies that a real update cycle records its spans, that a
+blocking task step is reported by name, and that an on-demand profile taken
+over HTTP finds the hot function and is written with its folded stacks (and
+is refused to other hosts).
+Exits non-zero on failure.
+    
+    python3 check_profiling.py --pools 20
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp.test_utils import make_mocked_request
+from unittest import mock
+
+from common import report
+from fake_klereo import SAMPLE_POOL_DETAILS, FakeKlereoServer
+from stub_ha import StubHAServer
+from ha_integration import HomeAssistantIntegration
+from klereo_async_api import AsyncKlereoAPI
+from klereo_metrics import MetricsServer
+from klereo_profiling import SPANS, SamplingProfiler, SlowCallbackDetector, span
+
+def span_overhead(iterations: int) -> float:
+    """Seconds added per span"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    empty = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with span('check_overhead'):
+            pass
+    return (time.perf_counter() - start - empty) / iterations
+
+async def callback_overhead(detector: SlowCallbackDetector, steps: int) -> float:
+    """Seconds the detector adds per event loop callback"""
+    async def steps_task() -> None:
+        for _ in range(steps):
+            await asyncio.sleep(0)
+    
+    timings = []
+    for installed in (False, True, False, True):
+        if installed:
+            detector.install()
+        start = time.perf_counter()
+        await steps_task()
+        timings.append((installed, time.perf_counter() - start))
+        detector.uninstall()
+    
+    plain = min(elapsed for installed, elapsed in timings if not installed)
+    timed = min(elapsed for installed, elapsed in timings if installed)
+    return (timed - plain) / steps
+
+def hot_function(seconds: float) -> int:
+    """Burns CPU in the event loop thread"""
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(200))
+    return total
+
+async def busy_loop(stop: asyncio.Event) -> None:
+    """Keeps the loop about half busy, yielding between bursts"""
+    while not stop.is_set():
+        hot_function(0.01)
+        await asyncio.sleep(0.01)
+
+async def main(args) -> int:
+    logger = logging.getLogger('check')
+    logger.setLevel(logging.CRITICAL)
+    results = []
+    
+    overhead = span_overhead(200_000)
+    results.append(report("span overhead", overhead < 20e-6, f"{overhead * 1e9:.0f} ns per span"))
+    
+    detector = SlowCallbackDetector(threshold=0.05, logger=logger)
+    per_callback = await callback_overhead(detector, 50_000)
+    results.append(report("slow callback detector overhead", per_callback < 20e-6,
+                          f"{max(per_callback, 0) * 1e9:.0f} ns per callback"))
+    
+    # A real update cycle records its spans
+    SPANS.clear()
+    with FakeKlereoServer(pool_count=args.pools, latency=args.latency, fixture=SAMPLE_POOL_DETAILS) as klereo, \
+            StubHAServer() as ha_server:
+        api = AsyncKlereoAPI('check', 'check', logger=logger)
+        api.API_ROOT = klereo.api_root
+        ha = HomeAssistantIntegration(ha_server.url, 'token', api_client=api, logger=logger)
+        try:
+            await ha.discover_and_register_pools()
+            await ha.update_all_sensors()
+        finally:
+            await ha.cleanup()
+            await api.close()
+    spans = SPANS.summary()
+    expected = ('klereo_request', 'ha_request', 'cache_get', 'cycle_get_pools', 'cycle_fetch',
+                'cycle_discovery', 'cycle_history', 'cycle_push', 'cycle_controls')
+    missing = [name for name in expected if name not in spans]
+    results.append(report("update cycle records its spans", not missing,
+                          f"missing {missing}" if missing else
+                          f"klereo_request x{spans['klereo_request']['count']}, "
+                          f"ha_request x{spans['ha_request']['count']}, "
+                          f"cycle_push {spans['cycle_push']['total'] * 1000:.0f} ms"))
+    
+    # A task step that blocks is reported with the task's name
+    detector.install()
+    try:
+        async def blocking_step() -> None:
+            await asyncio.sleep(0)
+            time.sleep(0.12)
+            await asyncio.sleep(0)
+        
+        async def fast_steps() -> None:
+            for _ in range(1000):
+                await asyncio.sleep(0)
+        
+        await asyncio.gather(asyncio.create_task(blocking_step(), name='blocker'), fast_steps())
+    finally:
+        detector.uninstall()
+    recent = list(detector.recent)
+    results.append(report("blocking task step reported", len(recent) == 1 and 'blocker' in recent[0][2]
+                          and 'blocking_step' in recent[0][2],
+                          f"{recent[0][1] * 1000:.0f} ms by {recent[0][2]}" if recent else 'nothing reported'))
+    
+    # On-demand profile over HTTP while the loop is busy
+    with tempfile.TemporaryDirectory() as directory:
+        profiler = SamplingProfiler(directory=directory, keep=2, detector=detector,
+                                    status=lambda: {'check': True}, logger=logger)
+        server = MetricsServer(host='127.0.0.1', port=args.port, logger=logger)
+        server.add_route('POST', '/profile', profiler.handle_request)
+        await server.start()
+        stop = asyncio.Event()
+        busy = asyncio.create_task(busy_loop(stop))
+        try:
+            async with aiohttp.ClientSession() as session:
+                url = f"http://127.0.0.1:{args.port}/profile"
+                first = asyncio.create_task(session.post(url, params={'seconds': str(args.seconds)}))
+                await asyncio.sleep(0.2)
+                async with await session.post(url) as response:
+                    results.append(report("concurrent profile request refused", response.status == 409,
+                                          f"HTTP {response.status}"))
+                async with await first as response:
+                    status, profile = response.status, await response.json()
+        finally:
+            stop.set()
+            await busy
+            await server.stop()
+        
+        transport = mock.Mock()
+        transport.get_extra_info.return_value = ('192.168.1.20', 50000)
+        remote = await profiler.handle_request(make_mocked_request('POST', '/profile', transport=transport))
+        results.append(report("request from the LAN refused", remote.status == 403, f"HTTP {remote.status}"))
+        
+        ok = status == 200 and profile['report'] and os.path.exists(profile['report'])
+        results.append(report("profile written", ok,
+                              f"{profile.get('samples')} samples, loop busy {profile.get('busy', 0):.0%}"))
+        if ok:
+            with open(profile['report']) as f:
+                text = f.read()
+            own = text.split('== Functions by own samples ==\n', 1)[1].split('\n\n', 1)[0].splitlines()
+            hot = [line.strip() for line in own[:3] if 'hot_function' in line]
+            results.append(report("hot function among the top 3", bool(hot), hot[0] if hot else own[:3]))
+            with open(profile['folded']) as f:
+                folded = f.readline()
+            results.append(report("folded stacks written", folded.rsplit(' ', 1)[-1].strip().isdigit(),
+                                  f"{os.path.getsize(profile['folded'])} bytes"))
+            results.append(report("report has spans, tasks and status",
+                                  'klereo_request' in text and 'busy_loop' in text and '"check": true' in text))
+            
+            for _ in range(2):
+                await asyncio.sleep(1.1)  # profiles are named by the second
+                await profiler.profile(0.05)
+            kept = sorted(name for name in os.listdir(directory) if name.endswith('.txt'))
+            results.append(report("old profiles pruned", len(kept) == 2 and profile['report'] not in
+                                  [os.path.join(directory, name) for name in kept], f"{len(kept)} kept"))
+    
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pools', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='upstream latency per request (s)')
+    parser.add_argument('--seconds', type=float, default=1.0, help='profile duration (s)')
+    parser.add_argument('--port', type=int, default=18080, help='port for the /profile endpoint')
+    sys.exit(asyncio.run(main(parser.parse_args())))
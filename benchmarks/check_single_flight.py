@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Single-flight coalescing check
+Fires N concurrent callers at a counting fake server and verifies each cache
+key costs exactly one upstream request. Exits non-zero on failure.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from common import report
+from fake_klereo import FakeKlereoServer
+from klereo_async_api import AsyncKlereoAPI
+
+def expect(label: str, server: FakeKlereoServer, expected: dict) -> bool:
+    """Compare upstream request counts with the expected ones"""
+    actual = {endpoint: server.requests[endpoint] for endpoint in expected}
+    return report(label, actual == expected, f"upstream={actual}")
+
+async def check_async(server: FakeKlereoServer, callers: int, logger: logging.Logger) -> bool:
+    """Concurrent callers of the asyncio client"""
+    results = []
+    api = AsyncKlereoAPI('check', 'check', logger=logger)
+    api.API_ROOT = server.api_root
+    try:
+        server.requests.clear()
+        tokens = await asyncio.gather(*(api.get_jwt_token() for _ in range(callers)))
+        results.append(expect(f"{callers} x get_jwt_token", server, {'GetJWT.php': 1}))
+        results.append(len(set(tokens)) == 1 and tokens[0] is not None)
+        
+        server.requests.clear()
+        await asyncio.gather(*(api.get_index() for _ in range(callers)))
+        results.append(expect(f"{callers} x get_index (token cached)", server,
+                              {'GetJWT.php': 0, 'GetIndex.php': 1}))
+        
+        pool_id = server.pool_ids()[0]
+        server.requests.clear()
+        await asyncio.gather(*(api.get_pool_details(pool_id) for _ in range(callers)))
+        results.append(expect(f"{callers} x get_pool_details({pool_id})", server,
+                              {'GetPoolDetails.php': 1}))
+        
+        # Cold client: every caller needs token, index and details at once
+        api.clear_cache()
+        server.requests.clear()
+        await asyncio.gather(*(api.get_pool_probes(pool_id) for _ in range(callers)),
+                             *(api.get_pools() for _ in range(callers)))
+        results.append(expect(f"{callers} x get_pool_probes + get_pools (cold)", server,
+                              {'GetJWT.php': 1, 'GetIndex.php': 1, 'GetPoolDetails.php': 1}))
+    finally:
+        await api.close()
+    return all(results)
+
+async def check_sync(server: FakeKlereoServer, callers: int, logger: logging.Logger) -> bool:
+    """Concurrent worker threads sharing the blocking client"""
+    try:
+        from klereo_api import KlereoAPI
+    except ImportError:
+        print("SKIP  blocking client (requests not installed)")
+        return True
+    
+    api = KlereoAPI('check', 'check', logger=logger)
+    api.API_ROOT = server.api_root
+    server.requests.clear()
+    pool_id = server.pool_ids()[0]
+    await asyncio.gather(*(asyncio.to_thread(api.get_pool_details, pool_id) for _ in range(callers)))
+    return expect(f"{callers} threads x KlereoAPI.get_pool_details", server,
+                  {'GetJWT.php': 1, 'GetPoolDetails.php': 1})
+
+async def main(args) -> int:
+    logger = logging.getLogger('check')
+    logger.setLevel(logging.CRITICAL)
+    
+    with FakeKlereoServer(latency=args.latency) as server:
+        ok = await check_async(server, args.callers, logger)
+        ok = await check_sync(server, min(args.callers, 16), logger) and ok
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--callers', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.1, help='upstream latency per request (s)')
+    sys.exit(asyncio.run(main(parser.parse_args())))
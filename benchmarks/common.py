@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the benchmark and check scripts
+PASS/FAIL reporting, loading KlereoAddon from the add-on's entry point script
+and expiring its cached pool details
+"""
+
+import importlib.machinery
+import importlib.util
+import logging
+import os
+
+from fake_klereo import ADDON_BIN
+
+def report(label: str, ok: bool, detail: str = '') -> bool:
+    """Print one PASS/FAIL line and return ok"""
+    print(f"{'PASS' if ok else 'FAIL'}  {label:<48} {detail}")
+    return ok
+
+def load_addon_class(logger_name: str = 'bench') -> type:
+    """KlereoAddon from the add-on's entry point script, logging to logger_name instead of /var/log"""
+    path = os.path.join(os.path.abspath(ADDON_BIN), 'klereo')
+    loader = importlib.machinery.SourceFileLoader('klereo_addon', path)
+    spec = importlib.util.spec_from_loader('klereo_addon', loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    
+    class LocalAddon(module.KlereoAddon):
+        """Add-on logging to a local logger"""
+        
+        def _setup_logging(self):
+            self.logger = logging.getLogger(logger_name)
+    
+    return LocalAddon
+
+def expire_pool_details(addon) -> None:
+    """Drop cached pool details so the next cycle fetches every pool upstream"""
+    for account in addon.api_client.accounts:
+        for pool_id in account.pool_ids:
+            account.client.cache.delete(f'pool_details_{pool_id}')
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Local fake Klereo Connect server for benchmarks
+Emulates GetJWT.php, GetIndex.php, GetPoolDetails.php and the SetOut.php and
+SetParam.php writes, optionally replaying a recorded pool details fixture,
+with injectable latency and errors
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web
+
+# Make the add-on modules importable (mirrors sys.path setup in /usr/bin/klereo)
+ADDON_BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'klereo', 'rootfs', 'usr', 'bin')
+sys.path.insert(0, os.path.abspath(ADDON_BIN))
+
+# Recorded responses to replay
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SAMPLE_POOL_DETAILS = os.path.join(FIXTURES, 'GetPoolDetails.json')
+
+PROBE_TEMPLATES = [
+    {'name': 'pH', 'unit': 'pH', 'type': 'ph', 'filteredValue': 7.2},
+    {'name': 'Water Temperature', 'unit': '°C', 'type': 'temperature', 'filteredValue': 26.4},
+    {'name': 'Chlorine', 'unit': 'mg/L', 'type': 'chlorine', 'filteredValue': 1.1},
+    {'name': 'ORP', 'unit': 'mV', 'type': 'orp', 'filteredValue': 690},
+    {'name': 'Water Level', 'unit': 'cm', 'type': 'level', 'filteredValue': 12},
+]
+
+class FakeKlereoServer:
+    """Fake Klereo API served from a background thread"""
+    
+    def __init__(self, pool_count: int = 3, probes_per_pool: int = 5, latency: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0, account_pools: Optional[Dict[str, List[str]]] = None,
+                 fixture: Optional[str] = None, seed: int = 0):
+        """Initialize fake server
+        
+        account_pools maps a login to the pool ids its index lists; other
+        logins see pool_ids(). fixture is a recorded GetPoolDetails.php
+        response (e.g. SAMPLE_POOL_DETAILS) replayed for every pool instead
+        of synthesized probes; probes_per_pool then doesn't apply. seed makes
+        injected errors and jitter reproducible.
+        """
+        self.pool_count = pool_count
+        self.account_pools = account_pools or {}
+        
+        # Pool nicknames overriding the default "Pool <id>"
+        self.pool_names: Dict[str, str] = {}
+        self.probes_per_pool = probes_per_pool
+        self.latency = latency
+        self.host = host
+        self.port = port
+        
+        # Replayed pool details, encoded once per pool and generation
+        self.fixture: Optional[Dict] = None
+        if fixture:
+            with open(fixture, 'rb') as f:
+                self.fixture = json.load(f)
+        self._replayed: Dict[str, bytes] = {}
+        
+        # Probe values change with every advance()
+        self.generation = 0
+        
+        # Writes: (monotonic time, pool_id, endpoint, form) in arrival order,
+        # and the output states and params they changed per pool. Pool
+        # details only reflect a write after apply_delay seconds, like a pool
+        # that takes a while to execute a command. Only replayed fixtures
+        # reflect writes.
+        self.commands: List[tuple] = []
+        self.outputs: Dict[str, Dict[int, int]] = {}
+        self.params: Dict[str, Dict[str, float]] = {}
+        self.apply_delay = 0.0
+        
+        # Injected faults. When fail_status is set, every request is answered
+        # with it. Otherwise a share error_rate of the requests to
+        # fault_endpoints (all endpoints when empty) gets error_status, and a
+        # share api_error_rate gets a Klereo API error body. Latency varies
+        # by up to jitter seconds.
+        self.fail_status: Optional[int] = None
+        self.error_rate = 0.0
+        self.error_status = 503
+        self.api_error_rate = 0.0
+        self.fault_endpoints: Set[str] = set()
+        self.jitter = 0.0
+        self.faults = Counter()
+        self._random = random.Random(seed)
+        
+        # Per-endpoint and per-pool details request counters, client
+        # connections seen, login times and the most requests handled at once
+        self.requests = Counter()
+        self.pool_requests = Counter()
+        self.connections = set()
+        self.login_times: List[float] = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+    
+    @property
+    def api_root(self) -> str:
+        """Base URL to assign to KlereoAPI.API_ROOT"""
+        return f"http://{self.host}:{self.port}/php/"
+    
+    def pool_ids(self) -> List[str]:
+        """Return the fake idSystem values"""
+        return [str(10000 + i) for i in range(self.pool_count)]
+    
+    def advance(self) -> None:
+        """Move every probe value far enough for the add-on to push it again"""
+        self.generation += 1
+        self._replayed.clear()
+    
+    def _value(self, value: Any) -> Any:
+        """Probe value for the current generation; odd ones exceed every deadband"""
+        if self.generation % 2 and isinstance(value, (int, float)):
+            return round(value * 1.1 + 1, 2)
+        return value
+    
+    def _pool_details(self, pool_id: str) -> Dict:
+        """Build a GetPoolDetails.php response payload"""
+        probes = []
+        for i in range(self.probes_per_pool):
+            template = PROBE_TEMPLATES[i % len(PROBE_TEMPLATES)]
+            probe = dict(template)
+            probe['logicalId'] = i
+            probe['filteredValue'] = self._value(template['filteredValue'])
+            if i >= len(PROBE_TEMPLATES):
+                probe['name'] = f"{template['name']} {i}"
+            probes.append(probe)
+        return {'idSystem': pool_id, 'probes': probes}
+    
+    def _replay(self, pool_id: str) -> bytes:
+        """The fixture response body for a pool, with the writes applied to it"""
+        body = self._replayed.get(pool_id)
+        if body is None:
+            details = self.fixture['response']
+            probes = [dict(probe, filteredValue=self._value(probe.get('filteredValue')))
+                      for probe in details.get('probes', ())]
+            outputs = self.outputs.get(pool_id, {})
+            outs = [dict(out, mode=0, status=outputs[out['index']]) if out.get('index') in outputs else out
+                    for out in details.get('outs', ())]
+            params = {**details.get('params', {}), **self.params.get(pool_id, {})}
+            response = {**self.fixture, 'response': {**details, 'idSystem': pool_id, 'probes': probes,
+                                                     'outs': outs, 'params': params}}
+            body = self._replayed[pool_id] = json.dumps(response, ensure_ascii=False).encode()
+        return body
+    
+    @web.middleware
+    async def _inject(self, request: web.Request, handler) -> web.Response:
+        """Count requests and apply injected latency and failures"""
+        endpoint = request.path.rsplit('/', 1)[-1]
+        self.requests[endpoint] += 1
+        self.connections.add(request.transport.get_extra_info('peername'))
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                await asyncio.sleep(delay)
+            if self.fail_status:
+                return web.Response(status=self.fail_status, text='Injected failure')
+            if not self.fault_endpoints or endpoint in self.fault_endpoints:
+                roll = self._random.random()
+                if roll < self.error_rate:
+                    self.faults['http_error'] += 1
+                    return web.Response(status=self.error_status, text='Injected failure')
+                if roll < self.error_rate + self.api_error_rate:
+                    self.faults['api_error'] += 1
+                    return web.json_response({'error': 'injected', 'detail': 'Injected API error'})
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+    
+    async def _get_jwt(self, request: web.Request) -> web.Response:
+        """Handle GetJWT.php; the token names the login so the index can depend on it"""
+        form = await request.post()
+        self.login_times.append(time.monotonic())
+        return web.json_response({'jwt': f"fake-jwt-token:{form.get('login', '')}"})
+    
+    async def _get_index(self, request: web.Request) -> web.Response:
+        """Handle GetIndex.php"""
+        login = request.headers.get('Authorization', '').partition(':')[2]
+        pool_ids = self.account_pools.get(login, self.pool_ids())
+        index = [{'idSystem': pool_id, 'poolNickname': self.pool_names.get(pool_id, f"Pool {pool_id}")}
+                 for pool_id in pool_ids]
+        return web.json_response({'response': index})
+    
+    async def _get_pool_details(self, request: web.Request) -> web.Response:
+        """Handle GetPoolDetails.php"""
+        form = await request.post()
+        pool_id = form.get('idSystem', '')
+        self.pool_requests[pool_id] += 1
+        if self.fixture is not None:
+            return web.Response(body=self._replay(pool_id), content_type='application/json')
+        return web.json_response({'response': self._pool_details(pool_id)})
+    
+    async def _command(self, request: web.Request) -> web.Response:
+        """Handle SetOut.php and SetParam.php"""
+        form = await request.post()
+        endpoint = request.path.rsplit('/', 1)[-1]
+        pool_id = form.get('poolID', '')
+        self.commands.append((time.monotonic(), pool_id, endpoint, dict(form)))
+        
+        def apply() -> None:
+            if endpoint == 'SetOut.php':
+                self.outputs.setdefault(pool_id, {})[int(form['outIdx'])] = int(form['newState'])
+            else:
+                self.params.setdefault(pool_id, {})[form['paramID']] = float(form['newValue'])
+            self._replayed.pop(pool_id, None)
+        
+        if self.apply_delay:
+            asyncio.get_running_loop().call_later(self.apply_delay, apply)
+        else:
+            apply()
+        return web.json_response({'status': 'ok', 'response': [{'cmdID': len(self.commands)}]})
+    
+    def _serve(self) -> None:
+        """Thread target running the aiohttp application"""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        
+        app = web.Application(middlewares=[self._inject])
+        app.router.add_post('/php/GetJWT.php', self._get_jwt)
+        app.router.add_get('/php/GetIndex.php', self._get_index)
+        app.router.add_post('/php/GetPoolDetails.php', self._get_pool_details)
+        app.router.add_post('/php/SetOut.php', self._command)
+        app.router.add_post('/php/SetParam.php', self._command)
+        
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+    
+    def start(self) -> 'FakeKlereoServer':
+        """Start serving in a background thread"""
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+    
+    def stop(self) -> None:
+        """Stop the server thread"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join()
+    
+    def __enter__(self) -> 'FakeKlereoServer':
+        return self.start()
+    
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Local stub of the Home Assistant Core REST and WebSocket APIs for benchmarks
+Accepts /api/config, /api/states/<entity_id> (GET, POST, DELETE), registry calls and /api/websocket
+commands and event subscriptions with injectable latency
+"""
+
+import asyncio
+import json
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from aiohttp import WSMsgType, web
+
+# WebSocket commands answered by the stub, as Home Assistant Core names them
+WS_COMMANDS = ('get_config', 'recorder/import_statistics', 'subscribe_events')
+
+class StubHAServer:
+    """Stub Home Assistant API served from a background thread"""
+    
+    def __init__(self, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0,
+                 ws_commands: Iterable[str] = WS_COMMANDS, token: Optional[str] = None):
+        """Initialize stub server
+        
+        ws_commands limits the WebSocket commands understood, e.g. () for a
+        Home Assistant answering every command with unknown_command. token,
+        if set, is required to authenticate.
+        """
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.ws_commands = set(ws_commands)
+        self.token = token
+        
+        # Request counters and last state per entity
+        self.requests = Counter()
+        self.states: Dict[str, Dict] = {}
+        self.statistics: Dict[str, Dict[str, Dict]] = {}
+        self._websockets = set()
+        
+        # Event subscriptions per connection, as (subscription id, event type)
+        self._subscriptions: Dict[web.WebSocketResponse, list] = {}
+        
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+    
+    @property
+    def url(self) -> str:
+        """Base URL to pass as ha_url"""
+        return f"http://{self.host}:{self.port}"
+    
+    async def _delay(self) -> None:
+        """Apply injected latency"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+    
+    async def _config(self, request: web.Request) -> web.Response:
+        """Handle GET /api/config"""
+        self.requests['config'] += 1
+        await self._delay()
+        return web.json_response({'version': 'stub', 'state': 'RUNNING'})
+    
+    async def _state(self, request: web.Request) -> web.Response:
+        """Handle POST /api/states/<entity_id>"""
+        self.requests['states'] += 1
+        await self._delay()
+        body = await request.json()
+        self.states[request.match_info['entity_id']] = body
+        return web.json_response(body)
+    
+    async def _get_state(self, request: web.Request) -> web.Response:
+        """Handle GET /api/states/<entity_id>"""
+        self.requests['get_states'] += 1
+        await self._delay()
+        state = self.states.get(request.match_info['entity_id'])
+        if state is None:
+            return web.json_response({'message': 'Entity not found.'}, status=404)
+        return web.json_response(state)
+    
+    async def _delete_state(self, request: web.Request) -> web.Response:
+        """Handle DELETE /api/states/<entity_id>"""
+        self.requests['delete_states'] += 1
+        await self._delay()
+        if self.states.pop(request.match_info['entity_id'], None) is None:
+            return web.json_response({'message': 'Entity not found.'}, status=404)
+        return web.json_response({'message': 'Entity removed.'})
+    
+    async def _registry(self, request: web.Request) -> web.Response:
+        """Handle device_registry / entity_registry posts"""
+        self.requests[request.match_info['registry']] += 1
+        await self._delay()
+        return web.json_response({'success': True})
+    
+    async def _ws_command(self, ws: web.WebSocketResponse, message: Dict) -> None:
+        """Answer one WebSocket command after the injected latency"""
+        command = message.get('type')
+        self.requests[f"ws:{command}"] += 1
+        await self._delay()
+        
+        reply = {'id': message.get('id'), 'type': 'result', 'success': True, 'result': None}
+        if command not in self.ws_commands:
+            reply.update(success=False, error={'code': 'unknown_command', 'message': 'Unknown command.'})
+        elif command == 'get_config':
+            reply['result'] = {'version': 'stub', 'state': 'RUNNING'}
+        elif command == 'recorder/import_statistics':
+            imported = self.statistics.setdefault(message['metadata']['statistic_id'], {})
+            imported.update({row['start']: row for row in message['stats']})
+        elif command == 'subscribe_events':
+            self._subscriptions.setdefault(ws, []).append((message.get('id'), message.get('event_type')))
+        
+        if not ws.closed:
+            await ws.send_json(reply)
+    
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        """Handle /api/websocket: auth handshake, then concurrent commands"""
+        self.requests['websocket'] += 1
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        
+        await ws.send_json({'type': 'auth_required', 'ha_version': 'stub'})
+        auth = await ws.receive_json()
+        if auth.get('type') != 'auth' or (self.token is not None and auth.get('access_token') != self.token):
+            await ws.send_json({'type': 'auth_invalid', 'message': 'Invalid access token'})
+            await ws.close()
+            return ws
+        await ws.send_json({'type': 'auth_ok', 'ha_version': 'stub'})
+        
+        tasks = set()
+        self._websockets.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    task = asyncio.create_task(self._ws_command(ws, json.loads(msg.data)))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        finally:
+            self._websockets.discard(ws)
+            self._subscriptions.pop(ws, None)
+        return ws
+    
+    def restart(self) -> None:
+        """Act like a restarted Home Assistant: states set through the API are gone"""
+        self.states.clear()
+        self.drop_websockets()
+    
+    def fire_event(self, event_type: str) -> int:
+        """Send an event to the connections subscribed to it; returns how many got it"""
+        async def send_all() -> int:
+            sent = 0
+            for ws, subscriptions in list(self._subscriptions.items()):
+                for subscription_id, subscribed in subscriptions:
+                    if subscribed in (event_type, None) and not ws.closed:
+                        await ws.send_json({'id': subscription_id, 'type': 'event',
+                                            'event': {'event_type': event_type, 'data': {}}})
+                        sent += 1
+            return sent
+        return asyncio.run_coroutine_threadsafe(send_all(), self._loop).result()
+    
+    def drop_websockets(self) -> None:
+        """Close all WebSocket connections from the server side, as a restart would"""
+        async def close_all():
+            for ws in list(self._websockets):
+                await ws.close()
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result()
+    
+    def _serve(self) -> None:
+        """Thread target running the aiohttp application"""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        
+        app = web.Application()
+        app.router.add_get('/api/config', self._config)
+        app.router.add_get('/api/states/{entity_id}', self._get_state)
+        app.router.add_post('/api/states/{entity_id}', self._state)
+        app.router.add_delete('/api/states/{entity_id}', self._delete_state)
+        app.router.add_post('/api/{registry:(device|entity)_registry}', self._registry)
+        app.router.add_get('/api/websocket', self._websocket)
+        
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+    
+    def start(self) -> 'StubHAServer':
+        """Start serving in a background thread"""
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+    
+    def stop(self) -> None:
+        """Stop the server thread"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join()
+    
+    def __enter__(self) -> 'StubHAServer':
+        return self.start()
+    
+    def __exit__(self, *exc) -> None:
+        self.stop()
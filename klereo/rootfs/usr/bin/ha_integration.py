@@ -7,26 +7,173 @@ import asyncio
 import aiohttp
 import json
 import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime
-from klereo_api import KlereoAPI
+import re
+import time
+from typing import Dict, List, Optional, Any, Union, TYPE_CHECKING
+from datetime import datetime, timezone
+from klereo_async_api import AsyncKlereoAPI
+from klereo_control import OUTPUT, SETPOINT, SETPOINTS, CommandQueue, ControlCommand
+from klereo_discovery import DiscoveryDiff, RegistrationStore, probe_signature
+from ha_websocket import HAWebSocketClient, HAWebSocketError
+from klereo_entities import EntityDescriptor, EntityDescriptorCache, entity_id_for
+from klereo_fetcher import FetchCycleResult, PoolCallback, PoolDetailsFetcher
+from klereo_health import UpstreamHealth
+from klereo_history import ProbeHistory
+from klereo_metrics import CONTROL_COMMANDS, CYCLE_PHASE_SECONDS, HA_REQUEST_SECONDS, HA_REQUESTS, HA_STATE_WRITES
+from klereo_probes import PoolDetails
+from klereo_profiling import SPANS, span
+
+if TYPE_CHECKING:
+    # The synchronous client pulls in requests, which the add-on doesn't need
+    from klereo_api import KlereoAPI
 
 class HomeAssistantIntegration:
     """Home Assistant integration for Klereo pools"""
     
-    def __init__(self, ha_url: str, ha_token: str, api_client: KlereoAPI, logger: Optional[logging.Logger] = None):
-        """Initialize Home Assistant integration"""
+    # Maximum number of state pushes in flight at once
+    DEFAULT_PUSH_CONCURRENCY = 10
+    
+    # Minimum change per probe kind before a new state is pushed
+    DEFAULT_DEADBANDS = {
+        'temperature': 0.1,  # °C
+        'ph': 0.05,
+        'chlorine': 0.05,    # mg/L
+        'orp': 5,            # mV
+        'level': 1,          # cm
+    }
+    
+    # Republish unchanged states at least this often (seconds)
+    DEFAULT_STATE_HEARTBEAT = 1800
+    
+    # States set through the API are gone after a Home Assistant restart;
+    # without the WebSocket to hear of it, check this often whether they
+    # still exist, and restore them if not
+    RESTART_CHECK_INTERVAL = 15  # seconds
+    
+    # Whether Home Assistant gets the states back by itself after a restart
+    STATES_SURVIVE_RESTART = False
+    
+    # Diagnostic entities
+    CIRCUIT_BREAKER_ENTITY_ID = 'sensor.klereo_api_circuit_breaker'
+    CONNECTED_ENTITY_ID = 'binary_sensor.klereo_api_connected'
+    
+    # Whether entity registrations embed the device name, so a renamed pool
+    # has to re-register its entities
+    DEVICE_IN_ENTITY_CONFIG = False
+    
+    # Whether this output can receive commands for switch and number entities
+    CONTROLS_SUPPORTED = False
+    
+    # A value written from Home Assistant is shown until Klereo reports it,
+    # or for at most this long (seconds)
+    OPTIMISTIC_HOLD = 60
+    
+    # Statistics published per history window when statistics sensors are enabled
+    STATISTICS = ('min', 'mean', 'max')
+    
+    # WebSocket commands Home Assistant Core offers for (method, endpoint).
+    # It has none for writing states or registry entries, which stay on REST;
+    # a command answered with unknown_command falls back to REST as well.
+    WS_COMMANDS = {
+        ('GET', 'config'): 'get_config'
+    }
+    
+    def __init__(self, ha_url: str, ha_token: str, api_client: Union['KlereoAPI', AsyncKlereoAPI],
+                 logger: Optional[logging.Logger] = None,
+                 max_concurrency: int = PoolDetailsFetcher.DEFAULT_MAX_CONCURRENCY,
+                 request_timeout: float = PoolDetailsFetcher.DEFAULT_TIMEOUT,
+                 push_concurrency: Optional[int] = None,
+                 deadbands: Optional[Dict[str, float]] = None,
+                 state_heartbeat: float = DEFAULT_STATE_HEARTBEAT,
+                 transport: str = 'rest', history: Optional[ProbeHistory] = None,
+                 statistics_sensors: bool = False,
+                 registration_store: Optional[RegistrationStore] = None,
+                 controls: bool = False):
+        """Initialize Home Assistant integration
+        
+        transport is 'rest' for one HTTP request per call, or 'websocket' to
+        send calls over a single persistent WebSocket connection. Fetched
+        probe values are recorded in history when one is given. With a
+        registration_store, registered devices and entities survive restarts.
+        controls exposes pool outputs and setpoints as switch and number
+        entities, on outputs that support commands.
+        """
         self.ha_url = ha_url.rstrip('/')
         self.ha_token = ha_token
         self.api_client = api_client
         self.logger = logger or logging.getLogger(__name__)
         
-        # Device and entity tracking
+        # Outcomes of the requests made to Home Assistant, for health checks
+        self.health = UpstreamHealth()
+        
+        # Device and entity tracking, restored so restarts skip registry calls
+        self.registration_store = registration_store
         self.registered_devices = {}
         self.registered_entities = {}
+        if registration_store:
+            self.registered_devices, self.registered_entities = registration_store.load()
+        self._registrations_dirty = False
+        
+        # Probe list per pool at the last discovery, to diff only pools that changed
+        self._probe_signatures: Dict[str, tuple] = {}
+        
+        # Per-probe entity metadata, computed once at discovery
+        self.descriptors = EntityDescriptorCache(self._generate_device_id)
+        
+        # Concurrent pool detail fetching
+        self.fetcher = PoolDetailsFetcher(
+            fetch=lambda pool_id: self._call_api('get_pool_probes', pool_id),
+            max_concurrency=max_concurrency,
+            timeout=request_timeout,
+            logger=self.logger
+        )
+        
+        # Concurrent state pushes
+        if push_concurrency is None:
+            push_concurrency = self.DEFAULT_PUSH_CONCURRENCY
+        self.push_concurrency = max(1, int(push_concurrency))
+        self._push_semaphore: Optional[asyncio.Semaphore] = None
+        self.last_push_duration: Optional[float] = None
+        
+        # Change detection: last pushed state per entity
+        self.deadbands = {**self.DEFAULT_DEADBANDS, **(deadbands or {})}
+        self.state_heartbeat = state_heartbeat
+        self.last_pushed_states = {}
+        self.push_stats = {'pushed': 0, 'suppressed': 0, 'failed': 0, 'restored': 0}
+        self.first_push_at: Optional[float] = None  # time.monotonic() of the first state pushed
+        
+        # Probe history, statistics sensors and long-term statistics import
+        self.history = history
+        self.statistics_sensors = statistics_sensors and history is not None
+        self.history_probes: Dict[tuple, EntityDescriptor] = {}
+        self._statistics_socket = None
+        
+        # Pool control: commands from Home Assistant go through a coalescing,
+        # rate-limited queue; states shown per (pool_id, kind, key)
+        self.control: Optional[CommandQueue] = None
+        self.control_states: Dict[tuple, Any] = {}
+        self._optimistic: Dict[tuple, tuple] = {}  # (pool_id, kind, key) -> (value, shown until)
+        if controls:
+            if self.CONTROLS_SUPPORTED:
+                self.control = CommandQueue(write=self._write_command, current=self._command_state,
+                                            on_written=self._command_written, on_settled=self.refresh_pool,
+                                            logger=self.logger)
+            else:
+                self.logger.warning("Pool controls need output_mode mqtt, only sensors are published")
         
         # Session for HTTP requests
         self.session = None
+        
+        # Background check for a Home Assistant restart
+        self._restart_watch: Optional[asyncio.Task] = None
+        self.last_restore: Optional[Dict[str, Any]] = None
+        
+        # Optional persistent WebSocket transport
+        self.websocket = None
+        self._ws_unsupported = set()
+        if transport == 'websocket':
+            self.websocket = HAWebSocketClient(self.ha_url, ha_token, logger=self.logger,
+                                               request_timeout=request_timeout)
     
     async def _get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session"""
@@ -35,31 +182,121 @@ class HomeAssistantIntegration:
                 'Authorization': f'Bearer {self.ha_token}',
                 'Content-Type': 'application/json'
             }
-            self.session = aiohttp.ClientSession(headers=headers)
+            # Keep enough pooled keep-alive connections for concurrent pushes
+            connector = aiohttp.TCPConnector(limit_per_host=self.push_concurrency)
+            self.session = aiohttp.ClientSession(headers=headers, connector=connector)
         return self.session
     
-    async def _make_ha_request(self, endpoint: str, method: str = 'GET', data: Optional[Dict] = None) -> Optional[Dict]:
-        """Make request to Home Assistant API"""
+    def _push_slots(self) -> asyncio.Semaphore:
+        """Semaphore bounding Home Assistant calls, shared by pools discovered and pushed concurrently"""
+        if self._push_semaphore is None:
+            self._push_semaphore = asyncio.Semaphore(self.push_concurrency)
+        return self._push_semaphore
+    
+    async def _call_api(self, method_name: str, *args) -> Any:
+        """Call a Klereo API method without blocking the event loop"""
+        method = getattr(self.api_client, method_name)
+        
+        if asyncio.iscoroutinefunction(method):
+            return await method(*args)
+        
+        # Synchronous client: run the blocking call in a worker thread
+        return await asyncio.to_thread(method, *args)
+    
+    async def fetch_pool_probes(self, pool_ids: List[str], on_pool: Optional[PoolCallback] = None) -> FetchCycleResult:
+        """Fetch probe data for all pools concurrently, passing each pool to on_pool as it arrives"""
+        
+        # Refresh the JWT once up front so concurrent fetches don't all log in
+        await self._call_api('get_jwt_token')
+        
+        return await self.fetcher.fetch_all(pool_ids, on_pool=on_pool)
+    
+    async def _make_ha_request(self, endpoint: str, method: str = 'GET', data: Optional[Dict] = None,
+                               missing_ok: bool = False) -> Optional[Dict]:
+        """Make request to Home Assistant API
+        
+        With missing_ok, a GET answered 404 returns {} instead of failing.
+        """
         
-        session = await self._get_session()
-        url = f"{self.ha_url}/api/{endpoint}"
+        method = method.upper()
+        if method not in ('GET', 'POST', 'DELETE'):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        
+        # Label by the first path segment so entity ids don't explode cardinality
+        metric_endpoint = endpoint.split('/', 1)[0]
+        command = None
+        if self.websocket is not None:
+            command = self.WS_COMMANDS.get((method, metric_endpoint))
+            if command in self._ws_unsupported:
+                command = None
+        start = time.perf_counter()
         
         try:
-            if method.upper() == 'GET':
+            if command:
+                message = {'type': command, **(data or {})}
+                if metric_endpoint == 'states':
+                    message['entity_id'] = endpoint.split('/', 1)[1]
+                result = await self.websocket.call(message)
+                HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='success')
+                self.health.record(True)
+                return {} if result is None else result
+            
+            session = await self._get_session()
+            url = f"{self.ha_url}/api/{endpoint}"
+            
+            if method == 'GET':
                 async with session.get(url) as response:
                     if response.status == 200:
+                        HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='success')
+                        self.health.record(True)
                         return await response.json()
-            elif method.upper() == 'POST':
+                    if response.status == 404 and missing_ok:
+                        HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='success')
+                        self.health.record(True)
+                        return {}
+            elif method == 'POST':
                 async with session.post(url, json=data) as response:
-                    if response.status == 200:
+                    # states/<entity_id> answers 201 when it creates the entity
+                    if response.status in (200, 201):
+                        HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='success')
+                        self.health.record(True)
                         return await response.json()
+            else:  # DELETE
+                async with session.delete(url) as response:
+                    # 404: already gone
+                    if response.status in (200, 404):
+                        HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='success')
+                        self.health.record(True)
+                        return {}
             
+            HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='http_error')
             self.logger.error(f"Home Assistant API error: {response.status} for {endpoint}")
+            # Other client errors are about the request; Home Assistant itself answered
+            if response.status >= 500 or response.status in (401, 403):
+                self.health.record(False, f"HTTP {response.status} for {endpoint}")
+            else:
+                self.health.record(True)
+            return None
+            
+        except HAWebSocketError as e:
+            if e.code == 'unknown_command':
+                self._ws_unsupported.add(command)
+                self.logger.info(f"Home Assistant has no WebSocket command {command}, using REST for {metric_endpoint}")
+                return await self._make_ha_request(endpoint, method, data)
+            HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='http_error')
+            self.logger.error(f"Home Assistant API error: {e} for {endpoint}")
+            self.health.record(True)
             return None
             
         except Exception as e:
+            HA_REQUESTS.inc(endpoint=metric_endpoint, outcome='error')
             self.logger.error(f"Home Assistant request failed: {e}")
+            self.health.record(False, str(e) or type(e).__name__)
             return None
+        finally:
+            elapsed = time.perf_counter() - start
+            HA_REQUEST_SECONDS.observe(elapsed, endpoint=metric_endpoint)
+            SPANS.record('ha_request', elapsed)
     
     def _generate_device_id(self, pool_id: str) -> str:
         """Generate unique device ID for pool"""
@@ -67,8 +304,7 @@ class HomeAssistantIntegration:
     
     def _generate_entity_id(self, pool_id: str, probe_name: str) -> str:
         """Generate unique entity ID for pool probe"""
-        sanitized_name = probe_name.lower().replace(' ', '_').replace('-', '_')
-        return f"sensor.klereo_{pool_id}_{sanitized_name}"
+        return entity_id_for(pool_id, probe_name)
     
     async def register_device(self, pool_id: str, pool_name: str) -> bool:
         """Register pool device in Home Assistant"""
@@ -91,12 +327,13 @@ class HomeAssistantIntegration:
         # Register device via Home Assistant device registry
         response = await self._make_ha_request('device_registry', method='POST', data=device_data)
         
-        if response:
+        if response is not None:
             self.registered_devices[device_id] = {
                 'pool_id': pool_id,
                 'pool_name': pool_name,
-                'registered_at': datetime.now()
+                'registered_at': time.time()
             }
+            self._registrations_dirty = True
             self.logger.info(f"Device registered: {pool_name} (ID: {device_id})")
             return True
         
@@ -106,148 +343,689 @@ class HomeAssistantIntegration:
     async def register_sensor_entity(self, pool_id: str, probe_data: Dict) -> bool:
         """Register sensor entity for pool probe"""
         
-        device_id = self._generate_device_id(pool_id)
-        entity_id = self._generate_entity_id(pool_id, probe_data['name'])
+        descriptor = self.descriptors.get(pool_id, probe_data)
+        entity_id = descriptor.entity_id
         
         if entity_id in self.registered_entities:
             return True
         
-        entity_data = {
-            'entity_id': entity_id,
-            'name': f"{probe_data['name']}",
-            'device_id': device_id,
-            'state_class': 'measurement',
-            'unit_of_measurement': probe_data.get('unit', ''),
-            'device_class': self._get_device_class(probe_data),
-            'icon': self._get_icon(probe_data),
-            'unique_id': f"klereo_{pool_id}_{probe_data['logicalId']}"
-        }
-        
         # Register entity via Home Assistant entity registry
-        response = await self._make_ha_request('entity_registry', method='POST', data=entity_data)
+        response = await self._make_ha_request('entity_registry', method='POST',
+                                               data=descriptor.registration_data())
         
-        if response:
-            self.registered_entities[entity_id] = {
-                'pool_id': pool_id,
-                'probe_data': probe_data,
-                'registered_at': datetime.now()
-            }
+        if response is not None:
+            self._remember_entity(descriptor, probe_data)
             self.logger.info(f"Sensor registered: {probe_data['name']} (ID: {entity_id})")
             return True
         
         self.logger.error(f"Failed to register sensor: {probe_data['name']}")
         return False
     
-    def _get_device_class(self, probe_data: Dict) -> Optional[str]:
-        """Get appropriate device class for probe"""
+    def _remember_entity(self, descriptor: EntityDescriptor, probe_data: Dict) -> None:
+        """Record a registered entity in the (persisted) registration state"""
+        self.registered_entities[descriptor.entity_id] = {
+            'pool_id': descriptor.pool_id,
+            'logical_id': descriptor.logical_id,
+            'unique_id': descriptor.unique_id,
+            'fingerprint': descriptor.fingerprint(),
+            'statistics': probe_data.get('statistics', False),
+            'registered_at': time.time()
+        }
+        self._registrations_dirty = True
+    
+    def _forget_entity(self, entity_id: str) -> None:
+        """Drop a removed entity and its change detection state"""
+        registered = self.registered_entities.pop(entity_id, None)
+        self.last_pushed_states.pop(entity_id, None)
+        if registered and 'logical_id' in registered:
+            self.history_probes.pop((registered['pool_id'], registered['logical_id']), None)
+        if registered and registered.get('control'):
+            self.control_states.pop((registered['pool_id'], *registered['control']), None)
+        self._registrations_dirty = True
+    
+    async def unregister_entity(self, entity_id: str) -> bool:
+        """Remove an entity that no longer exists in Klereo"""
         
-        probe_type = probe_data.get('type', '').lower()
-        probe_name = probe_data.get('name', '').lower()
+        # Remove the state object via Home Assistant states API
+        if await self._make_ha_request(f"states/{entity_id}", method='DELETE') is None:
+            self.logger.error(f"Failed to remove sensor: {entity_id}")
+            return False
         
-        if 'temperature' in probe_name or 'temp' in probe_name:
-            return 'temperature'
-        elif 'ph' in probe_name:
-            return None  # pH doesn't have a specific device class
-        elif 'chlorine' in probe_name or 'cl' in probe_name:
-            return None  # Chlorine doesn't have a specific device class
-        elif 'orp' in probe_name or 'redox' in probe_name:
-            return None  # ORP doesn't have a specific device class
-        elif 'level' in probe_name or 'water' in probe_name:
-            return None  # Water level doesn't have a specific device class
+        self._forget_entity(entity_id)
+        self.logger.info(f"Sensor removed: {entity_id}")
+        return True
+    
+    async def unregister_device(self, device_id: str) -> bool:
+        """Remove a pool that is no longer in the index, with all its entities"""
         
-        return None
+        device = self.registered_devices.get(device_id, {})
+        entity_ids = [entity_id for entity_id, registered in self.registered_entities.items()
+                      if registered.get('pool_id') == device.get('pool_id')]
+        results = await asyncio.gather(*(self.unregister_entity(entity_id) for entity_id in entity_ids))
+        if not all(results):
+            return False
+        
+        # The device registry entry goes away with its last entity
+        self.registered_devices.pop(device_id, None)
+        self._registrations_dirty = True
+        self.logger.info(f"Device removed: {device.get('pool_name')} (ID: {device_id})")
+        return True
+    
+    def save_registrations(self) -> bool:
+        """Persist the registration state if a store is configured and it changed"""
+        if not self.registration_store or not self._registrations_dirty:
+            return False
+        
+        if self.registration_store.save(self.registered_devices, self.registered_entities):
+            self._registrations_dirty = False
+            return True
+        return False
     
-    def _get_icon(self, probe_data: Dict) -> str:
-        """Get appropriate icon for probe"""
+    def _should_push_state(self, descriptor: EntityDescriptor, value: Any) -> bool:
+        """Check whether a probe value differs enough from the last pushed state"""
         
-        probe_name = probe_data.get('name', '').lower()
+        last = self.last_pushed_states.get(descriptor.entity_id)
+        if last is None:
+            return True
         
-        if 'temperature' in probe_name or 'temp' in probe_name:
-            return 'mdi:thermometer'
-        elif 'ph' in probe_name:
-            return 'mdi:ph'
-        elif 'chlorine' in probe_name or 'cl' in probe_name:
-            return 'mdi:water-percent'
-        elif 'orp' in probe_name or 'redox' in probe_name:
-            return 'mdi:alpha-r-circle'
-        elif 'level' in probe_name or 'water' in probe_name:
-            return 'mdi:waves'
+        # Heartbeat: republish even unchanged values after max silence
+        if time.monotonic() - last['pushed_at'] >= self.state_heartbeat:
+            return True
         
-        return 'mdi:gauge'
+        if value == last['value']:
+            return False
+        
+        deadband = self.deadbands.get(descriptor.kind, 0)
+        try:
+            return round(abs(float(value) - float(last['value'])), 6) >= deadband
+        except (TypeError, ValueError):
+            # Non-numeric state that changed
+            return True
     
-    async def update_sensor_state(self, pool_id: str, probe_data: Dict) -> bool:
+    async def _push_state(self, descriptor: EntityDescriptor, value: Any) -> bool:
+        """Send one state to Home Assistant"""
+        
+        # Update state via Home Assistant states API
+        response = await self._make_ha_request(descriptor.state_endpoint, method='POST',
+                                               data=descriptor.state_data(value))
+        return response is not None
+    
+    async def update_sensor_state(self, pool_id: str, probe_data: Dict, force: bool = False) -> bool:
         """Update sensor state in Home Assistant"""
         
-        entity_id = self._generate_entity_id(pool_id, probe_data['name'])
+        descriptor = self.descriptors.get(pool_id, probe_data)
+        entity_id = descriptor.entity_id
+        value = probe_data.get('filteredValue', 0)
+        
+        if not force and not self._should_push_state(descriptor, value):
+            self.push_stats['suppressed'] += 1
+            HA_STATE_WRITES.inc(result='suppressed')
+            return True
         
         if entity_id not in self.registered_entities:
             # Register entity if not exists
             await self.register_sensor_entity(pool_id, probe_data)
         
-        state_data = {
-            'entity_id': entity_id,
-            'state': probe_data.get('filteredValue', 0),
-            'attributes': {
-                'unit_of_measurement': probe_data.get('unit', ''),
-                'friendly_name': probe_data.get('name', ''),
-                'device_class': self._get_device_class(probe_data),
-                'last_updated': datetime.now().isoformat()
+        if await self._push_state(descriptor, value):
+            if self.first_push_at is None:
+                self.first_push_at = time.monotonic()
+            # Also the snapshot restored after a Home Assistant restart
+            self.last_pushed_states[entity_id] = {
+                'value': value,
+                'pushed_at': time.monotonic(),
+                'descriptor': descriptor
             }
-        }
-        
-        # Update state via Home Assistant states API
-        response = await self._make_ha_request(f"states/{entity_id}", method='POST', data=state_data)
-        
-        if response:
-            self.logger.debug(f"State updated: {probe_data['name']} = {probe_data.get('filteredValue', 0)}")
+            self.push_stats['pushed'] += 1
+            HA_STATE_WRITES.inc(result='pushed')
+            self.logger.debug("State updated: %s = %s", descriptor.name, value)
             return True
         
+        self.push_stats['failed'] += 1
+        HA_STATE_WRITES.inc(result='failed')
         self.logger.error(f"Failed to update state: {probe_data['name']}")
         return False
     
-    async def discover_and_register_pools(self) -> bool:
-        """Discover all pools and register them as devices"""
+    async def update_sensor_states(self, pool_probes: Dict[str, List[Dict]]) -> Dict[str, bool]:
+        """Push all probe states of a cycle concurrently
+        
+        Returns a summary {entity_id: success}.
+        """
+        
+        semaphore = self._push_slots()
+        
+        async def push(pool_id: str, probe: Dict) -> bool:
+            async with semaphore:
+                try:
+                    return await self.update_sensor_state(pool_id, probe)
+                except Exception as e:
+                    self.logger.error(f"Failed to update state: {probe.get('name')}: {e}")
+                    return False
+        
+        entity_ids = []
+        tasks = []
+        for pool_id, probes in pool_probes.items():
+            for probe in probes:
+                entity_ids.append(self.descriptors.get(pool_id, probe).entity_id)
+                tasks.append(push(pool_id, probe))
+        
+        start = time.monotonic()
+        results = await asyncio.gather(*tasks)
+        self.last_push_duration = time.monotonic() - start
+        
+        return dict(zip(entity_ids, results))
+    
+    async def states_lost(self) -> bool:
+        """Check whether Home Assistant lost the published states, as it does when it restarts
+        
+        One of them is looked up; an unreachable Home Assistant hasn't lost
+        anything yet.
+        """
+        canary = next(iter(self.last_pushed_states), None)
+        if canary is None:
+            return False
+        return await self._make_ha_request(f"states/{canary}", missing_ok=True) == {}
+    
+    async def restore_states(self) -> int:
+        """Republish every state last pushed, without fetching anything from Klereo
+        
+        The snapshot is the last pushed value per entity with its descriptor,
+        which holds everything else the state needs. States are pushed
+        concurrently, as many at once as a cycle push. Returns the number
+        restored.
+        """
+        
+        snapshot = list(self.last_pushed_states.items())
+        semaphore = self._push_slots()
+        
+        async def restore(entity_id: str, last: Dict[str, Any]) -> bool:
+            async with semaphore:
+                try:
+                    return await self._push_state(last['descriptor'], last['value'])
+                except Exception as e:
+                    self.logger.error(f"Failed to restore state: {entity_id}: {e}")
+                    return False
+        
+        start = time.monotonic()
+        results = await asyncio.gather(*(restore(entity_id, last) for entity_id, last in snapshot))
+        restored = sum(results)
+        await self.update_diagnostic_states()
+        duration = time.monotonic() - start
+        
+        self.push_stats['restored'] += restored
+        HA_STATE_WRITES.inc(restored, result='restored')
+        self.last_restore = {'at': time.time(), 'restored': restored, 'total': len(snapshot),
+                             'duration': round(duration, 3)}
+        self.logger.info(f"Restored {restored}/{len(snapshot)} states in {duration:.2f}s")
+        return restored
+    
+    async def _restore_if_lost(self) -> None:
+        """Restore the states if Home Assistant came back without them"""
+        try:
+            if await self.states_lost():
+                self.logger.warning("Home Assistant lost the Klereo states, probably restarted; restoring them")
+                await self.restore_states()
+        except Exception as e:
+            self.logger.warning(f"Home Assistant restart check failed: {e}")
+    
+    async def _restart_watch_loop(self) -> None:
+        """Restore the states as soon as Home Assistant comes back without them, polling for it"""
+        while True:
+            await asyncio.sleep(self.RESTART_CHECK_INTERVAL)
+            await self._restore_if_lost()
+    
+    async def _restart_event_watch(self) -> None:
+        """Restore the states when Home Assistant reports it started
+        
+        The WebSocket stays open for the homeassistant_started subscription
+        and is reopened when it drops, as it does during the restart. The
+        states are also checked after every reconnect, in case the event
+        came before the socket was back. A Home Assistant refusing the
+        subscription is polled instead.
+        """
+        started = asyncio.Event()
+        try:
+            await self.websocket.subscribe('homeassistant_started', lambda event: started.set())
+        except (HAWebSocketError, ConnectionError, asyncio.TimeoutError) as e:
+            self.logger.warning(f"Home Assistant started event unavailable ({e}), polling for restarts instead")
+            await self._restart_watch_loop()
+            return
+        
+        while True:
+            closed = asyncio.ensure_future(self.websocket.wait_closed())
+            event = asyncio.ensure_future(started.wait())
+            try:
+                await asyncio.wait((closed, event), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                closed.cancel()
+                event.cancel()
+            
+            if not started.is_set():
+                # Reopening the socket subscribes again
+                while not await self.websocket.connect():
+                    await asyncio.sleep(self.RESTART_CHECK_INTERVAL)
+            started.clear()
+            await self._restore_if_lost()
+    
+    def start_restart_watch(self) -> None:
+        """Start watching for Home Assistant restarts, where states don't survive them"""
+        if self.STATES_SURVIVE_RESTART:
+            return
+        if self._restart_watch is None or self._restart_watch.done():
+            watch = self._restart_watch_loop if self.websocket is None else self._restart_event_watch
+            self._restart_watch = asyncio.create_task(watch())
+    
+    def _diagnostics(self) -> List[Dict[str, Any]]:
+        """Add-on diagnostic entities with their current state and attributes"""
+        
+        diagnostics = []
+        
+        breaker = getattr(self.api_client, 'breaker', None)
+        if breaker is not None:
+            snapshot = breaker.snapshot()
+            diagnostics.append({
+                'entity_id': self.CIRCUIT_BREAKER_ENTITY_ID,
+                'topic': 'circuit_breaker',
+                'name': 'Klereo API Circuit Breaker',
+                'icon': 'mdi:api',
+                'state': snapshot.pop('state'),
+                'attributes': snapshot
+            })
+        
+        # Judged from the outcomes of the add-on's own requests
+        health = getattr(self.api_client, 'health', None)
+        if health is not None:
+            snapshot = health.snapshot()
+            diagnostics.append({
+                'entity_id': self.CONNECTED_ENTITY_ID,
+                'topic': 'connected',
+                'name': 'Klereo API Connected',
+                'device_class': 'connectivity',
+                'state': snapshot.pop('healthy'),
+                'attributes': snapshot
+            })
+        
+        return diagnostics
+    
+    async def update_diagnostic_states(self) -> bool:
+        """Publish add-on diagnostic entities"""
+        
+        success = True
+        for diagnostic in self._diagnostics():
+            state = diagnostic['state']
+            attributes = {'friendly_name': diagnostic['name'], 'entity_category': 'diagnostic'}
+            for key in ('icon', 'device_class'):
+                if key in diagnostic:
+                    attributes[key] = diagnostic[key]
+            state_data = {
+                'state': ('on' if state else 'off') if isinstance(state, bool) else state,
+                'attributes': {**attributes, **diagnostic['attributes']}
+            }
+            
+            response = await self._make_ha_request(f"states/{diagnostic['entity_id']}", method='POST',
+                                                   data=state_data)
+            if response is None:
+                self.logger.error(f"Failed to update {diagnostic['name']} diagnostic state")
+                success = False
+        
+        return success
+    
+    def _diff_pools(self, pools: Dict[str, str], removed_pools: Optional[List[str]] = None) -> DiscoveryDiff:
+        """Diff the pool index against the registered devices
+        
+        Pools are only removed when every account's index is known, so an
+        account that failed to answer doesn't lose its devices. With
+        removed_pools, pools is one account's part of the index and only
+        the devices of removed_pools are removed.
+        """
+        if removed_pools is None:
+            complete = getattr(self.api_client, 'index_complete', True)
+            return DiscoveryDiff().diff_pools(self.registered_devices, pools, self._generate_device_id,
+                                              remove_missing=complete)
+        
+        diff = DiscoveryDiff().diff_pools(self.registered_devices, pools, self._generate_device_id,
+                                          remove_missing=False)
+        diff.removed_devices.extend(device_id for device_id in map(self._generate_device_id, removed_pools)
+                                    if device_id in self.registered_devices)
+        return diff
+    
+    def _diff_probes(self, diff: DiscoveryDiff, pool_probes: Dict[str, List[Dict]],
+                     force: bool = False) -> DiscoveryDiff:
+        """Add the entity changes of pools whose probe list changed since the last discovery"""
+        for pool_id, probes in pool_probes.items():
+            signature = probe_signature(probes)
+            renamed = pool_id in diff.changed_devices
+            if force or renamed or signature != self._probe_signatures.get(pool_id):
+                diff.diff_probes(self.registered_entities, pool_id, probes, self.descriptors,
+                                 reregister=renamed and self.DEVICE_IN_ENTITY_CONFIG)
+                self._probe_signatures[pool_id] = signature
+        return diff
+    
+    async def apply_discovery(self, diff: DiscoveryDiff) -> bool:
+        """Apply a discovery diff: removals first, then devices, then entities concurrently"""
+        
+        if not diff:
+            return True
+        self.logger.info(f"Applying discovery changes: {diff}")
+        
+        semaphore = self._push_slots()
+        
+        async def bounded(coroutine) -> bool:
+            async with semaphore:
+                try:
+                    return await coroutine
+                except Exception as e:
+                    self.logger.error(f"Discovery change failed: {e}")
+                    return False
+        
+        results = list(await asyncio.gather(
+            *(bounded(self.unregister_device(device_id)) for device_id in diff.removed_devices),
+            *(bounded(self.unregister_entity(entity_id)) for entity_id in diff.removed_entities
+              if entity_id in self.registered_entities)))
+        
+        # Changed devices and entities are registered again with their new data
+        for pool_id in diff.changed_devices:
+            self.registered_devices.pop(self._generate_device_id(pool_id), None)
+        for pool_id, probe in diff.changed_entities:
+            self.registered_entities.pop(self.descriptors.get(pool_id, probe).entity_id, None)
+        
+        pools = {**diff.added_devices, **diff.changed_devices}
+        results += await asyncio.gather(*(bounded(self.register_device(pool_id, pool_name))
+                                          for pool_id, pool_name in pools.items()))
+        results += await asyncio.gather(*(bounded(self.register_sensor_entity(pool_id, probe))
+                                          for pool_id, probe in diff.added_entities + diff.changed_entities))
+        
+        if not all(results):
+            # Diff every pool again next cycle to retry what failed
+            self._probe_signatures.clear()
+            return False
+        return True
+    
+    async def discover_and_register_pools(self, publish_states: bool = False) -> bool:
+        """Discover all pools and register the devices and entities not registered yet
+        
+        Each pool is diffed and registered as soon as its details arrive. With
+        publish_states its sensor states are pushed right away as well, so the
+        first pools show up in Home Assistant while the others are fetched.
+        """
         
-        pools = self.api_client.get_pools()
+        pools = await self._call_api('get_pools')
         if not pools:
             self.logger.error("No pools found")
             return False
         
-        success_count = 0
+        # Pools gone from Klereo are removed before anything is registered
+        pool_diff = self._diff_pools(pools)
+        await self.apply_discovery(pool_diff.removals())
         
-        for pool_id, pool_name in pools.items():
-            # Register device
-            if await self.register_device(pool_id, pool_name):
-                success_count += 1
-                
-                # Get and register sensors for this pool
-                probes = self.api_client.get_pool_probes(pool_id)
-                if probes:
-                    for probe in probes:
-                        await self.register_sensor_entity(pool_id, probe)
+        async def discover_pool(pool_id: str, probes: List[Dict]) -> None:
+            diff = self._diff_probes(pool_diff.for_pool(pool_id), {pool_id: probes}, force=True)
+            await self.apply_discovery(diff)
+            if publish_states:
+                self.record_history({pool_id: probes})
+                await self.update_sensor_states({pool_id: probes})
+            await self.sync_controls([pool_id])
         
-        self.logger.info(f"Successfully registered {success_count}/{len(pools)} pools")
-        return success_count > 0
+        result = await self.fetch_pool_probes(list(pools), on_pool=discover_pool)
+        
+        registered = sum(1 for pool_id in pools if self._generate_device_id(pool_id) in self.registered_devices)
+        self.logger.info(f"Successfully registered {registered}/{len(pools)} pools "
+                         f"({len(self.registered_entities)} entities, {result.succeeded}/{result.total} "
+                         f"pools fetched in {result.duration:.2f}s)")
+        return registered > 0
     
-    async def update_all_sensors(self) -> bool:
-        """Update all sensor states"""
+    def record_history(self, pool_probes: Dict[str, List[Dict]], timestamp: Optional[float] = None) -> int:
+        """Record fetched probe values in the history; returns the number of samples added"""
         
-        pools = self.api_client.get_pools()
-        if not pools:
+        if self.history is None:
+            return 0
+        
+        timestamp = time.time() if timestamp is None else timestamp
+        recorded = 0
+        for pool_id, probes in pool_probes.items():
+            for probe in probes:
+                if self.history.record(pool_id, probe['logicalId'], probe.get('filteredValue'), timestamp):
+                    self.history_probes[(pool_id, probe['logicalId'])] = self.descriptors.get(pool_id, probe)
+                    recorded += 1
+        return recorded
+    
+    def _statistics_probes(self, pool_probes: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
+        """Probes carrying the min/mean/max of each history window so far"""
+        
+        statistics_probes = {}
+        for pool_id, probes in pool_probes.items():
+            for probe in probes:
+                for window in self.history.WINDOWS:
+                    stats = self.history.statistics(pool_id, probe['logicalId'], window)
+                    if stats is None:
+                        continue
+                    for stat in self.STATISTICS:
+                        statistics_probes.setdefault(pool_id, []).append({
+                            'logicalId': f"{probe['logicalId']}_{window}_{stat}",
+                            'name': f"{probe['name']} {window} {stat}",
+                            'unit': probe.get('unit', ''),
+                            'filteredValue': round(stats[stat], 3),
+                            # The probe summarized, so the sensor goes when it does
+                            'statistics': str(probe['logicalId'])
+                        })
+        return statistics_probes
+    
+    async def import_statistics(self) -> int:
+        """Import completed hourly min/max/mean into Home Assistant long-term statistics
+        
+        Hours stay queued until Home Assistant accepts them, so anything
+        recorded while it was unreachable is backfilled afterwards. Returns the
+        number of hours imported.
+        """
+        
+        if self.history is None or not self.ha_url:
+            return 0
+        
+        socket = self.websocket
+        if socket is None:
+            if self._statistics_socket is None:
+                self._statistics_socket = HAWebSocketClient(self.ha_url, self.ha_token, logger=self.logger,
+                                                            request_timeout=self.fetcher.timeout)
+            socket = self._statistics_socket
+        
+        async def import_probe(key: tuple, descriptor: EntityDescriptor) -> int:
+            hours = self.history.completed(key[0], key[1], '1h', after=self.history.imported_until(*key))
+            if not hours:
+                return 0
+            
+            object_id = re.sub(r'[^a-z0-9_]', '_', descriptor.entity_id.split('.', 1)[1])
+            message = {
+                'type': 'recorder/import_statistics',
+                'metadata': {
+                    'has_mean': True,
+                    'has_sum': False,
+                    'name': descriptor.name,
+                    'source': 'klereo',
+                    'statistic_id': f"klereo:{object_id}",
+                    'unit_of_measurement': descriptor.unit or None
+                },
+                'stats': [{
+                    'start': datetime.fromtimestamp(hour['start'], timezone.utc).isoformat(),
+                    'mean': hour['mean'],
+                    'min': hour['min'],
+                    'max': hour['max']
+                } for hour in hours]
+            }
+            
+            try:
+                await socket.call(message)
+            except (HAWebSocketError, ConnectionError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"Statistics import failed for {descriptor.name}, will retry: {e}")
+                return 0
+            
+            self.history.mark_imported(*key, hours[-1]['start'])
+            return len(hours)
+        
+        results = await asyncio.gather(*(import_probe(key, descriptor)
+                                         for key, descriptor in list(self.history_probes.items())))
+        imported = sum(results)
+        if imported:
+            self.logger.debug("Imported %d hourly statistics into Home Assistant", imported)
+        return imported
+    
+    async def update_all_sensors(self, pools: Optional[Dict[str, str]] = None,
+                                 removed_pools: Optional[List[str]] = None) -> bool:
+        """Update all sensor states, or only those of the given pools
+        
+        pools is one account's part of the index, {pool_id: pool_name}, and
+        removed_pools the pools that account no longer lists; without them
+        the index of every account is read. Pools and probes added, renamed
+        or removed in Klereo since the last cycle are registered or removed
+        first.
+        """
+        
+        if pools is None:
+            # The index is cached for hours, so diffing it every cycle is cheap
+            with span('cycle_get_pools'):
+                pools = await self._call_api('get_pools')
+            removed_pools = None
+        elif removed_pools is None:
+            removed_pools = []
+        if not pools and not removed_pools:
             return False
         
-        success_count = 0
+        with span('cycle_fetch'):
+            result = await self.fetch_pool_probes(list(pools or {}))
+        with span('cycle_discovery') as discovery:
+            await self.apply_discovery(self._diff_probes(self._diff_pools(pools or {}, removed_pools),
+                                                         result.probes))
+        with span('cycle_history') as history:
+            self.record_history(result.probes)
+            
+            pool_probes = result.probes
+            if self.statistics_sensors:
+                statistics_probes = self._statistics_probes(result.probes)
+                pool_probes = {pool_id: probes + statistics_probes.get(pool_id, [])
+                               for pool_id, probes in result.probes.items()}
         
-        for pool_id, pool_name in pools.items():
-            probes = self.api_client.get_pool_probes(pool_id)
-            if probes:
-                for probe in probes:
-                    if await self.update_sensor_state(pool_id, probe):
-                        success_count += 1
+        with span('cycle_push'):
+            push_results = await self.update_sensor_states(pool_probes)
+        with span('cycle_controls') as controls:
+            await self.sync_controls(list(result.probes))
+        CYCLE_PHASE_SECONDS.set(result.duration, phase='fetch')
+        CYCLE_PHASE_SECONDS.set(discovery.elapsed, phase='discovery')
+        CYCLE_PHASE_SECONDS.set(history.elapsed, phase='history')
+        CYCLE_PHASE_SECONDS.set(self.last_push_duration, phase='push')
+        CYCLE_PHASE_SECONDS.set(controls.elapsed, phase='controls')
+        success_count = sum(1 for success in push_results.values() if success)
         
-        self.logger.debug(f"Updated {success_count} sensors")
+        self.logger.debug("Updated %d/%d sensors in %.2fs (%d/%d pools fetched in %.2fs, "
+                          "pushed %d / suppressed %d total)",
+                          success_count, len(push_results), self.last_push_duration,
+                          result.succeeded, result.total, result.duration,
+                          self.push_stats['pushed'], self.push_stats['suppressed'])
         return success_count > 0
     
+    def submit_command(self, pool_id: str, kind: str, key: Any, value: Any) -> Optional[asyncio.Future]:
+        """Queue a control command from Home Assistant
+        
+        Returns a future resolving to whether the write went through, or
+        None when the command is rejected.
+        """
+        
+        if self.control is None:
+            return None
+        
+        if self._generate_device_id(pool_id) not in self.registered_devices:
+            reason = "unknown pool"
+        elif kind == SETPOINT and not SETPOINTS[key][2] <= value <= SETPOINTS[key][3]:
+            reason = f"{value} out of range"
+        else:
+            return self.control.submit(pool_id, kind, key, value)
+        
+        CONTROL_COMMANDS.inc(kind=kind, outcome='rejected')
+        self.logger.warning(f"Rejected {kind} {key} command for pool {pool_id}: {reason}")
+        return None
+    
+    async def _write_command(self, command: ControlCommand) -> bool:
+        """Send one queued command to Klereo"""
+        if command.kind == OUTPUT:
+            return await self._call_api('set_output', command.pool_id, command.key, bool(command.value))
+        return await self._call_api('set_setpoint', command.pool_id, command.key, command.value)
+    
+    def _command_state(self, command: ControlCommand) -> Any:
+        """State Home Assistant shows for the target of a command"""
+        return self.control_states.get(command.target)
+    
+    async def _command_written(self, command: ControlCommand) -> None:
+        """Show an accepted write right away, before Klereo reports it"""
+        self._optimistic[command.target] = (command.value, time.monotonic() + self.OPTIMISTIC_HOLD)
+        await self._publish_control_state(command.pool_id, command.kind, command.key, command.value)
+    
+    async def _publish_control_state(self, pool_id: str, kind: str, key: Any, value: Any) -> bool:
+        """Push a control state and remember it as shown"""
+        if await self.push_control_state(pool_id, kind, key, value):
+            self.control_states[(pool_id, kind, key)] = value
+            return True
+        return False
+    
+    async def register_controls(self, pool_id: str, details: PoolDetails) -> bool:
+        """Register the switch and number entities of a pool; outputs supporting controls override this"""
+        return True
+    
+    async def push_control_state(self, pool_id: str, kind: str, key: Any, value: Any) -> bool:
+        """Send one output or setpoint state; outputs supporting controls override this"""
+        return True
+    
+    async def update_control_states(self, pool_id: str, details: PoolDetails) -> bool:
+        """Push the output and setpoint states of a pool that changed
+        
+        A value written from Home Assistant stays shown until Klereo reports
+        it or OPTIMISTIC_HOLD expires, so a refresh that still sees the old
+        state doesn't flip the entity back.
+        """
+        
+        now = time.monotonic()
+        semaphore = self._push_slots()
+        states = [(OUTPUT, output.index, output.is_on) for output in details.outputs]
+        states += [(SETPOINT, param, value) for param, value in details.setpoints.items() if param in SETPOINTS]
+        
+        changed = []
+        for kind, key, value in states:
+            target = (pool_id, kind, key)
+            optimistic = self._optimistic.get(target)
+            if optimistic is not None:
+                if optimistic[0] != value and optimistic[1] > now:
+                    continue
+                del self._optimistic[target]
+            if self.control_states.get(target) != value:
+                changed.append((kind, key, value))
+        
+        async def push(kind: str, key: Any, value: Any) -> bool:
+            async with semaphore:
+                return await self._publish_control_state(pool_id, kind, key, value)
+        
+        return all(await asyncio.gather(*(push(*state) for state in changed)))
+    
+    async def sync_controls(self, pool_ids: List[str]) -> None:
+        """Register and publish the controls of pools whose details were just fetched"""
+        
+        if self.control is None:
+            return
+        
+        for pool_id in pool_ids:
+            # Served from the cache the fetch just filled
+            details = await self._call_api('get_pool_details', pool_id)
+            if details is not None and await self.register_controls(pool_id, details):
+                await self.update_control_states(pool_id, details)
+    
+    async def refresh_pool(self, pool_id: str) -> bool:
+        """Fetch one pool bypassing the cache and publish its states, without polling other pools"""
+        
+        details = await self._call_api('refresh_pool_details', pool_id)
+        if details is None:
+            self.logger.warning(f"Refresh of pool {pool_id} failed, states update with the next cycle")
+            return False
+        
+        probes = list(details.probes)
+        self.record_history({pool_id: probes})
+        await self.update_sensor_states({pool_id: probes})
+        return await self.update_control_states(pool_id, details)
+    
     async def test_ha_connection(self) -> bool:
         """Test Home Assistant connection"""
         
@@ -265,8 +1043,20 @@ class HomeAssistantIntegration:
     
     async def cleanup(self) -> None:
         """Clean up resources"""
+        if self._restart_watch is not None and not self._restart_watch.done():
+            self._restart_watch.cancel()
+            try:
+                await self._restart_watch
+            except asyncio.CancelledError:
+                pass
+        if self.control is not None:
+            await self.control.close()
         if self.session and not self.session.closed:
             await self.session.close()
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._statistics_socket is not None:
+            await self._statistics_socket.close()
 
 # Example usage
 if __name__ == "__main__":
@@ -276,7 +1066,7 @@ if __name__ == "__main__":
         logging.basicConfig(level=logging.DEBUG)
         
         # Initialize API client
-        api = KlereoAPI("username", "password")
+        api = AsyncKlereoAPI("username", "password")
         
         # Initialize Home Assistant integration
         ha_integration = HomeAssistantIntegration(
@@ -286,7 +1076,7 @@ if __name__ == "__main__":
         )
         
         # Test connections
-        if api.test_connection():
+        if await api.test_connection():
             print("✓ Klereo API connection successful")
             
             if await ha_integration.test_ha_connection():
@@ -301,5 +1091,6 @@ if __name__ == "__main__":
                         print("✓ Sensor update successful")
                 
         await ha_integration.cleanup()
+        await api.close()
     
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+MQTT discovery output backend for Klereo Pool Manager
+Publishes retained discovery configs once per entity, then only state payloads
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, TYPE_CHECKING, Union
+
+import aiomqtt
+
+from ha_integration import HomeAssistantIntegration
+from klereo_async_api import AsyncKlereoAPI
+from klereo_control import OUTPUT, SETPOINT, SETPOINTS, control_id, parse_control_id
+from klereo_entities import EntityDescriptor, entity_id_for
+from klereo_metrics import MQTT_PUBLISHES
+from klereo_probes import PoolDetails
+
+if TYPE_CHECKING:
+    from klereo_api import KlereoAPI
+
+class MQTTIntegration(HomeAssistantIntegration):
+    """Home Assistant integration for Klereo pools through MQTT discovery
+    
+    Entities created this way are persistent in Home Assistant, and a cycle
+    only sends one small retained state message per changed probe over a
+    single long-lived broker connection.
+    """
+    
+    DEFAULT_PORT = 1883
+    DEFAULT_DISCOVERY_PREFIX = 'homeassistant'
+    BASE_TOPIC = 'klereo'
+    
+    # Discovery configs carry the device name
+    DEVICE_IN_ENTITY_CONFIG = True
+    
+    # Switch and number entities publish their commands on the broker
+    CONTROLS_SUPPORTED = True
+    
+    # Home Assistant gets the retained configs and states back from the broker
+    STATES_SURVIVE_RESTART = True
+    
+    ADDON_DEVICE = {
+        'identifiers': ['klereo_addon'],
+        'name': 'Klereo Pool Manager',
+        'manufacturer': 'Klereo',
+        'model': 'Home Assistant Add-on'
+    }
+    
+    def __init__(self, mqtt_host: str, api_client: Union['KlereoAPI', AsyncKlereoAPI],
+                 mqtt_port: int = DEFAULT_PORT, mqtt_username: Optional[str] = None,
+                 mqtt_password: Optional[str] = None, discovery_prefix: str = DEFAULT_DISCOVERY_PREFIX,
+                 logger: Optional[logging.Logger] = None, **kwargs):
+        """Initialize MQTT integration
+        
+        Remaining keyword arguments are passed to HomeAssistantIntegration.
+        """
+        super().__init__('', '', api_client, logger=logger, **kwargs)
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = mqtt_port
+        self.mqtt_username = mqtt_username or None
+        self.mqtt_password = mqtt_password or None
+        self.discovery_prefix = discovery_prefix.rstrip('/')
+        
+        self.availability_topic = f"{self.BASE_TOPIC}/status"
+        
+        # One persistent broker connection, reopened on the next publish after a failure
+        self._client: Optional[aiomqtt.Client] = None
+        self._connect_lock = asyncio.Lock()
+        
+        # Task reading control commands from the connection
+        self._listener: Optional[asyncio.Task] = None
+    
+    def _state_topic(self, descriptor: EntityDescriptor) -> str:
+        return self._probe_state_topic(descriptor.pool_id, descriptor.logical_id)
+    
+    def _probe_state_topic(self, pool_id: str, logical_id: Any) -> str:
+        return f"{self.BASE_TOPIC}/{pool_id}/{logical_id}/state"
+    
+    def _config_topic(self, object_id: str, component: str = 'sensor') -> str:
+        return f"{self.discovery_prefix}/{component}/{object_id}/config"
+    
+    def _command_topic(self, pool_id: str, logical_id: Any) -> str:
+        return f"{self.BASE_TOPIC}/{pool_id}/{logical_id}/set"
+    
+    def _device_config(self, pool_id: str) -> Dict[str, Any]:
+        """Device block of a pool's discovery configs"""
+        device_id = self._generate_device_id(pool_id)
+        device = self.registered_devices.get(device_id, {})
+        return {
+            'identifiers': [device_id],
+            'name': f"Klereo Pool: {device.get('pool_name', pool_id)}",
+            'manufacturer': 'Klereo',
+            'model': 'Klereo Pool System',
+            'via_device': 'klereo_addon'
+        }
+    
+    async def _connect(self) -> bool:
+        """Open the broker connection if it isn't open yet"""
+        
+        async with self._connect_lock:
+            if self._client is not None:
+                return True
+            
+            client = aiomqtt.Client(
+                self.mqtt_host,
+                self.mqtt_port,
+                username=self.mqtt_username,
+                password=self.mqtt_password,
+                identifier='klereo-addon',
+                will=aiomqtt.Will(self.availability_topic, 'offline', qos=1, retain=True),
+                timeout=self.fetcher.timeout
+            )
+            
+            try:
+                await client.__aenter__()
+            except aiomqtt.MqttError as e:
+                self.logger.error(f"MQTT connection to {self.mqtt_host}:{self.mqtt_port} failed: {e}")
+                self.health.record(False, f"MQTT connection failed: {e}")
+                return False
+            
+            self._client = client
+            self.logger.info(f"Connected to MQTT broker {self.mqtt_host}:{self.mqtt_port}")
+            
+            if self.control is not None:
+                try:
+                    await client.subscribe(f"{self.BASE_TOPIC}/+/+/set", qos=1)
+                except aiomqtt.MqttError as e:
+                    self.logger.error(f"MQTT command subscription failed: {e}")
+                else:
+                    self._listener = asyncio.create_task(self._listen(client))
+        
+        return await self._publish(self.availability_topic, 'online', kind='availability', qos=1)
+    
+    async def _disconnect(self, client: aiomqtt.Client) -> None:
+        """Drop a connection so the next publish reconnects"""
+        if self._client is client:
+            self._client = None
+        listener, self._listener = self._listener, None
+        if listener is not None and listener is not asyncio.current_task():
+            listener.cancel()
+        try:
+            await client.__aexit__(None, None, None)
+        except aiomqtt.MqttError:
+            pass
+    
+    async def _publish(self, topic: str, payload: Any, kind: str, qos: int = 0, retain: bool = True) -> bool:
+        """Publish one message on the persistent connection"""
+        
+        if self._client is None and not await self._connect():
+            MQTT_PUBLISHES.inc(kind=kind, outcome='error')
+            return False
+        
+        client = self._client
+        try:
+            await client.publish(topic, payload, qos=qos, retain=retain)
+        except aiomqtt.MqttError as e:
+            MQTT_PUBLISHES.inc(kind=kind, outcome='error')
+            self.logger.error(f"MQTT publish to {topic} failed: {e}")
+            self.health.record(False, f"MQTT publish failed: {e}")
+            await self._disconnect(client)
+            return False
+        
+        MQTT_PUBLISHES.inc(kind=kind, outcome='success')
+        self.health.record(True)
+        return True
+    
+    async def _listen(self, client: aiomqtt.Client) -> None:
+        """Queue the commands published for switch and number entities"""
+        try:
+            async for message in client.messages:
+                self._handle_command(str(message.topic), message.payload)
+        except aiomqtt.MqttError as e:
+            # Reconnected, and subscribed again, by the next publish
+            self.logger.warning(f"MQTT command subscription lost: {e}")
+            await self._disconnect(client)
+    
+    def _handle_command(self, topic: str, payload: Any) -> None:
+        """Parse a klereo/<pool_id>/<control>/set message into a control command"""
+        
+        parts = topic.split('/')
+        control = parse_control_id(parts[2]) if len(parts) == 4 and parts[3] == 'set' else None
+        if control is None:
+            self.logger.debug("Ignoring MQTT message on %s", topic)
+            return
+        
+        kind, key = control
+        text = payload.decode(errors='replace') if isinstance(payload, (bytes, bytearray)) else str(payload)
+        if kind == OUTPUT:
+            value = {'ON': True, 'OFF': False}.get(text.strip().upper())
+        else:
+            try:
+                value = float(text)
+            except ValueError:
+                value = None
+        if value is None:
+            self.logger.warning(f"Ignoring invalid command {text!r} on {topic}")
+            return
+        
+        self.submit_command(parts[1], kind, key, value)
+    
+    async def register_device(self, pool_id: str, pool_name: str) -> bool:
+        """Remember the pool; MQTT discovery creates the device with its first entity"""
+        
+        device_id = self._generate_device_id(pool_id)
+        if device_id not in self.registered_devices:
+            self.registered_devices[device_id] = {'pool_id': pool_id, 'pool_name': pool_name}
+            self._registrations_dirty = True
+        return True
+    
+    async def register_sensor_entity(self, pool_id: str, probe_data: Dict) -> bool:
+        """Publish the retained discovery config for a pool probe"""
+        
+        descriptor = self.descriptors.get(pool_id, probe_data)
+        entity_id = descriptor.entity_id
+        
+        if entity_id in self.registered_entities:
+            return True
+        
+        config = {
+            'name': descriptor.name,
+            'unique_id': descriptor.unique_id,
+            'object_id': entity_id.split('.', 1)[1],
+            'state_topic': self._state_topic(descriptor),
+            'availability_topic': self.availability_topic,
+            'state_class': 'measurement',
+            'unit_of_measurement': descriptor.unit or None,
+            'device_class': descriptor.device_class,
+            'icon': descriptor.icon,
+            'device': self._device_config(pool_id)
+        }
+        config = {key: value for key, value in config.items() if value is not None}
+        
+        if await self._publish(self._config_topic(descriptor.unique_id), json.dumps(config), kind='config', qos=1):
+            self._remember_entity(descriptor, probe_data)
+            self.logger.info(f"Sensor registered: {descriptor.name} (ID: {entity_id})")
+            return True
+        
+        self.logger.error(f"Failed to register sensor: {descriptor.name}")
+        return False
+    
+    async def unregister_entity(self, entity_id: str) -> bool:
+        """Clear the retained discovery config and state, which deletes the entity"""
+        
+        registered = self.registered_entities.get(entity_id, {})
+        if 'unique_id' in registered:
+            config_topic = self._config_topic(registered['unique_id'], registered.get('component', 'sensor'))
+            if not await self._publish(config_topic, '', kind='config', qos=1):
+                self.logger.error(f"Failed to remove sensor: {entity_id}")
+                return False
+            await self._publish(self._probe_state_topic(registered['pool_id'], registered['logical_id']), '',
+                                kind='state')
+        
+        self._forget_entity(entity_id)
+        self.logger.info(f"Sensor removed: {entity_id}")
+        return True
+    
+    async def _push_state(self, descriptor: EntityDescriptor, value: Any) -> bool:
+        """Publish one retained state message"""
+        return await self._publish(self._state_topic(descriptor), str(value), kind='state')
+    
+    async def register_controls(self, pool_id: str, details: PoolDetails) -> bool:
+        """Publish the retained discovery configs of a pool's switches (outputs) and numbers (setpoints)"""
+        
+        controls = [(OUTPUT, output.index, output.name) for output in details.outputs]
+        controls += [(SETPOINT, param, SETPOINTS[param][0]) for param in details.setpoints if param in SETPOINTS]
+        
+        # Configs embed the device name, so a renamed pool registers them again
+        pool_name = self.registered_devices.get(self._generate_device_id(pool_id), {}).get('pool_name')
+        
+        results = []
+        for kind, key, name in controls:
+            component = 'switch' if kind == OUTPUT else 'number'
+            entity_id = entity_id_for(pool_id, name, domain=component)
+            registered = self.registered_entities.get(entity_id)
+            if registered is not None and registered.get('fingerprint') == [name, pool_name]:
+                continue
+            
+            logical_id = control_id(kind, key)
+            unique_id = f"klereo_{pool_id}_{logical_id}"
+            config = {
+                'name': name,
+                'unique_id': unique_id,
+                'object_id': entity_id.split('.', 1)[1],
+                'state_topic': self._probe_state_topic(pool_id, logical_id),
+                'command_topic': self._command_topic(pool_id, logical_id),
+                'availability_topic': self.availability_topic,
+                'qos': 1,
+                'device': self._device_config(pool_id)
+            }
+            if kind == OUTPUT:
+                config['icon'] = 'mdi:power'
+            else:
+                _, unit, minimum, maximum, step, icon = SETPOINTS[key]
+                config.update({'unit_of_measurement': unit, 'min': minimum, 'max': maximum,
+                               'step': step, 'mode': 'box', 'icon': icon})
+            
+            async with self._push_slots():
+                published = await self._publish(self._config_topic(unique_id, component), json.dumps(config),
+                                                kind='config', qos=1)
+            if not published:
+                self.logger.error(f"Failed to register {component}: {name}")
+                results.append(False)
+                continue
+            
+            self.registered_entities[entity_id] = {
+                'pool_id': pool_id,
+                'logical_id': logical_id,
+                'unique_id': unique_id,
+                'component': component,
+                'control': [kind, key],
+                'fingerprint': [name, pool_name],
+                'registered_at': time.time()
+            }
+            self._registrations_dirty = True
+            self.logger.info(f"{component.capitalize()} registered: {name} (ID: {entity_id})")
+            results.append(True)
+        
+        return all(results)
+    
+    async def push_control_state(self, pool_id: str, kind: str, key: Any, value: Any) -> bool:
+        """Publish one retained switch or number state"""
+        payload = ('ON' if value else 'OFF') if kind == OUTPUT else str(value)
+        return await self._publish(self._probe_state_topic(pool_id, control_id(kind, key)), payload,
+                                   kind='control')
+    
+    async def update_sensor_states(self, pool_probes: Dict[str, List[Dict]]) -> Dict[str, bool]:
+        """Publish all probe states of a cycle as one batch on the broker connection"""
+        
+        # Connect once up front rather than from every queued publish
+        await self._connect()
+        return await super().update_sensor_states(pool_probes)
+    
+    async def _publish_diagnostic(self, diagnostic: Dict[str, Any]) -> bool:
+        """Publish the discovery config of a diagnostic entity once, then its attributes and state"""
+        
+        entity_id = diagnostic['entity_id']
+        component, object_id = entity_id.split('.', 1)
+        state_topic = f"{self.BASE_TOPIC}/diagnostics/{diagnostic['topic']}/state"
+        attributes_topic = f"{self.BASE_TOPIC}/diagnostics/{diagnostic['topic']}/attributes"
+        
+        if entity_id not in self.registered_entities:
+            config = {
+                'name': diagnostic['name'],
+                'unique_id': object_id,
+                'object_id': object_id,
+                'state_topic': state_topic,
+                'json_attributes_topic': attributes_topic,
+                'availability_topic': self.availability_topic,
+                'entity_category': 'diagnostic',
+                'device': self.ADDON_DEVICE
+            }
+            for key in ('icon', 'device_class'):
+                if key in diagnostic:
+                    config[key] = diagnostic[key]
+            if not await self._publish(self._config_topic(object_id, component), json.dumps(config),
+                                       kind='config', qos=1):
+                return False
+            self.registered_entities[entity_id] = {}
+            self._registrations_dirty = True
+        
+        state = diagnostic['state']
+        payload = ('ON' if state else 'OFF') if isinstance(state, bool) else state
+        return (await self._publish(attributes_topic, json.dumps(diagnostic['attributes']), kind='diagnostic')
+                and await self._publish(state_topic, payload, kind='diagnostic'))
+    
+    async def update_diagnostic_states(self) -> bool:
+        """Publish add-on diagnostic entities"""
+        
+        success = True
+        for diagnostic in self._diagnostics():
+            if not await self._publish_diagnostic(diagnostic):
+                self.logger.error(f"Failed to update {diagnostic['name']} diagnostic state")
+                success = False
+        return success
+    
+    async def test_ha_connection(self) -> bool:
+        """Test the MQTT broker connection"""
+        
+        if await self._connect():
+            self.health.record(True)
+            self.logger.info("MQTT broker connection test successful")
+            return True
+        
+        self.logger.error("MQTT broker connection test failed")
+        return False
+    
+    async def cleanup(self) -> None:
+        """Mark entities unavailable and close the broker connection"""
+        client = self._client
+        if client is not None:
+            await self._publish(self.availability_topic, 'offline', kind='availability', qos=1)
+            await self._disconnect(client)
+        await super().cleanup()
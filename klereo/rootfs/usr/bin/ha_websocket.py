@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Persistent WebSocket transport to Home Assistant Core
+One authenticated connection, many pipelined messages correlated by id
+"""
+
+import asyncio
+import aiohttp
+import itertools
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from klereo_resilience import RetryPolicy
+
+# Called with the event of a subscription, from the read loop
+EventCallback = Callable[[Dict[str, Any]], None]
+
+class HAWebSocketError(Exception):
+    """Home Assistant answered a command with success: false"""
+    
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+class HAWebSocketClient:
+    """Long-lived WebSocket connection to the Home Assistant API
+    
+    Authenticates once with the access token, then sends commands without
+    waiting for earlier replies; each reply is matched to its caller by id.
+    A dropped connection fails the commands in flight and is reopened with
+    backoff by the next command, which also renews the event subscriptions.
+    """
+    
+    HEARTBEAT = 30  # seconds between WebSocket pings
+    
+    def __init__(self, url: str, token: str, logger: Optional[logging.Logger] = None,
+                 request_timeout: float = 30, retry_policy: Optional[RetryPolicy] = None):
+        """Initialize WebSocket client
+        
+        url is the Home Assistant base URL (e.g. http://supervisor/core).
+        """
+        self.url = url.rstrip('/').replace('http', 'ws', 1) + '/api/websocket'
+        self.token = token
+        self.logger = logger or logging.getLogger(__name__)
+        self.request_timeout = request_timeout
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=30.0)
+        
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        
+        # Event callbacks by event type, and by subscription id on this connection
+        self._listeners: Dict[str, EventCallback] = {}
+        self._subscriptions: Dict[int, EventCallback] = {}
+        self.ha_version: Optional[str] = None
+        self.reconnects = 0
+    
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+    
+    async def _open(self) -> None:
+        """Open and authenticate one connection"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        
+        ws = await self.session.ws_connect(self.url, heartbeat=self.HEARTBEAT, max_msg_size=0)
+        try:
+            hello = await ws.receive_json(timeout=self.request_timeout)
+            if hello.get('type') != 'auth_required':
+                raise ConnectionError(f"Unexpected WebSocket greeting: {hello.get('type')}")
+            
+            await ws.send_json({'type': 'auth', 'access_token': self.token})
+            reply = await ws.receive_json(timeout=self.request_timeout)
+            if reply.get('type') != 'auth_ok':
+                raise PermissionError(f"WebSocket authentication failed: {reply.get('message', reply.get('type'))}")
+        except BaseException:
+            await ws.close()
+            raise
+        
+        self.ha_version = reply.get('ha_version')
+        self._ws = ws
+        self._reader = asyncio.create_task(self._read_loop(ws))
+    
+    async def connect(self) -> bool:
+        """Connect if needed, retrying with backoff"""
+        
+        async with self._connect_lock:
+            if self.connected:
+                return True
+            
+            for attempt in range(1, self.retry_policy.max_attempts + 1):
+                try:
+                    await self._open()
+                    self.logger.info(f"Home Assistant WebSocket connected ({self.ha_version or 'unknown version'})")
+                    await self._resubscribe()
+                    return True
+                except PermissionError as e:
+                    self.logger.error(str(e))
+                    return False
+                except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, TypeError, ValueError) as e:
+                    if attempt == self.retry_policy.max_attempts:
+                        self.logger.error(f"Home Assistant WebSocket connection failed: {e}")
+                        return False
+                    delay = self.retry_policy.delay(attempt)
+                    self.logger.warning(f"Home Assistant WebSocket connection failed: {e}, "
+                                        f"retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            return False
+    
+    async def _resubscribe(self) -> None:
+        """Renew the event subscriptions on a new connection"""
+        for event_type, callback in self._listeners.items():
+            try:
+                await self.call({'type': 'subscribe_events', 'event_type': event_type}, on_event=callback)
+            except (HAWebSocketError, ConnectionError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"Home Assistant event subscription to {event_type} failed: {e}")
+    
+    async def _read_loop(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        """Dispatch replies to the commands waiting for them, and events to their callbacks"""
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                data = msg.json()
+                # Home Assistant may coalesce several messages into one JSON array
+                for message in data if isinstance(data, list) else (data,):
+                    if message.get('type') == 'event':
+                        callback = self._subscriptions.get(message.get('id'))
+                        if callback is not None:
+                            callback(message.get('event') or {})
+                        continue
+                    future = self._pending.pop(message.get('id'), None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+        except (aiohttp.ClientError, ValueError) as e:
+            self.logger.warning(f"Home Assistant WebSocket read failed: {e}")
+        finally:
+            if self._ws is ws:
+                self._ws = None
+                self.reconnects += 1
+            # Fail everything still waiting on this connection, whose subscriptions end with it
+            self._subscriptions = {}
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Home Assistant WebSocket closed"))
+    
+    async def call(self, message: Dict[str, Any], on_event: Optional[EventCallback] = None) -> Any:
+        """Send a command and return its result
+        
+        on_event receives the events the command subscribes to, for as long
+        as the connection lasts. Raises HAWebSocketError when Home Assistant
+        rejects the command and ConnectionError when no connection could be
+        made or it dropped.
+        """
+        if not self.connected and not await self.connect():
+            raise ConnectionError("Home Assistant WebSocket unavailable")
+        ws = self._ws
+        if ws is None:
+            raise ConnectionError("Home Assistant WebSocket closed")
+        
+        message_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        if on_event is not None:
+            self._subscriptions[message_id] = on_event
+        try:
+            await ws.send_json({**message, 'id': message_id})
+            reply = await asyncio.wait_for(future, timeout=self.request_timeout)
+        except (aiohttp.ClientError, ConnectionResetError) as e:
+            self._subscriptions.pop(message_id, None)
+            raise ConnectionError(f"Home Assistant WebSocket send failed: {e}") from e
+        except BaseException:
+            self._subscriptions.pop(message_id, None)
+            raise
+        finally:
+            self._pending.pop(message_id, None)
+        
+        if not reply.get('success', False):
+            self._subscriptions.pop(message_id, None)
+            error = reply.get('error') or {}
+            raise HAWebSocketError(error.get('code', 'unknown_error'), error.get('message', ''))
+        return reply.get('result')
+    
+    async def subscribe(self, event_type: str, callback: EventCallback) -> None:
+        """Subscribe to an event type, on this connection and every later one
+        
+        Raises like call(); a subscription Home Assistant rejects isn't kept.
+        """
+        await self.call({'type': 'subscribe_events', 'event_type': event_type}, on_event=callback)
+        self._listeners[event_type] = callback
+    
+    async def wait_closed(self) -> None:
+        """Wait until the current connection drops"""
+        if self._reader is not None:
+            # Unlike awaiting the task, cancelling this wait leaves the reader running
+            await asyncio.wait({self._reader})
+    
+    async def close(self) -> None:
+        """Close the connection and session"""
+        ws, self._ws = self._ws, None
+        if ws is not None:
+            await ws.close()
+        if self._reader:
+            await asyncio.gather(self._reader, return_exceptions=True)
+        if self.session and not self.session.closed:
+            await self.session.close()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Multi-account support for Klereo Pool Manager
+Several Klereo accounts polled from one process over a shared connection pool
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from klereo_async_api import AsyncKlereoAPI
+from klereo_cache import CacheStore
+from klereo_probes import PoolDetails, ProbeRecord
+from klereo_resilience import CircuitBreaker
+
+class KlereoAccount:
+    """One Klereo login with its own client, JWT, cache and circuit breaker"""
+    
+    def __init__(self, index: int, username: str, client: AsyncKlereoAPI):
+        """Initialize account"""
+        self.username = username
+        self.client = client
+        
+        # Name for diagnostics, which are served without authentication
+        self.label = f"account {index + 1}"
+        
+        # Pools this account serves, from its last index
+        self.pool_ids: List[str] = []
+        
+        # Every pool of its last index, including those another account serves
+        self.index_pool_ids: List[str] = []
+
+class AccountBreakers:
+    """Combined view of the per-account circuit breakers for diagnostics
+    
+    The worst state wins: open if any account's breaker is open, then
+    half-open, closed only when every account is healthy.
+    """
+    
+    SEVERITY = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+    
+    def __init__(self, accounts: List[KlereoAccount]):
+        """Initialize view"""
+        self.accounts = accounts
+    
+    @property
+    def state(self) -> str:
+        return max((account.client.breaker.state for account in self.accounts), key=self.SEVERITY.index)
+    
+    @property
+    def is_closed(self) -> bool:
+        return self.state == CircuitBreaker.CLOSED
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """State and counters for diagnostics, with the state of each account"""
+        snapshots = {account.label: account.client.breaker.snapshot() for account in self.accounts}
+        retry_in = [snapshot['retry_in'] for snapshot in snapshots.values() if snapshot['retry_in'] is not None]
+        return {
+            'state': self.state,
+            'consecutive_failures': max(snapshot['consecutive_failures'] for snapshot in snapshots.values()),
+            'failure_threshold': min(snapshot['failure_threshold'] for snapshot in snapshots.values()),
+            'times_opened': sum(snapshot['times_opened'] for snapshot in snapshots.values()),
+            'retry_in': min(retry_in) if retry_in else None,
+            'accounts': {label: snapshot['state'] for label, snapshot in snapshots.items()}
+        }
+
+class AccountHealth:
+    """Combined view of the per-account health trackers
+    
+    Healthy only when every account is: an account whose pools can't be
+    read is an outage for those pools. Idle for as long as the busiest
+    account, since a probe of any account tells whether Klereo is up.
+    """
+    
+    def __init__(self, accounts: List[KlereoAccount]):
+        """Initialize view"""
+        self.accounts = accounts
+    
+    @property
+    def healthy(self) -> bool:
+        return all(account.client.health.healthy for account in self.accounts)
+    
+    def idle_for(self) -> float:
+        return min(account.client.health.idle_for() for account in self.accounts)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Health and its figures for diagnostics, with the health of each account"""
+        snapshots = {account.label: account.client.health.snapshot() for account in self.accounts}
+        requests = sum(snapshot['requests'] for snapshot in snapshots.values())
+        successes = sum(snapshot['successes'] for snapshot in snapshots.values())
+        ages = [snapshot['last_success_age'] for snapshot in snapshots.values()]
+        idle = [snapshot['idle_for'] for snapshot in snapshots.values() if snapshot['idle_for'] is not None]
+        errors = [snapshot['last_error'] for snapshot in snapshots.values() if snapshot['last_error']]
+        return {
+            'healthy': self.healthy,
+            'success_rate': round(successes / requests, 3) if requests else None,
+            'requests': requests,
+            'successes': successes,
+            'consecutive_failures': max(snapshot['consecutive_failures'] for snapshot in snapshots.values()),
+            'last_success_age': None if None in ages else max(ages),
+            'idle_for': min(idle) if idle else None,
+            'last_error': errors[0] if errors else None,
+            'accounts': {label: snapshot['healthy'] for label, snapshot in snapshots.items()}
+        }
+
+class KlereoAccounts:
+    """Several Klereo accounts behind the interface of a single AsyncKlereoAPI
+    
+    Every account has its own client, hence its own JWT, cache namespace and
+    circuit breaker, but all clients share one HTTP session and therefore one
+    connection pool. Calls for a pool are routed to the account whose index
+    lists it; a pool visible to several accounts is served by the first.
+    """
+    
+    # Delay between account logins so they don't all hit GetJWT.php at once;
+    # refresh-ahead renews each token relative to its own login, keeping the gap
+    LOGIN_SPACING = 2.0  # seconds
+    
+    # Connections to the Klereo API shared by all accounts
+    DEFAULT_CONNECTION_LIMIT = 4
+    
+    def __init__(self, credentials: List[Tuple[str, str]], logger: Optional[logging.Logger] = None,
+                 cache_directory: Optional[str] = None,
+                 connection_limit: int = DEFAULT_CONNECTION_LIMIT,
+                 login_spacing: float = LOGIN_SPACING):
+        """Initialize accounts
+        
+        credentials is a list of (username, password). With a cache_directory,
+        each account persists its cache to its own file there. Must be created
+        inside the running event loop, which owns the shared session.
+        """
+        if not credentials:
+            raise ValueError("At least one Klereo account is required")
+        
+        self.logger = logger or logging.getLogger(__name__)
+        self.cache_directory = cache_directory
+        self.login_spacing = login_spacing
+        
+        # One connection pool for all accounts
+        self.session = AsyncKlereoAPI.create_session(
+            aiohttp.TCPConnector(limit_per_host=max(1, int(connection_limit))))
+        
+        self.accounts: List[KlereoAccount] = []
+        for index, (username, password) in enumerate(credentials):
+            client = AsyncKlereoAPI(
+                username=username,
+                password=password,
+                logger=self.logger,
+                session=self.session,
+                cache_store=self._cache_store(index, username)
+            )
+            self.accounts.append(KlereoAccount(index, username, client))
+        
+        # Pool id -> account serving it
+        self._routes: Dict[str, KlereoAccount] = {}
+        
+        # Whether the last get_pools() got every account's index
+        self.index_complete = False
+        
+        self.breaker = AccountBreakers(self.accounts)
+        self.health = AccountHealth(self.accounts)
+    
+    def _cache_store(self, index: int, username: str) -> Optional[CacheStore]:
+        """Cache file of an account; the first keeps the single-account file"""
+        if self.cache_directory is None:
+            return None
+        
+        if index == 0:
+            path = os.path.join(self.cache_directory, os.path.basename(CacheStore.DEFAULT_PATH))
+        else:
+            digest = hashlib.sha1(username.encode()).hexdigest()[:12]
+            path = os.path.join(self.cache_directory, f"klereo_cache_{digest}.json")
+        return CacheStore(path, namespace=username, logger=self.logger)
+    
+    def __len__(self) -> int:
+        return len(self.accounts)
+    
+    def account_for(self, pool_id: str) -> Optional[KlereoAccount]:
+        """Account serving a pool"""
+        return self._routes.get(pool_id)
+    
+    def _route(self, account: KlereoAccount, pools: Dict[str, str]) -> Dict[str, str]:
+        """Record the pools of an account's index, dropping those another account already serves
+        
+        A pool leaving the index of the account serving it passes to another
+        account still listing it, if any.
+        """
+        account.index_pool_ids = list(pools)
+        for pool_id in account.pool_ids:
+            if pool_id not in pools and self._routes.get(pool_id) is account:
+                heir = next((other for other in self.accounts
+                             if other is not account and pool_id in other.index_pool_ids), None)
+                if heir is None:
+                    del self._routes[pool_id]
+                else:
+                    self._routes[pool_id] = heir
+                    heir.pool_ids.append(pool_id)
+        
+        owned = {}
+        for pool_id, pool_name in pools.items():
+            owner = self._routes.setdefault(pool_id, account)
+            if owner is account:
+                owned[pool_id] = pool_name
+            else:
+                self.logger.debug("Pool %s is also visible to %s, served by %s",
+                                  pool_id, account.username, owner.username)
+        account.pool_ids = list(owned)
+        return owned
+    
+    async def test_connection(self) -> bool:
+        """Log every account in, spaced out; True if at least one account works"""
+        
+        async def connect(account: KlereoAccount, delay: float) -> bool:
+            await asyncio.sleep(delay)
+            if await account.client.test_connection():
+                return True
+            self.logger.error(f"Klereo account {account.username} connection failed")
+            return False
+        
+        results = await asyncio.gather(*(connect(account, i * self.login_spacing)
+                                         for i, account in enumerate(self.accounts)))
+        if len(self.accounts) > 1:
+            self.logger.info(f"{sum(results)}/{len(results)} Klereo accounts connected")
+        return any(results)
+    
+    async def get_jwt_token(self) -> Dict[str, Optional[str]]:
+        """Make sure every account holds a token; returns {username: token}"""
+        tokens = await asyncio.gather(*(account.client.get_jwt_token() for account in self.accounts))
+        return {account.username: token for account, token in zip(self.accounts, tokens)}
+    
+    async def get_pools(self, account: Optional[KlereoAccount] = None) -> Optional[Dict[str, str]]:
+        """Get pools of all accounts, or of one, as dict {pool_id: pool_name}"""
+        accounts = self.accounts if account is None else [account]
+        results = await asyncio.gather(*(account.client.get_pools() for account in accounts))
+        
+        if account is None:
+            self.index_complete = None not in results
+        
+        pools = {}
+        for account, account_pools in zip(accounts, results):
+            if account_pools is None:
+                self.logger.warning(f"No pools for Klereo account {account.username}")
+                continue
+            pools.update(self._route(account, account_pools))
+        return pools or None
+    
+    def pool_details_fresh_until(self, account: KlereoAccount) -> Optional[float]:
+        """Time when the first cached details of a pool in an account's index expire
+        
+        Each pool's details are cached by the account serving it, so a pool
+        shared with another account is looked up in that account's cache.
+        Returns None when the index is unknown or some pool has no cached
+        details, i.e. when polling now could fetch new data.
+        """
+        expiries = [(self.account_for(pool_id) or account).client.cache.expires_at(f'pool_details_{pool_id}')
+                    for pool_id in account.index_pool_ids]
+        if not expiries or None in expiries:
+            return None
+        return min(expiries)
+    
+    async def get_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Get detailed information for a specific pool from its account"""
+        account = self.account_for(pool_id)
+        if account is None:
+            self.logger.error(f"Pool {pool_id} is not in any account's index")
+            return None
+        return await account.client.get_pool_details(pool_id)
+    
+    async def get_pool_probes(self, pool_id: str) -> Optional[List[ProbeRecord]]:
+        """Get probe data for a specific pool from its account"""
+        account = self.account_for(pool_id)
+        if account is None:
+            self.logger.error(f"Pool {pool_id} is not in any account's index")
+            return None
+        return await account.client.get_pool_probes(pool_id)
+    
+    async def refresh_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Fetch the details of one pool upstream from its account, bypassing the cache"""
+        account = self.account_for(pool_id)
+        if account is None:
+            self.logger.error(f"Pool {pool_id} is not in any account's index")
+            return None
+        return await account.client.refresh_pool_details(pool_id)
+    
+    async def set_output(self, pool_id: str, index: int, on: bool) -> bool:
+        """Switch an output of a pool on or off through its account"""
+        account = self.account_for(pool_id)
+        if account is None:
+            self.logger.error(f"Pool {pool_id} is not in any account's index")
+            return False
+        return await account.client.set_output(pool_id, index, on)
+    
+    async def set_setpoint(self, pool_id: str, param: str, value: float) -> bool:
+        """Change a setpoint of a pool through its account"""
+        account = self.account_for(pool_id)
+        if account is None:
+            self.logger.error(f"Pool {pool_id} is not in any account's index")
+            return False
+        return await account.client.set_setpoint(pool_id, param, value)
+    
+    async def probe(self) -> bool:
+        """Probe every account; True if all answered"""
+        results = await asyncio.gather(*(account.client.probe() for account in self.accounts))
+        return all(results)
+    
+    def start_refresh_ahead(self) -> None:
+        """Start background refresh for every account"""
+        for account in self.accounts:
+            account.client.start_refresh_ahead()
+    
+    def save_cache(self) -> None:
+        """Persist the cache of every account"""
+        for account in self.accounts:
+            account.client.save_cache()
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Cache counters summed over accounts"""
+        stats: Dict[str, Any] = {}
+        for account in self.accounts:
+            for key, value in account.client.cache_stats().items():
+                if key != 'hit_ratio':
+                    stats[key] = stats.get(key, 0) + value
+        
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else None
+        return stats
+    
+    def info(self) -> Dict[str, Dict[str, Any]]:
+        """Per-account pools, breaker state and cache size for diagnostics, by account label"""
+        return {
+            account.label: {
+                'pools': len(account.pool_ids),
+                'circuit_breaker': account.client.breaker.state,
+                'healthy': account.client.health.healthy,
+                'cache_entries': len(account.client.cache)
+            }
+            for account in self.accounts
+        }
+    
+    async def close(self) -> None:
+        """Stop every client, then close the shared session"""
+        for account in self.accounts:
+            await account.client.close()
+        if not self.session.closed:
+            await self.session.close()
@@ -4,16 +4,20 @@ Klereo API Client for Home Assistant
 Converted from PHP Jeedom plugin
 """
 
-import requests
-import json
 import hashlib
 import time
 import logging
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Optional, Tuple, Any, Callable, Union
+from klereo_cache import CacheStore, TTLCache
+from klereo_health import UpstreamHealth
+from klereo_probes import PoolDetails, ProbeRecord, loads, parse_pool_details
+from klereo_profiling import span
+from klereo_scheduler import MaintenanceCalendar
 
-class KlereoAPI:
-    """Klereo API client for pool management"""
+class KlereoAPIBase:
+    """Shared configuration, caching and parsing for Klereo API clients"""
     
     # API Configuration
     API_ROOT = "https://connect.klereo.fr/php/"
@@ -25,6 +29,15 @@ class KlereoAPI:
     INDEX_REFRESH_INTERVAL = 3 * 3600 + 55 * 60  # 3 hours 55 minutes
     POOL_DETAILS_REFRESH_INTERVAL = 9 * 60 + 50  # 9 minutes 50 seconds
     
+    # Write requests: outputs switched from Home Assistant are put in manual
+    # mode, and commands are sent for immediate execution
+    OUTPUT_MODE_MANUAL = 0
+    COMMAND_MODE = 1
+    
+    # Socket timeouts
+    CONNECT_TIMEOUT = 10  # seconds
+    READ_TIMEOUT = 20  # seconds
+    
     # Maintenance windows (day_of_week: {from: HHMM, to: HHMM})
     MAINTENANCE_WINDOWS = {
         0: {'from': 145, 'to': 445},   # Sunday
@@ -35,21 +48,30 @@ class KlereoAPI:
         6: {'from': 130, 'to': 135},   # Saturday
     }
     
-    def __init__(self, username: str, password: str, logger: Optional[logging.Logger] = None):
+    def __init__(self, username: str, password: str, logger: Optional[logging.Logger] = None,
+                 cache_store: Optional[CacheStore] = None,
+                 cache_max_entries: int = TTLCache.DEFAULT_MAX_ENTRIES):
         """Initialize Klereo API client"""
         self.username = username
         self.password = password
         self.logger = logger or logging.getLogger(__name__)
         
-        # Cache for API data
-        self.cache = {}
+        # Cache for API data, optionally restored from disk
+        self.cache_store = cache_store
+        self.cache = TTLCache(cache_max_entries)
+        if cache_store:
+            self.cache.restore(self._decode_entries(cache_store.load()))
+        self._cache_dirty = False
         
-        # Session for HTTP requests
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': self.USER_AGENT,
-            'Content-Type': 'application/x-www-form-urlencoded'
-        })
+        # Last value stored per key, kept past expiry for degraded operation
+        self.last_known = {key: entry['value'] for key, entry in self.cache.snapshot().items()}
+        
+        # Maintenance windows, logged only when entering or leaving one
+        self.maintenance = MaintenanceCalendar(self.MAINTENANCE_WINDOWS)
+        self._in_maintenance = False
+        
+        # Outcomes of the requests made, for health checks
+        self.health = UpstreamHealth()
     
     def _get_now(self) -> datetime:
         """Get current datetime"""
@@ -57,78 +79,222 @@ class KlereoAPI:
     
     def _is_maintenance_ongoing(self) -> bool:
         """Check if maintenance is currently ongoing"""
-        now = self._get_now()
-        day_of_week = now.weekday()  # 0=Monday, 6=Sunday
-        current_time = now.hour * 100 + now.minute
-        
-        # Convert Python weekday to match PHP (0=Sunday)
-        php_day = 0 if day_of_week == 6 else day_of_week + 1
+        window = self.maintenance.current_window(self._get_now())
         
-        if php_day in self.MAINTENANCE_WINDOWS:
-            maintenance = self.MAINTENANCE_WINDOWS[php_day]
-            if maintenance['from'] <= current_time <= maintenance['to']:
-                self.logger.info(f"Maintenance ongoing: {maintenance['from']:04d}-{maintenance['to']:04d}")
-                return True
+        if window and not self._in_maintenance:
+            self.logger.info(f"Maintenance ongoing: {window[0]:%H%M}-{window[1] - timedelta(minutes=1):%H%M}")
+        elif not window and self._in_maintenance:
+            self.logger.info("Maintenance ended")
         
-        return False
+        self._in_maintenance = window is not None
+        return self._in_maintenance
     
     def _cache_get(self, key: str, default: Any = None) -> Any:
         """Get value from cache"""
-        if key in self.cache:
-            entry = self.cache[key]
-            if entry['expires'] > time.time():
-                return entry['value']
-            else:
-                del self.cache[key]
-        return default
+        with span('cache_get'):
+            return self.cache.get(key, default)
     
     def _cache_set(self, key: str, value: Any, ttl: int = 3600) -> None:
         """Set value in cache with TTL"""
-        self.cache[key] = {
-            'value': value,
-            'expires': time.time() + ttl
+        self.cache.set(key, value, ttl)
+        self.last_known[key] = value
+        self._cache_dirty = True
+    
+    def _get_login_data(self) -> Dict[str, str]:
+        """Build the GetJWT.php login form"""
+        password_hash = hashlib.sha1(self.password.encode()).hexdigest()
+        return {
+            'login': self.username,
+            'password': password_hash,
+            'version': self.WEB_VERSION
+        }
+    
+    def _parse_body(self, endpoint: str, status: int, content: Union[bytes, str]) -> Optional[Any]:
+        """Validate an HTTP response and decode its JSON body"""
+        
+        # Check HTTP status
+        if status != 200:
+            self.logger.error(f"HTTP {status} error for {endpoint}")
+            return None
+        
+        # Parse JSON response
+        try:
+            body = loads(content)
+        except ValueError:
+            self.logger.error(f"Invalid JSON response from {endpoint}")
+            return None
+        
+        # Check for API error
+        if isinstance(body, dict) and 'error' in body:
+            error_msg = body.get('detail', 'Unknown error')
+            self.logger.error(f"API error: {error_msg}")
+            return None
+        
+        return body
+    
+    def _extract_pools(self, index: List[Dict]) -> Dict[str, str]:
+        """Build {pool_id: pool_name} from index data"""
+        pools = {}
+        for pool in index:
+            pool_id = pool.get('idSystem')
+            pool_name = pool.get('poolNickname')
+            if pool_id and pool_name:
+                pools[pool_id] = pool_name
+        
+        return pools
+    
+    def _set_output_data(self, pool_id: str, index: int, on: bool) -> Dict[str, Any]:
+        """Build the SetOut.php form switching an output in manual mode"""
+        return {
+            'poolID': pool_id,
+            'outIdx': index,
+            'newMode': self.OUTPUT_MODE_MANUAL,
+            'newState': 1 if on else 0,
+            'comMode': self.COMMAND_MODE
+        }
+    
+    def _set_param_data(self, pool_id: str, param: str, value: float) -> Dict[str, Any]:
+        """Build the SetParam.php form changing a setpoint"""
+        return {
+            'poolID': pool_id,
+            'paramID': param,
+            'newValue': value,
+            'comMode': self.COMMAND_MODE
+        }
+    
+    def _command_sent(self, pool_id: str, endpoint: str, body: Optional[Dict]) -> bool:
+        """Check a write response; the pool's cached details are stale once it is accepted"""
+        if not body:
+            self.logger.error(f"{endpoint} failed for pool {pool_id}")
+            return False
+        
+        self.cache.delete(f'pool_details_{pool_id}')
+        self._cache_dirty = True
+        self.logger.debug("%s accepted for pool %s", endpoint, pool_id)
+        return True
+    
+    def _encode_entries(self, entries: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Cache entries in JSON-serializable form, pool details as rows"""
+        return {
+            key: {**entry, 'value': entry['value'].to_row()} if key.startswith('pool_details_') else entry
+            for key, entry in entries.items()
         }
     
-    def _make_request(self, endpoint: str, method: str = 'GET', data: Optional[Dict] = None, 
+    def _decode_entries(self, entries: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Inverse of _encode_entries, for entries loaded from disk"""
+        return {
+            key: {**entry, 'value': PoolDetails.from_row(entry['value'])} if key.startswith('pool_details_') else entry
+            for key, entry in entries.items()
+        }
+    
+    def save_cache(self) -> bool:
+        """Persist the cache if a store is configured and entries changed"""
+        if not self.cache_store or not self._cache_dirty:
+            return False
+        
+        if self.cache_store.save(self._encode_entries(self.cache.snapshot())):
+            self._cache_dirty = False
+            return True
+        return False
+    
+    def pool_details_fresh_until(self) -> Optional[float]:
+        """Time when the first cached pool details expire
+        
+        Returns None when the pool list is unknown or some pool has no cached
+        details, i.e. when polling now could fetch new data.
+        """
+        index = self.last_known.get('index')
+        if not index:
+            return None
+        
+        expiries = [self.cache.expires_at(f'pool_details_{pool_id}') for pool_id in self._extract_pools(index)]
+        if not expiries or None in expiries:
+            return None
+        return min(expiries)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Cache size, hit ratio and hit/miss/eviction counters"""
+        return {
+            'entries': len(self.cache),
+            'max_entries': self.cache.max_entries,
+            'hit_ratio': self.cache.hit_ratio(),
+            **self.cache.stats
+        }
+    
+    def clear_cache(self) -> None:
+        """Clear all cached data"""
+        self.cache.clear()
+        self.last_known.clear()
+        self._cache_dirty = True
+        self.logger.info("Cache cleared")
+
+class KlereoAPI(KlereoAPIBase):
+    """Klereo API client for pool management"""
+    
+    def __init__(self, username: str, password: str, logger: Optional[logging.Logger] = None,
+                 cache_store: Optional[CacheStore] = None,
+                 cache_max_entries: int = TTLCache.DEFAULT_MAX_ENTRIES):
+        """Initialize Klereo API client"""
+        super().__init__(username, password, logger, cache_store, cache_max_entries)
+        
+        # Imported here so the aiohttp-based add-on never loads requests
+        import requests
+        
+        # Session for HTTP requests
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': self.USER_AGENT,
+            'Content-Type': 'application/x-www-form-urlencoded'
+        })
+        
+        # Per-cache-key locks so threads missing the same key fetch it only once
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._key_locks_guard = threading.Lock()
+    
+    def _single_flight(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """Fetch a missing cache entry once, even with concurrent callers"""
+        with self._key_locks_guard:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        with lock:
+            # Another thread may have filled the entry while we waited
+            cached = self._cache_get(key)
+            if cached:
+                return cached
+            return fetch()
+    
+    def _make_request(self, endpoint: str, method: str = 'GET', data: Optional[Dict] = None,
                      headers: Optional[Dict] = None) -> Tuple[Optional[Dict], Optional[Dict]]:
         """Make HTTP request to Klereo API"""
         
         if self._is_maintenance_ongoing():
-            self.logger.warning("Maintenance ongoing, skipping request")
+            self.logger.debug("Maintenance ongoing, skipping request")
             return None, None
         
+        import requests
+        
         url = f"{self.API_ROOT}{endpoint}"
+        timeout = (self.CONNECT_TIMEOUT, self.READ_TIMEOUT)
         
         try:
-            if method.upper() == 'GET':
-                response = self.session.get(url, headers=headers)
-            elif method.upper() == 'POST':
-                response = self.session.post(url, data=data, headers=headers)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-            
-            # Check HTTP status
-            if response.status_code != 200:
-                self.logger.error(f"HTTP {response.status_code} error for {endpoint}")
-                return None, None
-            
-            # Parse JSON response
-            try:
-                body = response.json()
-            except json.JSONDecodeError:
-                self.logger.error(f"Invalid JSON response from {endpoint}")
-                return None, None
+            with span('klereo_request'):
+                if method.upper() == 'GET':
+                    response = self.session.get(url, headers=headers, timeout=timeout)
+                elif method.upper() == 'POST':
+                    response = self.session.post(url, data=data, headers=headers, timeout=timeout)
+                else:
+                    raise ValueError(f"Unsupported HTTP method: {method}")
             
-            # Check for API error
-            if isinstance(body, dict) and 'error' in body:
-                error_msg = body.get('detail', 'Unknown error')
-                self.logger.error(f"API error: {error_msg}")
+            body = self._parse_body(endpoint, response.status_code, response.content)
+            self.health.record(body is not None, None if body is not None else f"No valid response from {endpoint}")
+            if body is None:
                 return None, None
             
             return response.headers, body
             
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Request failed for {endpoint}: {e}")
+            self.health.record(False, str(e))
             return None, None
     
     def get_jwt_token(self) -> Optional[str]:
@@ -139,16 +305,13 @@ class KlereoAPI:
         if cached_token:
             return cached_token
         
-        # Prepare login data
-        password_hash = hashlib.sha1(self.password.encode()).hexdigest()
-        login_data = {
-            'login': self.username,
-            'password': password_hash,
-            'version': self.WEB_VERSION
-        }
+        return self._single_flight('jwt_token', self._fetch_jwt_token)
+    
+    def _fetch_jwt_token(self) -> Optional[str]:
+        """Log in and cache a fresh JWT token"""
         
         # Make login request
-        headers, body = self._make_request('GetJWT.php', method='POST', data=login_data)
+        headers, body = self._make_request('GetJWT.php', method='POST', data=self._get_login_data())
         
         if not body or 'jwt' not in body:
             self.logger.error("Failed to get JWT token")
@@ -170,6 +333,11 @@ class KlereoAPI:
         if cached_index:
             return cached_index
         
+        return self._single_flight('index', self._fetch_index)
+    
+    def _fetch_index(self) -> Optional[List[Dict]]:
+        """Fetch and cache a fresh pool index"""
+        
         # Get JWT token
         jwt_token = self.get_jwt_token()
         if not jwt_token:
@@ -188,7 +356,7 @@ class KlereoAPI:
         # Cache index data
         self._cache_set('index', index_data, self.INDEX_REFRESH_INTERVAL)
         
-        self.logger.debug(f"Index data obtained: {len(index_data)} pools")
+        self.logger.debug("Index data obtained: %d pools", len(index_data))
         return index_data
     
     def get_pools(self) -> Optional[Dict[str, str]]:
@@ -198,23 +366,21 @@ class KlereoAPI:
         if not index:
             return None
         
-        pools = {}
-        for pool in index:
-            pool_id = pool.get('idSystem')
-            pool_name = pool.get('poolNickname')
-            if pool_id and pool_name:
-                pools[pool_id] = pool_name
-        
-        return pools
+        return self._extract_pools(index)
     
-    def get_pool_details(self, pool_id: str) -> Optional[Dict]:
-        """Get detailed information for a specific pool"""
+    def get_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Get the parsed details (probes, outputs, setpoints) of a specific pool"""
         
         cache_key = f'pool_details_{pool_id}'
         cached_details = self._cache_get(cache_key)
-        if cached_details:
+        if cached_details is not None:
             return cached_details
         
+        return self._single_flight(cache_key, lambda: self._fetch_pool_details(pool_id))
+    
+    def _fetch_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Fetch and cache fresh details for a specific pool"""
+        
         # Get JWT token
         jwt_token = self.get_jwt_token()
         if not jwt_token:
@@ -224,45 +390,58 @@ class KlereoAPI:
         headers = {'Authorization': f'Bearer {jwt_token}'}
         data = {'idSystem': pool_id}
         
-        response_headers, body = self._make_request('GetPoolDetails.php', method='POST', 
+        response_headers, body = self._make_request('GetPoolDetails.php', method='POST',
                                                    data=data, headers=headers)
         
         if not body or 'response' not in body:
             self.logger.error(f"Failed to get pool details for {pool_id}")
             return None
         
-        pool_details = body['response']
+        # Only the parsed records are kept, not the response body
+        pool_details = parse_pool_details(body['response'])
         
         # Cache pool details
-        self._cache_set(cache_key, pool_details, self.POOL_DETAILS_REFRESH_INTERVAL)
+        self._cache_set(f'pool_details_{pool_id}', pool_details, self.POOL_DETAILS_REFRESH_INTERVAL)
         
-        self.logger.debug(f"Pool details obtained for {pool_id}")
+        self.logger.debug("Pool details obtained for %s", pool_id)
         return pool_details
     
-    def get_pool_probes(self, pool_id: str) -> Optional[List[Dict]]:
+    def get_pool_probes(self, pool_id: str) -> Optional[List[ProbeRecord]]:
         """Get probe data for a specific pool"""
         
         pool_details = self.get_pool_details(pool_id)
-        if not pool_details:
+        if pool_details is None:
             return None
         
-        # Extract probes from pool details
-        probes = []
+        return list(pool_details.probes)
+    
+    def refresh_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Fetch the details of one pool upstream, bypassing the cache"""
+        return self._fetch_pool_details(pool_id)
+    
+    def set_output(self, pool_id: str, index: int, on: bool) -> bool:
+        """Switch an output of a pool on or off"""
         
-        # This would need to be adapted based on actual API response structure
-        # The PHP code suggests there are probe values with filteredValue
-        if 'probes' in pool_details:
-            for probe in pool_details['probes']:
-                probe_data = {
-                    'logicalId': probe.get('logicalId'),
-                    'name': probe.get('name'),
-                    'filteredValue': probe.get('filteredValue'),
-                    'unit': probe.get('unit'),
-                    'type': probe.get('type')
-                }
-                probes.append(probe_data)
+        jwt_token = self.get_jwt_token()
+        if not jwt_token:
+            return False
+        
+        headers = {'Authorization': f'Bearer {jwt_token}'}
+        response_headers, body = self._make_request('SetOut.php', method='POST',
+                                                   data=self._set_output_data(pool_id, index, on), headers=headers)
+        return self._command_sent(pool_id, 'SetOut.php', body)
+    
+    def set_setpoint(self, pool_id: str, param: str, value: float) -> bool:
+        """Change a setpoint of a pool"""
+        
+        jwt_token = self.get_jwt_token()
+        if not jwt_token:
+            return False
         
-        return probes
+        headers = {'Authorization': f'Bearer {jwt_token}'}
+        response_headers, body = self._make_request('SetParam.php', method='POST',
+                                                   data=self._set_param_data(pool_id, param, value), headers=headers)
+        return self._command_sent(pool_id, 'SetParam.php', body)
     
     def test_connection(self) -> bool:
         """Test if API connection is working"""
@@ -278,11 +457,6 @@ class KlereoAPI:
         except Exception as e:
             self.logger.error(f"Connection test failed: {e}")
             return False
-    
-    def clear_cache(self) -> None:
-        """Clear all cached data"""
-        self.cache.clear()
-        self.logger.info("Cache cleared")
 
 # Example usage and testing
 if __name__ == "__main__":
@@ -314,4 +488,4 @@ if __name__ == "__main__":
                         for probe in probes:
                             print(f"      - {probe['name']}: {probe['filteredValue']} {probe['unit']}")
     else:
-        print("✗ Connection failed")
\ No newline at end of file
+        print("✗ Connection failed")
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Asynchronous Klereo API Client for Home Assistant
+aiohttp-based counterpart of KlereoAPI that never blocks the event loop
+"""
+
+import asyncio
+import aiohttp
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from klereo_api import KlereoAPIBase
+from klereo_cache import CacheStore, TTLCache
+from klereo_metrics import KLEREO_REQUEST_SECONDS, KLEREO_REQUESTS
+from klereo_probes import PoolDetails, ProbeRecord, parse_pool_details
+from klereo_profiling import span
+from klereo_resilience import CircuitBreaker, RetryPolicy
+
+class AsyncKlereoAPI(KlereoAPIBase):
+    """Asynchronous Klereo API client for pool management"""
+    
+    # Refresh-ahead: renew hot cache entries this long before they expire.
+    # Pool details are left to the poll scheduler, which polls when they expire.
+    REFRESH_AHEAD_MARGIN = 60  # seconds
+    REFRESH_AHEAD_CHECK_INTERVAL = 15  # seconds
+    REFRESH_AHEAD_KEYS = ('jwt_token', 'index')
+    
+    def __init__(self, username: str, password: str, logger: Optional[logging.Logger] = None,
+                 session: Optional[aiohttp.ClientSession] = None,
+                 cache_store: Optional[CacheStore] = None,
+                 cache_max_entries: int = TTLCache.DEFAULT_MAX_ENTRIES,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        """Initialize asynchronous Klereo API client"""
+        super().__init__(username, password, logger, cache_store, cache_max_entries)
+        
+        # Session for HTTP requests (created lazily inside the running loop)
+        self.session = session
+        self._owns_session = session is None
+        
+        # Resilience: retries for transient failures, breaker for a flapping upstream
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(logger=self.logger)
+        
+        # Background refresh-ahead task
+        self._refresh_task: Optional[asyncio.Task] = None
+        
+        # In-flight upstream fetches by cache key, shared by concurrent callers
+        self._inflight: Dict[str, asyncio.Future] = {}
+    
+    async def _single_flight(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fetch once per key; concurrent callers await the same result"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+            
+            def _done(_future: asyncio.Future) -> None:
+                if self._inflight.get(key) is _future:
+                    del self._inflight[key]
+            
+            future.add_done_callback(_done)
+        
+        # Shield so one caller timing out doesn't cancel the fetch for the others
+        return await asyncio.shield(future)
+    
+    @classmethod
+    def create_session(cls, connector: Optional[aiohttp.BaseConnector] = None) -> aiohttp.ClientSession:
+        """Create an HTTP session configured for the Klereo API, e.g. to share between clients"""
+        headers = {
+            'User-Agent': cls.USER_AGENT,
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+        timeout = aiohttp.ClientTimeout(total=None, connect=cls.CONNECT_TIMEOUT,
+                                        sock_read=cls.READ_TIMEOUT)
+        return aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector)
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get or create aiohttp session"""
+        if self.session is None or self.session.closed:
+            self.session = self.create_session()
+            self._owns_session = True
+        return self.session
+    
+    async def _send_request(self, endpoint: str, method: str, data: Optional[Dict],
+                            headers: Optional[Dict]) -> Tuple[Optional[Dict], Optional[Dict], Optional[str]]:
+        """Send a single request
+        
+        Returns (headers, body, transient_error). transient_error is set for
+        failures worth retrying: network errors, timeouts, HTTP 429 and 5xx.
+        """
+        
+        session = await self._get_session()
+        url = f"{self.API_ROOT}{endpoint}"
+        metric_endpoint = endpoint.split('.', 1)[0]
+        start = time.perf_counter()
+        
+        try:
+            async with session.request(method, url, data=data, headers=headers) as response:
+                status = response.status
+                content = await response.read()
+                response_headers = dict(response.headers)
+        except asyncio.TimeoutError:
+            KLEREO_REQUESTS.inc(endpoint=metric_endpoint, outcome='timeout')
+            return None, None, f"Request timed out for {endpoint}"
+        except aiohttp.ClientError as e:
+            KLEREO_REQUESTS.inc(endpoint=metric_endpoint, outcome='network_error')
+            return None, None, f"Request failed for {endpoint}: {e}"
+        finally:
+            KLEREO_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=metric_endpoint)
+        
+        if status == 429 or status >= 500:
+            KLEREO_REQUESTS.inc(endpoint=metric_endpoint, outcome='http_error')
+            return None, None, f"HTTP {status} error for {endpoint}"
+        
+        body = self._parse_body(endpoint, status, content)
+        if body is None:
+            KLEREO_REQUESTS.inc(endpoint=metric_endpoint, outcome='error')
+            return None, None, None
+        
+        KLEREO_REQUESTS.inc(endpoint=metric_endpoint, outcome='success')
+        return response_headers, body, None
+    
+    async def _make_request(self, endpoint: str, method: str = 'GET', data: Optional[Dict] = None,
+                            headers: Optional[Dict] = None,
+                            idempotent: bool = True) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Make HTTP request to Klereo API, retrying transient failures of idempotent calls"""
+        
+        method = method.upper()
+        if method not in ('GET', 'POST'):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        
+        if self._is_maintenance_ongoing():
+            self.logger.debug("Maintenance ongoing, skipping request")
+            return None, None
+        
+        if not self.breaker.allow_request():
+            self.logger.debug("Circuit breaker %s, skipping request to %s", self.breaker.state, endpoint)
+            return None, None
+        
+        # Spans the retries and their backoff, unlike the per-attempt request histogram
+        attempts = self.retry_policy.max_attempts if idempotent else 1
+        with span('klereo_request'):
+            for attempt in range(1, attempts + 1):
+                response_headers, body, error = await self._send_request(endpoint, method, data, headers)
+                
+                if error is None:
+                    # The upstream answered, even if with an API error
+                    self.breaker.record_success()
+                    # but only a usable answer counts as healthy
+                    self.health.record(body is not None, None if body is not None else f"No valid response from {endpoint}")
+                    return response_headers, body
+                
+                if attempt < attempts:
+                    delay = self.retry_policy.delay(attempt)
+                    self.logger.warning(f"{error}, retrying in {delay:.1f}s ({attempt}/{attempts})")
+                    await asyncio.sleep(delay)
+        
+        self.logger.error(error)
+        self.breaker.record_failure()
+        self.health.record(False, error)
+        return None, None
+    
+    async def get_jwt_token(self) -> Optional[str]:
+        """Get JWT authentication token"""
+        
+        # Check cache first
+        cached_token = self._cache_get('jwt_token')
+        if cached_token:
+            return cached_token
+        
+        return await self._single_flight('jwt_token', self._fetch_jwt_token)
+    
+    async def _fetch_jwt_token(self) -> Optional[str]:
+        """Log in and cache a fresh JWT token"""
+        
+        # Make login request
+        headers, body = await self._make_request('GetJWT.php', method='POST', data=self._get_login_data())
+        
+        if not body or 'jwt' not in body:
+            self.logger.error("Failed to get JWT token")
+            return None
+        
+        jwt_token = body['jwt']
+        
+        # Cache token (55 minutes TTL)
+        self._cache_set('jwt_token', jwt_token, self.JWT_REFRESH_INTERVAL)
+        
+        self.logger.debug("JWT token obtained successfully")
+        return jwt_token
+    
+    async def get_index(self) -> Optional[List[Dict]]:
+        """Get list of pools from API"""
+        
+        # Check cache first
+        cached_index = self._cache_get('index')
+        if cached_index:
+            return cached_index
+        
+        index = await self._single_flight('index', self._fetch_index)
+        return index if index is not None else self._get_stale('index')
+    
+    async def _fetch_index(self) -> Optional[List[Dict]]:
+        """Fetch and cache a fresh pool index"""
+        
+        # Get JWT token
+        jwt_token = await self.get_jwt_token()
+        if not jwt_token:
+            return None
+        
+        # Make index request
+        headers = {'Authorization': f'Bearer {jwt_token}'}
+        response_headers, body = await self._make_request('GetIndex.php', headers=headers)
+        
+        if not body or 'response' not in body:
+            self.logger.error("Failed to get index")
+            return None
+        
+        index_data = body['response']
+        
+        # Cache index data
+        self._cache_set('index', index_data, self.INDEX_REFRESH_INTERVAL)
+        
+        self.logger.debug("Index data obtained: %d pools", len(index_data))
+        return index_data
+    
+    async def get_pools(self) -> Optional[Dict[str, str]]:
+        """Get pools as dict {pool_id: pool_name}"""
+        
+        index = await self.get_index()
+        if not index:
+            return None
+        
+        return self._extract_pools(index)
+    
+    async def get_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Get the parsed details (probes, outputs, setpoints) of a specific pool"""
+        
+        cache_key = f'pool_details_{pool_id}'
+        cached_details = self._cache_get(cache_key)
+        if cached_details is not None:
+            return cached_details
+        
+        details = await self._single_flight(cache_key, lambda: self._fetch_pool_details(pool_id))
+        return details if details is not None else self._get_stale(cache_key)
+    
+    async def _fetch_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Fetch and cache fresh details for a specific pool"""
+        
+        # Get JWT token
+        jwt_token = await self.get_jwt_token()
+        if not jwt_token:
+            return None
+        
+        # Make pool details request
+        headers = {'Authorization': f'Bearer {jwt_token}'}
+        data = {'idSystem': pool_id}
+        
+        response_headers, body = await self._make_request('GetPoolDetails.php', method='POST',
+                                                          data=data, headers=headers)
+        
+        if not body or 'response' not in body:
+            self.logger.error(f"Failed to get pool details for {pool_id}")
+            return None
+        
+        # Only the parsed records are kept, not the response body
+        pool_details = parse_pool_details(body['response'])
+        
+        # Cache pool details
+        self._cache_set(f'pool_details_{pool_id}', pool_details, self.POOL_DETAILS_REFRESH_INTERVAL)
+        
+        self.logger.debug("Pool details obtained for %s", pool_id)
+        return pool_details
+    
+    async def get_pool_probes(self, pool_id: str) -> Optional[List[ProbeRecord]]:
+        """Get probe data for a specific pool"""
+        
+        pool_details = await self.get_pool_details(pool_id)
+        if pool_details is None:
+            return None
+        
+        return list(pool_details.probes)
+    
+    async def refresh_pool_details(self, pool_id: str) -> Optional[PoolDetails]:
+        """Fetch the details of one pool upstream, bypassing the cache
+        
+        Used after a write; a fetch already in flight for the regular cache
+        key may predate the write, so it isn't joined.
+        """
+        return await self._single_flight(f'refresh_pool_details_{pool_id}',
+                                         lambda: self._fetch_pool_details(pool_id))
+    
+    async def set_output(self, pool_id: str, index: int, on: bool) -> bool:
+        """Switch an output of a pool on or off"""
+        
+        jwt_token = await self.get_jwt_token()
+        if not jwt_token:
+            return False
+        
+        # Writes aren't idempotent, so they are never retried
+        headers = {'Authorization': f'Bearer {jwt_token}'}
+        response_headers, body = await self._make_request('SetOut.php', method='POST',
+                                                          data=self._set_output_data(pool_id, index, on),
+                                                          headers=headers, idempotent=False)
+        return self._command_sent(pool_id, 'SetOut.php', body)
+    
+    async def set_setpoint(self, pool_id: str, param: str, value: float) -> bool:
+        """Change a setpoint of a pool"""
+        
+        jwt_token = await self.get_jwt_token()
+        if not jwt_token:
+            return False
+        
+        headers = {'Authorization': f'Bearer {jwt_token}'}
+        response_headers, body = await self._make_request('SetParam.php', method='POST',
+                                                          data=self._set_param_data(pool_id, param, value),
+                                                          headers=headers, idempotent=False)
+        return self._command_sent(pool_id, 'SetParam.php', body)
+    
+    async def test_connection(self) -> bool:
+        """Test if API connection is working"""
+        
+        try:
+            jwt_token = await self.get_jwt_token()
+            if not jwt_token:
+                return False
+            
+            pools = await self.get_pools()
+            return pools is not None
+            
+        except Exception as e:
+            self.logger.error(f"Connection test failed: {e}")
+            return False
+    
+    async def probe(self) -> bool:
+        """Cheap active health check: refetch the pool index, bypassing the cache"""
+        try:
+            return await self._refresh_entry('index')
+        except Exception as e:
+            self.logger.warning(f"Klereo health probe failed: {e}")
+            return False
+    
+    def _get_stale(self, key: str) -> Any:
+        """Last known value for a key while the circuit breaker is not closed"""
+        if self.breaker.is_closed:
+            return None
+        
+        value = self.last_known.get(key)
+        if value is not None:
+            self.logger.debug("Circuit breaker %s, serving last known %s", self.breaker.state, key)
+        return value
+    
+    async def _refresh_entry(self, key: str) -> bool:
+        """Refetch the upstream data behind a cache key"""
+        if key == 'jwt_token':
+            fetch = self._fetch_jwt_token
+        elif key == 'index':
+            fetch = self._fetch_index
+        elif key.startswith('pool_details_'):
+            pool_id = key[len('pool_details_'):]
+            fetch = lambda: self._fetch_pool_details(pool_id)
+        else:
+            return False
+        
+        return await self._single_flight(key, fetch) is not None
+    
+    async def _refresh_ahead_loop(self) -> None:
+        """Renew hot cache entries shortly before they expire"""
+        while True:
+            await asyncio.sleep(self.REFRESH_AHEAD_CHECK_INTERVAL)
+            
+            keys = [key for key in self.cache.expiring_keys(self.REFRESH_AHEAD_MARGIN)
+                    if key in self.REFRESH_AHEAD_KEYS]
+            if not keys or self._is_maintenance_ongoing():
+                continue
+            
+            # Renew the token first so the other refreshes reuse it
+            keys.sort(key=lambda key: key != 'jwt_token')
+            for key in keys:
+                try:
+                    if await self._refresh_entry(key):
+                        self.cache.stats['refreshes'] += 1
+                        self.logger.debug("Refreshed cache entry ahead of expiry: %s", key)
+                except Exception as e:
+                    self.logger.warning(f"Background refresh of {key} failed: {e}")
+    
+    def start_refresh_ahead(self) -> None:
+        """Start background refresh of cache entries before they expire"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_ahead_loop())
+    
+    async def close(self) -> None:
+        """Stop background refresh and close the HTTP session if this client created it"""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+        
+        if self._owns_session and self.session and not self.session.closed:
+            await self.session.close()
+
+# Example usage and testing
+if __name__ == "__main__":
+    
+    async def main():
+        logging.basicConfig(level=logging.DEBUG)
+        
+        # This would normally come from config
+        api = AsyncKlereoAPI("your_username", "your_password")
+        
+        try:
+            if await api.test_connection():
+                print("✓ Connection successful")
+                
+                pools = await api.get_pools()
+                if pools:
+                    print(f"✓ Found {len(pools)} pools:")
+                    for pool_id, pool_name in pools.items():
+                        print(f"  - {pool_name} (ID: {pool_id})")
+                        
+                        probes = await api.get_pool_probes(pool_id)
+                        if probes:
+                            print(f"    ✓ Found {len(probes)} probes")
+                            for probe in probes:
+                                print(f"      - {probe['name']}: {probe['filteredValue']} {probe['unit']}")
+            else:
+                print("✗ Connection failed")
+        finally:
+            await api.close()
+    
+    asyncio.run(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Caching and cache persistence for Klereo Pool Manager
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+def write_json_atomic(path: str, data: Any) -> None:
+    """Write JSON to a temporary file in the same directory, then rename it over path"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after a per-entry TTL"""
+    
+    DEFAULT_MAX_ENTRIES = 1024
+    
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """Initialize cache"""
+        self.max_entries = max(1, int(max_entries))
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'refreshes': 0}
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry['expires'] > time.time()
+    
+    def expires_at(self, key: str) -> Optional[float]:
+        """Expiry timestamp of an unexpired entry, without counting a lookup"""
+        entry = self._entries.get(key)
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry['expires']
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get an unexpired value, marking it as recently used"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return default
+        
+        if entry['expires'] <= time.time():
+            del self._entries[key]
+            self.stats['expirations'] += 1
+            self.stats['misses'] += 1
+            return default
+        
+        self._entries.move_to_end(key)
+        entry['accessed'] = True
+        self.stats['hits'] += 1
+        return entry['value']
+    
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """Store a value, evicting the least recently used entries beyond the bound"""
+        self._entries[key] = {
+            'value': value,
+            'expires': time.time() + ttl,
+            'accessed': False
+        }
+        self._entries.move_to_end(key)
+        
+        if len(self._entries) > self.max_entries:
+            self.purge_expired()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+    
+    def delete(self, key: str) -> None:
+        """Remove an entry if present"""
+        self._entries.pop(key, None)
+    
+    def clear(self) -> None:
+        """Remove all entries"""
+        self._entries.clear()
+    
+    def purge_expired(self) -> int:
+        """Drop expired entries and return how many were removed"""
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if entry['expires'] <= now]
+        for key in expired:
+            del self._entries[key]
+        self.stats['expirations'] += len(expired)
+        return len(expired)
+    
+    def expiring_keys(self, within: float, accessed_only: bool = True) -> List[str]:
+        """Keys that expire within the given number of seconds
+        
+        With accessed_only, only entries read since they were stored are
+        returned, so refresh-ahead never keeps unused data warm.
+        """
+        deadline = time.time() + within
+        return [
+            key for key, entry in self._entries.items()
+            if entry['expires'] <= deadline and (entry['accessed'] or not accessed_only)
+        ]
+    
+    def hit_ratio(self) -> Optional[float]:
+        """Fraction of lookups served from cache"""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else None
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Unexpired entries as {key: {'value', 'expires'}} for persistence"""
+        now = time.time()
+        return {
+            key: {'value': entry['value'], 'expires': entry['expires']}
+            for key, entry in self._entries.items() if entry['expires'] > now
+        }
+    
+    def restore(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        """Load persisted entries, keeping their absolute expiry"""
+        now = time.time()
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['expires']):
+            if entry['expires'] > now:
+                self.set(key, entry['value'], entry['expires'] - now)
+
+class CacheStore:
+    """JSON file backend that persists API cache entries across restarts"""
+    
+    # 2: pool details persisted as probe record rows instead of response bodies
+    # 3: pool details rows carry outputs and setpoints along with the probes
+    VERSION = 3
+    DEFAULT_PATH = '/data/klereo_cache.json'
+    
+    def __init__(self, path: str = DEFAULT_PATH, namespace: str = '', logger: Optional[logging.Logger] = None):
+        """Initialize cache store
+        
+        namespace identifies the account owning the entries; a file written
+        for another account is ignored.
+        """
+        self.path = path
+        self.namespace = hashlib.sha1(namespace.encode()).hexdigest()
+        self.logger = logger or logging.getLogger(__name__)
+    
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load unexpired cache entries from disk"""
+        
+        if not os.path.exists(self.path):
+            return {}
+        
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.warning(f"Ignoring unreadable cache file {self.path}: {e}")
+            return {}
+        
+        if (not isinstance(data, dict) or data.get('version') != self.VERSION
+                or data.get('namespace') != self.namespace):
+            self.logger.info("Ignoring cache file from another version or account")
+            return {}
+        
+        now = time.time()
+        entries = {
+            key: entry for key, entry in data.get('entries', {}).items()
+            if entry.get('expires', 0) > now
+        }
+        
+        self.logger.debug("Loaded %d cache entries from %s", len(entries), self.path)
+        return entries
+    
+    def save(self, entries: Dict[str, Dict[str, Any]]) -> bool:
+        """Atomically write cache entries to disk"""
+        
+        data = {
+            'version': self.VERSION,
+            'namespace': self.namespace,
+            'entries': entries
+        }
+        
+        try:
+            write_json_atomic(self.path, data)
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.error(f"Failed to save cache to {self.path}: {e}")
+            return False
+        
+        self.logger.debug("Saved %d cache entries to %s", len(entries), self.path)
+        return True
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Pool control for Klereo Pool Manager
+Queue of output and setpoint writes, coalesced and rate limited per pool
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from klereo_metrics import CONTROL_COMMANDS
+
+# Command kinds
+OUTPUT = 'output'
+SETPOINT = 'setpoint'
+
+# Setpoints exposed as number entities, for the params kept by
+# klereo_probes.SETPOINT_PARAMS: param -> (name, unit, min, max, step, icon)
+SETPOINTS: Dict[str, Tuple[str, str, float, float, float, str]] = {
+    'Heating_Setpoint': ('Water Temperature Setpoint', '°C', 10, 40, 0.5, 'mdi:thermometer-water'),
+    'pH_Setpoint': ('pH Setpoint', 'pH', 6.5, 8.0, 0.05, 'mdi:ph'),
+    'ORP_Setpoint': ('ORP Setpoint', 'mV', 400, 900, 10, 'mdi:alpha-r-circle'),
+    'Chlorine_Setpoint': ('Chlorine Setpoint', 'mg/L', 0, 5, 0.1, 'mdi:water-percent'),
+}
+
+def control_id(kind: str, key: Any) -> str:
+    """Topic-safe identifier of an output or setpoint within its pool"""
+    return f"out_{key}" if kind == OUTPUT else f"param_{key}"
+
+def parse_control_id(identifier: str) -> Optional[Tuple[str, Any]]:
+    """(kind, key) from control_id() output, None when it names no control"""
+    prefix, _, key = identifier.partition('_')
+    if prefix == 'out' and key.isdigit():
+        return OUTPUT, int(key)
+    if prefix == 'param' and key in SETPOINTS:
+        return SETPOINT, key
+    return None
+
+class ControlCommand:
+    """Pending write of an output state or a setpoint value"""
+    
+    __slots__ = ('pool_id', 'kind', 'key', 'value', 'due_at', 'coalesced', 'future')
+    
+    def __init__(self, pool_id: str, kind: str, key: Any, value: Any, due_at: float):
+        """Initialize command; must be created inside the running event loop"""
+        self.pool_id = pool_id
+        self.kind = kind
+        self.key = key
+        self.value = value
+        self.due_at = due_at
+        self.coalesced = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+    
+    @property
+    def target(self) -> Tuple[str, str, Any]:
+        return self.pool_id, self.kind, self.key
+    
+    def resolve(self, result: bool) -> None:
+        """Tell the submitters (of every coalesced command) how the write went"""
+        if not self.future.done():
+            self.future.set_result(result)
+
+class CommandQueue:
+    """Control writes, one worker per pool
+    
+    A command is sent coalesce_window seconds after it is submitted. Until
+    then, and while it waits for the rate limit, a newer command for the same
+    output or setpoint only replaces its value, so a burst of toggles costs
+    at most one upstream write, and none when the last value is the current
+    state anyway. Writes to a pool are spaced at least min_interval seconds
+    apart. on_written runs after each accepted write, on_settled once a pool
+    that was written to has nothing left pending.
+    """
+    
+    DEFAULT_COALESCE_WINDOW = 0.5  # seconds
+    DEFAULT_MIN_INTERVAL = 2.0     # seconds between writes to one pool
+    
+    def __init__(self, write: Callable[[ControlCommand], Awaitable[bool]],
+                 current: Optional[Callable[[ControlCommand], Any]] = None,
+                 on_written: Optional[Callable[[ControlCommand], Awaitable[Any]]] = None,
+                 on_settled: Optional[Callable[[str], Awaitable[Any]]] = None,
+                 coalesce_window: float = DEFAULT_COALESCE_WINDOW,
+                 min_interval: float = DEFAULT_MIN_INTERVAL,
+                 logger: Optional[logging.Logger] = None):
+        """Initialize queue
+        
+        write sends one command upstream and returns whether it was accepted;
+        current returns the state Home Assistant shows for a command's target.
+        """
+        self.write = write
+        self.current = current
+        self.on_written = on_written
+        self.on_settled = on_settled
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+        self.logger = logger or logging.getLogger(__name__)
+        
+        # Pending commands per pool by (kind, key), oldest first
+        self._pending: Dict[str, Dict[Tuple[str, Any], ControlCommand]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._last_write: Dict[str, float] = {}
+        self.stats = {'submitted': 0, 'written': 0, 'coalesced': 0, 'unchanged': 0, 'failed': 0}
+    
+    def submit(self, pool_id: str, kind: str, key: Any, value: Any) -> asyncio.Future:
+        """Queue a command; the future resolves to whether the target ended up at value"""
+        self.stats['submitted'] += 1
+        pending = self._pending.setdefault(pool_id, {})
+        
+        command = pending.get((kind, key))
+        if command is None:
+            command = ControlCommand(pool_id, kind, key, value, time.monotonic() + self.coalesce_window)
+            pending[(kind, key)] = command
+        else:
+            command.value = value
+            command.coalesced += 1
+            self.stats['coalesced'] += 1
+            CONTROL_COMMANDS.inc(kind=kind, outcome='coalesced')
+        
+        worker = self._workers.get(pool_id)
+        if worker is None or worker.done():
+            self._workers[pool_id] = asyncio.create_task(self._drain(pool_id))
+        return command.future
+    
+    def pending(self) -> int:
+        """Commands waiting to be sent"""
+        return sum(len(commands) for commands in self._pending.values())
+    
+    async def _drain(self, pool_id: str) -> None:
+        """Send a pool's commands oldest first, then let on_settled refresh it"""
+        try:
+            while True:
+                written = False
+                pending = self._pending.get(pool_id, {})
+                while pending:
+                    command = next(iter(pending.values()))
+                    ready_at = max(command.due_at, self._last_write.get(pool_id, 0) + self.min_interval)
+                    delay = ready_at - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    
+                    # Sent with the latest value submitted while waiting
+                    del pending[(command.kind, command.key)]
+                    written |= await self._send(command)
+                
+                if written and self.on_settled is not None:
+                    try:
+                        await self.on_settled(pool_id)
+                    except Exception as e:
+                        self.logger.error(f"Refresh of pool {pool_id} after a command failed: {e}")
+                
+                # Commands submitted during the refresh are sent by this worker too
+                if not self._pending.get(pool_id):
+                    self._pending.pop(pool_id, None)
+                    return
+        finally:
+            if self._workers.get(pool_id) is asyncio.current_task():
+                del self._workers[pool_id]
+    
+    async def _send(self, command: ControlCommand) -> bool:
+        """Write one command unless its target is already at the value
+        
+        Returns True when a write was attempted, accepted or not.
+        """
+        if self.current is not None and self.current(command) == command.value:
+            self.stats['unchanged'] += 1
+            CONTROL_COMMANDS.inc(kind=command.kind, outcome='unchanged')
+            command.resolve(True)
+            return False
+        
+        try:
+            accepted = await self.write(command)
+        except Exception as e:
+            self.logger.error(f"Control command {command.kind} {command.key} for pool {command.pool_id} failed: {e}")
+            accepted = False
+        self._last_write[command.pool_id] = time.monotonic()
+        
+        if not accepted:
+            self.stats['failed'] += 1
+            CONTROL_COMMANDS.inc(kind=command.kind, outcome='failed')
+            command.resolve(False)
+            return True
+        
+        self.stats['written'] += 1
+        CONTROL_COMMANDS.inc(kind=command.kind, outcome='written')
+        self.logger.info(f"Pool {command.pool_id}: {command.kind} {command.key} set to {command.value}"
+                         + (f" ({command.coalesced} commands coalesced)" if command.coalesced else ""))
+        if self.on_written is not None:
+            try:
+                await self.on_written(command)
+            except Exception as e:
+                self.logger.error(f"Publishing control state for pool {command.pool_id} failed: {e}")
+        command.resolve(True)
+        return True
+    
+    async def close(self) -> None:
+        """Stop the workers; commands not sent yet resolve to False"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        
+        for pending in self._pending.values():
+            for command in pending.values():
+                command.resolve(False)
+        self._pending.clear()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Incremental discovery for Klereo Pool Manager
+Diffs Klereo pools and probes against the registered devices and entities,
+and persists the registrations across restarts
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from klereo_cache import write_json_atomic
+from klereo_entities import EntityDescriptorCache
+
+Registrations = Dict[str, Dict[str, Any]]
+
+def probe_signature(probes: Iterable[Dict]) -> Tuple:
+    """Identity of a pool's probe list, ignoring values"""
+    return tuple((probe['logicalId'], probe['name'], probe.get('unit', '')) for probe in probes)
+
+def statistics_source(registered: Dict[str, Any]) -> str:
+    """logicalId of the probe a registered statistics sensor summarizes"""
+    source = registered['statistics']
+    if isinstance(source, str):
+        return source
+    # Registered before the source was recorded: <logicalId>_<window>_<stat>
+    return str(registered.get('logical_id', '')).rsplit('_', 2)[0]
+
+class DiscoveryDiff:
+    """Devices and entities to add, change and remove so Home Assistant matches Klereo"""
+    
+    def __init__(self):
+        """Initialize empty diff"""
+        self.added_devices: Dict[str, str] = {}    # pool_id -> pool name
+        self.changed_devices: Dict[str, str] = {}  # pool_id -> new pool name
+        self.removed_devices: List[str] = []       # device ids
+        self.added_entities: List[Tuple[str, Dict]] = []    # (pool_id, probe)
+        self.changed_entities: List[Tuple[str, Dict]] = []  # (pool_id, probe)
+        self.removed_entities: List[str] = []      # entity ids
+    
+    def __bool__(self) -> bool:
+        return any((self.added_devices, self.changed_devices, self.removed_devices,
+                    self.added_entities, self.changed_entities, self.removed_entities))
+    
+    def __str__(self) -> str:
+        return (f"devices +{len(self.added_devices)} ~{len(self.changed_devices)} -{len(self.removed_devices)}, "
+                f"entities +{len(self.added_entities)} ~{len(self.changed_entities)} -{len(self.removed_entities)}")
+    
+    def removals(self) -> 'DiscoveryDiff':
+        """The removed devices and entities, as a diff of their own"""
+        diff = DiscoveryDiff()
+        diff.removed_devices = list(self.removed_devices)
+        diff.removed_entities = list(self.removed_entities)
+        return diff
+    
+    def for_pool(self, pool_id: str) -> 'DiscoveryDiff':
+        """The device addition or rename of one pool, as a diff of its own"""
+        diff = DiscoveryDiff()
+        if pool_id in self.added_devices:
+            diff.added_devices[pool_id] = self.added_devices[pool_id]
+        if pool_id in self.changed_devices:
+            diff.changed_devices[pool_id] = self.changed_devices[pool_id]
+        return diff
+    
+    def diff_pools(self, registered_devices: Registrations, pools: Dict[str, str],
+                   device_id_for: Callable[[str], str], remove_missing: bool = True) -> 'DiscoveryDiff':
+        """Compare the pool index with the registered devices
+        
+        remove_missing is only safe when pools is the complete index; a pool
+        missing from a partial one may still exist.
+        """
+        for pool_id, pool_name in pools.items():
+            registered = registered_devices.get(device_id_for(pool_id))
+            if registered is None:
+                self.added_devices[pool_id] = pool_name
+            elif registered.get('pool_name') != pool_name:
+                self.changed_devices[pool_id] = pool_name
+        
+        if remove_missing:
+            self.removed_devices.extend(device_id for device_id, registered in registered_devices.items()
+                                        if registered.get('pool_id') not in pools)
+        return self
+    
+    def diff_probes(self, registered_entities: Registrations, pool_id: str, probes: List[Dict],
+                    descriptors: EntityDescriptorCache, reregister: bool = False) -> 'DiscoveryDiff':
+        """Compare a pool's probe list with its registered entities
+        
+        With reregister, every registered entity of the pool counts as changed.
+        """
+        current = set()
+        logical_ids = set()
+        for probe in probes:
+            descriptor = descriptors.get(pool_id, probe)
+            current.add(descriptor.entity_id)
+            logical_ids.add(str(probe['logicalId']))
+            
+            registered = registered_entities.get(descriptor.entity_id)
+            if registered is None:
+                self.added_entities.append((pool_id, probe))
+            elif reregister or registered.get('fingerprint') != descriptor.fingerprint():
+                self.changed_entities.append((pool_id, probe))
+        
+        # Statistics sensors only appear once their window has data, so they
+        # go with the probe they summarize; control entities are registered
+        # from the pool's outputs and aren't diffed
+        self.removed_entities.extend(
+            entity_id for entity_id, registered in registered_entities.items()
+            if registered.get('pool_id') == pool_id and not registered.get('control')
+            and (statistics_source(registered) not in logical_ids if registered.get('statistics')
+                 else entity_id not in current))
+        return self
+
+class RegistrationStore:
+    """JSON file that persists registered devices and entities across restarts"""
+    
+    VERSION = 1
+    DEFAULT_PATH = '/data/klereo_registrations.json'
+    
+    def __init__(self, path: str = DEFAULT_PATH, namespace: str = '', logger: Optional[logging.Logger] = None):
+        """Initialize registration store
+        
+        namespace identifies where the registrations were made (Home Assistant
+        URL or MQTT broker); a file written for another target is ignored.
+        """
+        self.path = path
+        self.namespace = hashlib.sha1(namespace.encode()).hexdigest()
+        self.logger = logger or logging.getLogger(__name__)
+    
+    def load(self) -> Tuple[Registrations, Registrations]:
+        """Load (devices, entities) from disk"""
+        
+        if not os.path.exists(self.path):
+            return {}, {}
+        
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.warning(f"Ignoring unreadable registrations file {self.path}: {e}")
+            return {}, {}
+        
+        if (not isinstance(data, dict) or data.get('version') != self.VERSION
+                or data.get('namespace') != self.namespace):
+            self.logger.info("Ignoring registrations file from another version or output")
+            return {}, {}
+        
+        devices, entities = data.get('devices', {}), data.get('entities', {})
+        self.logger.debug("Loaded %d devices and %d entities from %s", len(devices), len(entities), self.path)
+        return devices, entities
+    
+    def save(self, devices: Registrations, entities: Registrations) -> bool:
+        """Atomically write the registrations to disk"""
+        
+        data = {
+            'version': self.VERSION,
+            'namespace': self.namespace,
+            'devices': devices,
+            'entities': entities
+        }
+        
+        try:
+            write_json_atomic(self.path, data)
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.error(f"Failed to save registrations to {self.path}: {e}")
+            return False
+        
+        self.logger.debug("Saved %d devices and %d entities to %s", len(devices), len(entities), self.path)
+        return True
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Probe classification and precomputed entity descriptors for Klereo Pool Manager
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Probe kinds in match order: (kind, name keywords, device class, icon).
+# The first kind with a keyword contained in the lowercased probe name wins.
+PROBE_KINDS: Tuple[Tuple[str, Tuple[str, ...], Optional[str], str], ...] = (
+    ('temperature', ('temperature', 'temp'), 'temperature', 'mdi:thermometer'),
+    ('ph', ('ph',), None, 'mdi:ph'),  # pH doesn't have a specific device class
+    ('chlorine', ('chlorine', 'cl'), None, 'mdi:water-percent'),
+    ('orp', ('orp', 'redox'), None, 'mdi:alpha-r-circle'),
+    ('level', ('level', 'water'), None, 'mdi:waves'),
+)
+
+DEFAULT_ICON = 'mdi:gauge'
+
+def classify_probe(name: str) -> Tuple[Optional[str], Optional[str], str]:
+    """Classify a probe by name into (kind, device class, icon)"""
+    lowered = name.lower()
+    for kind, keywords, device_class, icon in PROBE_KINDS:
+        for keyword in keywords:
+            if keyword in lowered:
+                return kind, device_class, icon
+    return None, None, DEFAULT_ICON
+
+def entity_id_for(pool_id: str, probe_name: str, domain: str = 'sensor') -> str:
+    """Entity ID of a pool probe, or of a pool control in another domain"""
+    sanitized_name = probe_name.lower().replace(' ', '_').replace('-', '_')
+    return f"{domain}.klereo_{pool_id}_{sanitized_name}"
+
+class EntityDescriptor:
+    """Everything about a probe entity that doesn't change between updates"""
+    
+    __slots__ = ('pool_id', 'logical_id', 'name', 'unit', 'kind', 'device_class', 'icon',
+                 'entity_id', 'unique_id', 'device_id', 'state_endpoint', 'attributes')
+    
+    def __init__(self, pool_id: str, probe_data: Dict, device_id: str):
+        """Build the descriptor from a probe as returned by get_pool_probes"""
+        self.pool_id = pool_id
+        self.logical_id = probe_data['logicalId']
+        self.name = probe_data['name']
+        self.unit = probe_data.get('unit', '')
+        self.kind, self.device_class, self.icon = classify_probe(self.name)
+        
+        self.entity_id = entity_id_for(pool_id, self.name)
+        self.unique_id = f"klereo_{pool_id}_{self.logical_id}"
+        self.device_id = device_id
+        self.state_endpoint = f"states/{self.entity_id}"
+        
+        # Shared by every state update; never mutated after construction
+        self.attributes = {
+            'unit_of_measurement': self.unit,
+            'friendly_name': self.name,
+            'device_class': self.device_class
+        }
+    
+    def matches(self, probe_data: Dict) -> bool:
+        """Check whether the probe still has the name and unit this descriptor was built from"""
+        return probe_data['name'] == self.name and probe_data.get('unit', '') == self.unit
+    
+    def fingerprint(self) -> List[Any]:
+        """Registered fields, compared to detect entities that need re-registering"""
+        return [self.name, self.unit, self.device_class, self.icon]
+    
+    def registration_data(self) -> Dict[str, Any]:
+        """Entity registry payload"""
+        return {
+            'entity_id': self.entity_id,
+            'name': self.name,
+            'device_id': self.device_id,
+            'state_class': 'measurement',
+            'unit_of_measurement': self.unit,
+            'device_class': self.device_class,
+            'icon': self.icon,
+            'unique_id': self.unique_id
+        }
+    
+    def state_data(self, value: Any) -> Dict[str, Any]:
+        """State payload for a new value"""
+        return {
+            'entity_id': self.entity_id,
+            'state': value,
+            'attributes': self.attributes
+        }
+
+class EntityDescriptorCache:
+    """Descriptors keyed by (pool_id, logicalId), built once and reused every cycle"""
+    
+    def __init__(self, device_id_for: Callable[[str], str]):
+        """Initialize cache
+        
+        device_id_for maps a pool ID to its device ID.
+        """
+        self.device_id_for = device_id_for
+        self._descriptors: Dict[Tuple[str, Any], EntityDescriptor] = {}
+    
+    def __len__(self) -> int:
+        return len(self._descriptors)
+    
+    def get(self, pool_id: str, probe_data: Dict) -> EntityDescriptor:
+        """Descriptor for a probe, rebuilt only if the probe was renamed or changed unit"""
+        key = (pool_id, probe_data['logicalId'])
+        descriptor = self._descriptors.get(key)
+        if descriptor is None or not descriptor.matches(probe_data):
+            descriptor = EntityDescriptor(pool_id, probe_data, self.device_id_for(pool_id))
+            self._descriptors[key] = descriptor
+        return descriptor
+    
+    def clear(self) -> None:
+        """Forget all descriptors"""
+        self._descriptors.clear()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Bounded concurrent pool detail fetching for Klereo Pool Manager
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+PoolCallback = Callable[[str, List[Dict]], Awaitable[None]]
+
+class FetchCycleResult:
+    """Outcome of one fan-out fetch cycle"""
+    
+    def __init__(self):
+        """Initialize empty result"""
+        self.probes: Dict[str, List[Dict]] = {}
+        self.failed: Dict[str, str] = {}
+        self.duration = 0.0
+    
+    @property
+    def succeeded(self) -> int:
+        """Number of pools fetched successfully"""
+        return len(self.probes)
+    
+    @property
+    def total(self) -> int:
+        """Number of pools attempted"""
+        return len(self.probes) + len(self.failed)
+
+class PoolDetailsFetcher:
+    """Fetch probe data for many pools concurrently with a concurrency cap"""
+    
+    DEFAULT_MAX_CONCURRENCY = 4
+    DEFAULT_TIMEOUT = 30  # seconds per pool request
+    
+    def __init__(self, fetch: Callable[[str], Awaitable[Optional[List[Dict]]]],
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                 logger: Optional[logging.Logger] = None):
+        """Initialize fetcher
+        
+        fetch is a coroutine function returning the probe list for a pool id,
+        or None on failure.
+        """
+        self.fetch = fetch
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+        
+        # Duration of the most recent cycle, for reporting
+        self.last_cycle_duration: Optional[float] = None
+    
+    async def _fetch_one(self, semaphore: asyncio.Semaphore, pool_id: str, result: FetchCycleResult,
+                         on_pool: Optional[PoolCallback] = None) -> None:
+        """Fetch a single pool, recording failures without raising"""
+        async with semaphore:
+            try:
+                probes = await asyncio.wait_for(self.fetch(pool_id), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                result.failed[pool_id] = f"timed out after {self.timeout}s"
+                return
+            except Exception as e:
+                result.failed[pool_id] = str(e) or e.__class__.__name__
+                return
+        
+        if probes is None:
+            result.failed[pool_id] = "no data"
+            return
+        result.probes[pool_id] = probes
+        
+        # Outside the semaphore, so processing a pool doesn't hold up fetching the next
+        if on_pool is not None:
+            try:
+                await on_pool(pool_id, probes)
+            except Exception as e:
+                self.logger.error(f"Failed to process pool {pool_id}: {e}")
+    
+    async def fetch_all(self, pool_ids: Iterable[Any], on_pool: Optional[PoolCallback] = None) -> FetchCycleResult:
+        """Fetch probe data for all pools, isolating per-pool failures
+        
+        on_pool, if given, is awaited with (pool_id, probes) as soon as each
+        pool arrives, while the remaining pools are still being fetched.
+        """
+        result = FetchCycleResult()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        start = time.monotonic()
+        await asyncio.gather(*(self._fetch_one(semaphore, pool_id, result, on_pool) for pool_id in pool_ids))
+        result.duration = time.monotonic() - start
+        self.last_cycle_duration = result.duration
+        
+        for pool_id, reason in result.failed.items():
+            self.logger.warning(f"Failed to fetch pool {pool_id}: {reason}")
+        
+        self.logger.debug("Fetched %d/%d pools in %.2fs (concurrency %d)",
+                          result.succeeded, result.total, result.duration, self.max_concurrency)
+        return result
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Passive health tracking for Klereo Pool Manager
+Upstream health judged from the outcomes of the requests the add-on makes
+anyway, and the /health endpoint watched by the Supervisor
+"""
+
+import collections
+import contextlib
+import time
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from aiohttp import web
+
+class UpstreamHealth:
+    """Health of an upstream from the outcomes of real requests
+    
+    Healthy once a request succeeded, as long as fewer than
+    failure_threshold requests in a row failed and at least
+    min_success_rate of the requests of the last window seconds succeeded.
+    No request is made for it; idle_for() tells when an active probe is due.
+    """
+    
+    DEFAULT_WINDOW = 900.0  # seconds
+    DEFAULT_FAILURE_THRESHOLD = 3
+    DEFAULT_MIN_SUCCESS_RATE = 0.5
+    MAX_OUTCOMES = 512
+    
+    def __init__(self, window: float = DEFAULT_WINDOW, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 min_success_rate: float = DEFAULT_MIN_SUCCESS_RATE):
+        """Initialize tracker"""
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.min_success_rate = min_success_rate
+        
+        # (time.monotonic(), succeeded), oldest first
+        self._outcomes: Deque[Tuple[float, bool]] = collections.deque(maxlen=self.MAX_OUTCOMES)
+        self.consecutive_failures = 0
+        self.last_success: Optional[float] = None
+        self.last_request: Optional[float] = None
+        self.last_error: Optional[str] = None
+    
+    def record(self, succeeded: bool, error: Optional[str] = None) -> None:
+        """Record the outcome of one request"""
+        now = time.monotonic()
+        self._outcomes.append((now, succeeded))
+        self.last_request = now
+        if succeeded:
+            self.consecutive_failures = 0
+            self.last_success = now
+        else:
+            self.consecutive_failures += 1
+            self.last_error = error
+    
+    def window_counts(self) -> Tuple[int, int]:
+        """(requests, successes) within the window"""
+        cutoff = time.monotonic() - self.window
+        requests = successes = 0
+        for at, succeeded in reversed(self._outcomes):
+            if at < cutoff:
+                break
+            requests += 1
+            successes += succeeded
+        return requests, successes
+    
+    def success_rate(self) -> Optional[float]:
+        """Share of the window's requests that succeeded, None without requests"""
+        requests, successes = self.window_counts()
+        return successes / requests if requests else None
+    
+    def idle_for(self) -> float:
+        """Seconds since the last request, infinite before the first"""
+        return float('inf') if self.last_request is None else time.monotonic() - self.last_request
+    
+    @property
+    def healthy(self) -> bool:
+        if self.last_success is None or self.consecutive_failures >= self.failure_threshold:
+            return False
+        rate = self.success_rate()
+        return rate is None or rate >= self.min_success_rate
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Health and the figures it is based on, for diagnostics"""
+        requests, successes = self.window_counts()
+        now = time.monotonic()
+        return {
+            'healthy': self.healthy,
+            'success_rate': round(successes / requests, 3) if requests else None,
+            'requests': requests,
+            'successes': successes,
+            'consecutive_failures': self.consecutive_failures,
+            'last_success_age': None if self.last_success is None else round(now - self.last_success),
+            'idle_for': None if self.last_request is None else round(now - self.last_request),
+            'last_error': self.last_error
+        }
+
+class AddonHealth:
+    """Overall health served on /health for the Supervisor watchdog
+    
+    The add-on is unhealthy, answered with HTTP 503 so the watchdog restarts
+    it, only when it is stopping or one of its jobs has been busy for longer
+    than stall_timeout: a restart can fix a hung task, not a Klereo outage.
+    Upstreams that aren't healthy make it degraded, still answered with 200.
+    """
+    
+    DEFAULT_STALL_TIMEOUT = 900.0  # seconds
+    
+    def __init__(self, components: Callable[[], Dict[str, Any]], running: Callable[[], bool] = lambda: True,
+                 stall_timeout: float = DEFAULT_STALL_TIMEOUT):
+        """Initialize health
+        
+        components returns {name: tracker} for the upstreams to report, each
+        with a healthy property and a snapshot() method.
+        """
+        self.components = components
+        self.running = running
+        self.stall_timeout = stall_timeout
+        
+        # Job in progress and when it started (time.monotonic())
+        self._busy: Optional[Tuple[str, float]] = None
+    
+    @contextlib.contextmanager
+    def busy(self, job: str) -> Iterator[None]:
+        """Mark a job in progress, such as an update cycle"""
+        previous = self._busy
+        self._busy = (job, time.monotonic()) if previous is None else previous
+        try:
+            yield
+        finally:
+            self._busy = previous
+    
+    def busy_for(self) -> float:
+        """Seconds the job in progress has been running, 0 when idle"""
+        return 0.0 if self._busy is None else time.monotonic() - self._busy[1]
+    
+    def evaluate(self) -> Dict[str, Any]:
+        """Overall status with the figures of every component"""
+        components = {name: tracker.snapshot() for name, tracker in self.components().items()}
+        busy_for = self.busy_for()
+        
+        if not self.running() or busy_for > self.stall_timeout:
+            status = 'unhealthy'
+        elif all(snapshot['healthy'] for snapshot in components.values()):
+            status = 'healthy'
+        else:
+            status = 'degraded'
+        
+        return {
+            'status': status,
+            'busy': {'job': self._busy[0], 'for': round(busy_for)} if self._busy else None,
+            'components': components
+        }
+    
+    async def handle_request(self, request: web.Request) -> web.Response:
+        """GET /health"""
+        health = self.evaluate()
+        return web.json_response(health, status=503 if health['status'] == 'unhealthy' else 200)
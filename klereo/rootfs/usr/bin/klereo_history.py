@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Probe history for Klereo Pool Manager
+Fixed-size ring buffers of samples with streaming min/max/mean downsampling
+"""
+
+import json
+import logging
+import mmap
+import os
+import time
+from collections import deque
+from urllib.parse import quote
+
+from klereo_cache import write_json_atomic
+from typing import Dict, Iterator, List, Optional, Tuple
+
+Sample = Tuple[float, float]
+
+class RingBuffer:
+    """Fixed-capacity buffer of (timestamp, value) samples, oldest overwritten first
+    
+    Samples live in one flat array of doubles, either in memory or in a
+    memory-mapped file so the history survives restarts. Memory use is fixed
+    at creation: 16 bytes per sample plus a 32 byte header.
+    """
+    
+    MAGIC = 4.2e9  # marks an initialized file
+    HEADER = 4  # doubles: magic, capacity, next index, count
+    
+    def __init__(self, capacity: int, path: Optional[str] = None):
+        """Initialize ring buffer, reopening the file at path if it has the same capacity"""
+        self.capacity = max(1, int(capacity))
+        self.path = path
+        self._mmap = None
+        
+        size = (self.HEADER + 2 * self.capacity) * 8
+        if path:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                self._mmap = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            self._data = memoryview(self._mmap).cast('d')
+        else:
+            self._data = memoryview(bytearray(size)).cast('d')
+        
+        if self._data[0] != self.MAGIC or self._data[1] != self.capacity:
+            self.clear()
+    
+    def __len__(self) -> int:
+        return int(self._data[3])
+    
+    def clear(self) -> None:
+        """Drop all samples"""
+        self._data[0] = self.MAGIC
+        self._data[1] = self.capacity
+        self._data[2] = 0
+        self._data[3] = 0
+    
+    def append(self, timestamp: float, value: float) -> None:
+        """Add a sample, overwriting the oldest one when full"""
+        data = self._data
+        index = int(data[2])
+        offset = self.HEADER + 2 * index
+        data[offset] = timestamp
+        data[offset + 1] = value
+        data[2] = (index + 1) % self.capacity
+        if data[3] < self.capacity:
+            data[3] += 1
+    
+    def last(self) -> Optional[Sample]:
+        """Newest sample"""
+        if not len(self):
+            return None
+        offset = self.HEADER + 2 * ((int(self._data[2]) - 1) % self.capacity)
+        return self._data[offset], self._data[offset + 1]
+    
+    def samples(self, since: Optional[float] = None) -> Iterator[Sample]:
+        """Samples from oldest to newest, optionally only those after since"""
+        data = self._data
+        count = len(self)
+        start = (int(data[2]) - count) % self.capacity
+        for i in range(count):
+            offset = self.HEADER + 2 * ((start + i) % self.capacity)
+            if since is None or data[offset] > since:
+                yield data[offset], data[offset + 1]
+    
+    def flush(self) -> None:
+        """Write a memory-mapped buffer back to its file"""
+        if self._mmap is not None:
+            self._mmap.flush()
+    
+    def close(self) -> None:
+        """Release the buffer"""
+        self._data.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+class Downsampler:
+    """Streaming min/max/mean per fixed time bucket
+    
+    Only the open bucket and a bounded number of completed buckets are kept,
+    so memory does not grow with the number of samples.
+    """
+    
+    def __init__(self, size: float, keep: int, local_time: bool = False):
+        """Initialize downsampler
+        
+        size is the bucket length in seconds; with local_time buckets are
+        aligned to local rather than UTC time (e.g. days start at midnight).
+        """
+        self.size = size
+        self.local_time = local_time
+        self.completed: deque = deque(maxlen=keep)
+        self._bucket: Optional[List[float]] = None  # [start, min, max, sum, count]
+    
+    def bucket_start(self, timestamp: float) -> float:
+        """Start of the bucket containing timestamp"""
+        offset = time.localtime(timestamp).tm_gmtoff if self.local_time else 0
+        return timestamp - (timestamp + offset) % self.size
+    
+    @staticmethod
+    def _summary(bucket: List[float]) -> Dict[str, float]:
+        start, minimum, maximum, total, count = bucket
+        return {'start': start, 'min': minimum, 'max': maximum, 'mean': total / count, 'count': int(count)}
+    
+    def add(self, timestamp: float, value: float) -> None:
+        """Fold a sample into its bucket; samples older than the open bucket are ignored"""
+        bucket = self._bucket
+        if bucket is not None and bucket[0] <= timestamp < bucket[0] + self.size:
+            start = bucket[0]  # still in the open bucket, skip the alignment math
+        else:
+            start = self.bucket_start(timestamp)
+        
+        if bucket is None or start > bucket[0]:
+            if bucket is not None:
+                self.completed.append(self._summary(bucket))
+            self._bucket = [start, value, value, value, 1]
+        elif start == bucket[0]:
+            if value < bucket[1]:
+                bucket[1] = value
+            if value > bucket[2]:
+                bucket[2] = value
+            bucket[3] += value
+            bucket[4] += 1
+    
+    def current(self) -> Optional[Dict[str, float]]:
+        """Summary of the open bucket"""
+        return self._summary(self._bucket) if self._bucket else None
+
+class _ProbeSeries:
+    """Samples and downsampled views of one probe"""
+    
+    __slots__ = ('buffer', 'windows')
+    
+    def __init__(self, buffer: RingBuffer, windows: Dict[str, Downsampler]):
+        self.buffer = buffer
+        self.windows = windows
+    
+    def add(self, timestamp: float, value: float) -> None:
+        self.buffer.append(timestamp, value)
+        for downsampler in self.windows.values():
+            downsampler.add(timestamp, value)
+
+class ProbeHistory:
+    """Bounded history of every probe, keyed by (pool_id, logicalId)"""
+    
+    DEFAULT_CAPACITY = 4096  # samples per probe, 28 days at one sample per 10 minutes
+    
+    # Statistics import progress, kept next to the ring files
+    IMPORTED_FILE = 'imported.json'
+    
+    # Window name: (bucket seconds, completed buckets kept, aligned to local time)
+    WINDOWS = {
+        '1h': (3600, 48, False),
+        '1d': (86400, 31, True)
+    }
+    
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, directory: Optional[str] = None,
+                 logger: Optional[logging.Logger] = None):
+        """Initialize probe history
+        
+        With a directory, each probe's ring buffer is memory-mapped from a file
+        there and reloaded on the next start.
+        """
+        self.capacity = max(1, int(capacity))
+        self.directory = directory
+        self.logger = logger or logging.getLogger(__name__)
+        self._series: Dict[Tuple[str, str], _ProbeSeries] = {}
+        
+        # Start of the last hour imported into Home Assistant's statistics, per probe
+        self._imported: Dict[Tuple[str, str], float] = {}
+        self._imported_dirty = False
+        
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._imported = self._load_imported()
+    
+    def __len__(self) -> int:
+        return len(self._series)
+    
+    @staticmethod
+    def ring_file_name(pool_id: str, logical_id: str) -> str:
+        """File name of a probe's ring buffer
+        
+        Both ids come from the Klereo API, so they are percent-escaped,
+        underscores and path separators included: the name stays inside the
+        directory and no two keys share it. Numeric ids keep their plain
+        <pool_id>_<logicalId>.ring name.
+        """
+        pool_part, probe_part = (quote(part, safe='').replace('_', '%5F') for part in (pool_id, logical_id))
+        return f"{pool_part}_{probe_part}.ring"
+    
+    def _get_series(self, pool_id: str, logical_id) -> _ProbeSeries:
+        """Series for a probe, created (and reloaded from disk) on first use"""
+        key = (str(pool_id), str(logical_id))
+        series = self._series.get(key)
+        if series is not None:
+            return series
+        
+        path = None
+        if self.directory:
+            path = os.path.join(self.directory, self.ring_file_name(*key))
+        try:
+            buffer = RingBuffer(self.capacity, path)
+        except OSError as e:
+            self.logger.warning(f"Keeping history of probe {key[1]} in memory, cannot map {path}: {e}")
+            buffer = RingBuffer(self.capacity)
+        
+        windows = {name: Downsampler(size, keep, local_time)
+                   for name, (size, keep, local_time) in self.WINDOWS.items()}
+        series = _ProbeSeries(buffer, windows)
+        
+        # Rebuild the downsampled views from samples kept on disk
+        for timestamp, value in buffer.samples():
+            for downsampler in windows.values():
+                downsampler.add(timestamp, value)
+        
+        self._series[key] = series
+        return series
+    
+    def record(self, pool_id: str, logical_id, value, timestamp: Optional[float] = None) -> bool:
+        """Record a sample; non-numeric values and samples not newer than the last are skipped"""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        
+        timestamp = time.time() if timestamp is None else timestamp
+        series = self._get_series(pool_id, logical_id)
+        last = series.buffer.last()
+        if last is not None and timestamp <= last[0]:
+            return False
+        
+        series.add(timestamp, value)
+        return True
+    
+    def samples(self, pool_id: str, logical_id, since: Optional[float] = None) -> List[Sample]:
+        """Raw samples of a probe"""
+        return list(self._get_series(pool_id, logical_id).buffer.samples(since))
+    
+    def statistics(self, pool_id: str, logical_id, window: str) -> Optional[Dict[str, float]]:
+        """Min/max/mean of the current window (e.g. this hour, today) so far"""
+        series = self._series.get((str(pool_id), str(logical_id)))
+        return series.windows[window].current() if series else None
+    
+    def completed(self, pool_id: str, logical_id, window: str,
+                  after: Optional[float] = None) -> List[Dict[str, float]]:
+        """Completed window summaries, optionally only those starting after a timestamp"""
+        series = self._series.get((str(pool_id), str(logical_id)))
+        if series is None:
+            return []
+        return [bucket for bucket in series.windows[window].completed
+                if after is None or bucket['start'] > after]
+    
+    def imported_until(self, pool_id: str, logical_id) -> Optional[float]:
+        """Start of the last hour of a probe imported into Home Assistant's statistics"""
+        return self._imported.get((str(pool_id), str(logical_id)))
+    
+    def mark_imported(self, pool_id: str, logical_id, start: float) -> None:
+        """Record the last hour imported; saved with the next flush"""
+        self._imported[(str(pool_id), str(logical_id))] = start
+        self._imported_dirty = True
+    
+    def _load_imported(self) -> Dict[Tuple[str, str], float]:
+        """Import progress saved by an earlier run, as [[pool_id, logicalId, start], ...]"""
+        path = os.path.join(self.directory, self.IMPORTED_FILE)
+        if not os.path.exists(path):
+            return {}
+        
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            return {(str(pool_id), str(logical_id)): float(start) for pool_id, logical_id, start in data}
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable statistics import progress {path}: {e}")
+            return {}
+    
+    def _save_imported(self) -> None:
+        """Persist the import progress if it changed"""
+        if not self.directory or not self._imported_dirty:
+            return
+        
+        path = os.path.join(self.directory, self.IMPORTED_FILE)
+        try:
+            write_json_atomic(path, [[*key, start] for key, start in self._imported.items()])
+            self._imported_dirty = False
+        except OSError as e:
+            self.logger.warning(f"Failed to save statistics import progress to {path}: {e}")
+    
+    def info(self) -> Dict[str, int]:
+        """Size figures for diagnostics"""
+        return {
+            'probes': len(self._series),
+            'samples': sum(len(series.buffer) for series in self._series.values()),
+            'capacity_per_probe': self.capacity
+        }
+    
+    def flush(self) -> None:
+        """Write memory-mapped buffers and the import progress back to disk"""
+        for series in self._series.values():
+            series.buffer.flush()
+        self._save_imported()
+    
+    def close(self) -> None:
+        """Flush and release all buffers"""
+        for series in self._series.values():
+            series.buffer.flush()
+            series.buffer.close()
+        self._series.clear()
+        self._save_imported()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Logging pipeline for Klereo Pool Manager
+Records are queued by the event loop and written by a background thread to
+stdout and a size-rotated log file; repeated messages are rate limited
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from typing import Dict, List, Optional, TextIO, Tuple
+
+class RepeatFilter(logging.Filter):
+    """Lets a message through once per window, then reports how often it repeated
+    
+    Messages are compared after formatting, so "State updated: pH = 7.2" for
+    two pools are different messages, while "Maintenance ongoing, skipping
+    request" logged for every request is shown once a minute. The first
+    message after a quiet window carries the count of the ones held back.
+    """
+    
+    DEFAULT_WINDOW = 60.0  # seconds
+    MAX_TRACKED = 1000
+    
+    def __init__(self, window: float = DEFAULT_WINDOW):
+        """Initialize filter"""
+        super().__init__()
+        self.window = window
+        # (logger, level, message) -> [window start, suppressed count]
+        self._seen: Dict[Tuple[str, int, str], List[float]] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        key = (record.name, record.levelno, message)
+        now = record.created
+        
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.window:
+                seen[1] += 1
+                self.suppressed += 1
+                return False
+            
+            repeated = seen[1] if seen is not None else 0
+            if len(self._seen) >= self.MAX_TRACKED:
+                self._prune(now)
+            self._seen[key] = [now, 0]
+        
+        # Formatted once here instead of again by the queue handler
+        record.msg = f"{message} (repeated {repeated} more times)" if repeated else message
+        record.args = None
+        return True
+    
+    def _prune(self, now: float) -> None:
+        """Forget messages whose window is over, or all if none is"""
+        expired = [key for key, (start, _) in self._seen.items() if now - start >= self.window]
+        for key in expired or list(self._seen):
+            del self._seen[key]
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the writer falls behind
+    
+    The drops are reported once the writer has caught up, so a burst gives
+    one notice with its total rather than one each time a slot frees up.
+    """
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.dropped and self.queue.empty():
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Log writer fell behind, {self.dropped} records dropped"}))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogWriter(logging.handlers.QueueListener):
+    """Queue listener that drains the queue on stop, which is safe to call again"""
+    
+    def enqueue_sentinel(self) -> None:
+        # Waits for room: the writer still empties a full queue
+        self.queue.put(self._sentinel)
+    
+    def stop(self) -> None:
+        """Write what is queued, then close the handlers"""
+        if self._thread is None:
+            return
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
+
+def setup_logging(level: int, path: Optional[str] = '/var/log/klereo.log',
+                  max_bytes: int = 2 * 1024 * 1024, backups: int = 2, stream: TextIO = sys.stdout,
+                  queue_size: int = 10000,
+                  repeat_window: float = RepeatFilter.DEFAULT_WINDOW) -> LogWriter:
+    """Route all logging through a queue to stream and a rotated log file
+    
+    The event loop only formats the message and enqueues it; a listener
+    thread does the writes, so a slow SD card can't stall it. The file is
+    rotated at max_bytes, keeping backups old files. The writer is
+    stopped, flushing the queue, at exit.
+    """
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers: List[logging.Handler] = [logging.StreamHandler(stream)]
+    if path:
+        try:
+            handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups))
+        except OSError as e:
+            print(f"Logging to {path} disabled: {e}", file=sys.stderr)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    if repeat_window > 0:
+        queue_handler.addFilter(RepeatFilter(repeat_window))
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    writer = LogWriter(log_queue, *handlers, respect_handler_level=True)
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style metrics for Klereo Pool Manager
+Minimal in-process registry with text exposition, no external dependencies
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_value(value: float) -> str:
+    """Format a sample value"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value: str) -> str:
+    """Escape a label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    """Format a label set"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    """Base class for labelled metrics"""
+    
+    TYPE = 'untyped'
+    
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        """Initialize metric"""
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+    
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        """Label values in declaration order"""
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+    
+    def samples(self) -> List[str]:
+        """Exposition lines for this metric's samples"""
+        raise NotImplementedError
+    
+    def expose(self) -> str:
+        """Full exposition block including HELP and TYPE"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing counter"""
+    
+    TYPE = 'counter'
+    
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+    
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Increment the counter"""
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels) -> float:
+        """Current value"""
+        return self._values.get(self._key(labels), 0)
+    
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+class Gauge(Metric):
+    """Value that can go up and down, or is computed at scrape time"""
+    
+    TYPE = 'gauge'
+    
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Optional[float]]] = None
+    
+    def set(self, value: float, **labels) -> None:
+        """Set the gauge"""
+        self._values[self._key(labels)] = value
+    
+    def set_function(self, function: Callable[[], Optional[float]]) -> None:
+        """Compute the (unlabelled) value at scrape time; None omits the sample"""
+        self._function = function
+    
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                value = None
+            return [] if value is None else [f"{self.name} {_format_value(value)}"]
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed buckets"""
+    
+    TYPE = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+    
+    def observe(self, value: float, **labels) -> None:
+        """Record an observation"""
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+    
+    def time(self, **labels) -> '_Timer':
+        """Context manager observing the elapsed time of its block"""
+        return _Timer(self, labels)
+    
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class _Timer:
+    """Times a block into a histogram"""
+    
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+    
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+    
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric, returning the existing one if the name is taken"""
+        return self._metrics.setdefault(metric.name, metric)
+    
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+    
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+    
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+    
+    def expose(self) -> str:
+        """Prometheus text exposition of all metrics"""
+        return '\n'.join(metric.expose() for metric in self._metrics.values()) + '\n'
+
+# Process-wide registry and the add-on's metrics
+REGISTRY = MetricsRegistry()
+
+KLEREO_REQUEST_SECONDS = REGISTRY.histogram(
+    'klereo_api_request_duration_seconds', 'Latency of Klereo API requests', ['endpoint'])
+KLEREO_REQUESTS = REGISTRY.counter(
+    'klereo_api_requests_total', 'Klereo API requests by outcome', ['endpoint', 'outcome'])
+HA_REQUEST_SECONDS = REGISTRY.histogram(
+    'klereo_ha_request_duration_seconds', 'Latency of Home Assistant API requests', ['endpoint'])
+HA_REQUESTS = REGISTRY.counter(
+    'klereo_ha_requests_total', 'Home Assistant API requests by outcome', ['endpoint', 'outcome'])
+HA_STATE_WRITES = REGISTRY.counter(
+    'klereo_ha_state_writes_total', 'Sensor state writes by result', ['result'])
+MQTT_PUBLISHES = REGISTRY.counter(
+    'klereo_mqtt_publishes_total', 'MQTT messages published by kind and outcome', ['kind', 'outcome'])
+CYCLE_SECONDS = REGISTRY.histogram(
+    'klereo_update_cycle_duration_seconds', 'Duration of sensor update cycles',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+CYCLE_PHASE_SECONDS = REGISTRY.gauge(
+    'klereo_update_cycle_phase_seconds', 'Duration of the phases of the last update cycle', ['phase'])
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    'klereo_cache_hit_ratio', 'Fraction of Klereo cache lookups served from cache')
+CACHE_ENTRIES = REGISTRY.gauge(
+    'klereo_cache_entries', 'Entries held in the Klereo cache')
+CIRCUIT_BREAKER_OPEN = REGISTRY.gauge(
+    'klereo_circuit_breaker_open', '1 while the Klereo circuit breaker is not closed')
+STARTUP_SECONDS = REGISTRY.gauge(
+    'klereo_startup_seconds', 'Seconds from add-on start to each startup milestone', ['milestone'])
+CONTROL_COMMANDS = REGISTRY.counter(
+    'klereo_control_commands_total', 'Pool control commands by kind and outcome', ['kind', 'outcome'])
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    'klereo_event_loop_lag_seconds', 'Delay of event loop wakeups past their deadline',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+SLOW_CALLBACKS = REGISTRY.counter(
+    'klereo_slow_callbacks_total', 'Event loop callbacks that ran longer than the slow callback threshold')
+
+class StartupTimer:
+    """Seconds from add-on start to each startup milestone, reported once at boot"""
+    
+    def __init__(self, start: Optional[float] = None, gauge: Gauge = STARTUP_SECONDS):
+        """Initialize timer; start is a time.monotonic() value, defaulting to now"""
+        self.start = time.monotonic() if start is None else start
+        self.gauge = gauge
+        self.milestones: Dict[str, float] = {}
+    
+    def mark(self, milestone: str, at: Optional[float] = None) -> float:
+        """Record a milestone reached now, or at a given time.monotonic() value
+        
+        Only the first mark of a milestone counts.
+        """
+        if milestone not in self.milestones:
+            elapsed = (time.monotonic() if at is None else at) - self.start
+            self.milestones[milestone] = round(elapsed, 3)
+            self.gauge.set(elapsed, milestone=milestone)
+        return self.milestones[milestone]
+    
+    def report(self) -> str:
+        """Milestones in the order they were reached"""
+        return ', '.join(f"{milestone} {elapsed:.2f}s"
+                         for milestone, elapsed in sorted(self.milestones.items(), key=lambda item: item[1]))
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a periodic wakeup"""
+    
+    def __init__(self, interval: float = 0.5, histogram: Histogram = LOOP_LAG_SECONDS):
+        """Initialize monitor"""
+        self.interval = interval
+        self.histogram = histogram
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+    
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.histogram.observe(self.last_lag)
+    
+    def start(self) -> None:
+        """Start sampling"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop sampling"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+class MetricsServer:
+    """HTTP server exposing /metrics, /status and any routes added by other components"""
+    
+    DEFAULT_PORT = 8080
+    
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = '0.0.0.0', port: int = DEFAULT_PORT,
+                 status: Optional[Callable[[], Dict]] = None, logger: Optional[logging.Logger] = None,
+                 metrics: bool = True):
+        """Initialize metrics server
+        
+        status is called to build the JSON document served on /status. With
+        metrics off, only the added routes are served.
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.status = status
+        self.metrics = metrics
+        self.logger = logger or logging.getLogger(__name__)
+        self._runner = None
+        self._routes: List[Tuple[str, str, Callable]] = []
+    
+    def add_route(self, method: str, path: str, handler: Callable) -> None:
+        """Serve another aiohttp handler on the same port; call before start()"""
+        self._routes.append((method, path, handler))
+    
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.expose(), content_type='text/plain',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+    
+    async def _status(self, request: web.Request) -> web.Response:
+        return web.json_response(self.status() if self.status else {})
+    
+    async def start(self) -> bool:
+        """Start listening; failures are logged and leave the add-on running"""
+        app = web.Application()
+        paths = []
+        if self.metrics:
+            app.router.add_get('/metrics', self._metrics)
+            app.router.add_get('/status', self._status)
+            paths = ['/metrics', '/status']
+        for method, path, handler in self._routes:
+            app.router.add_route(method, path, handler)
+        
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            self.logger.error(f"Metrics server failed to listen on port {self.port}: {e}")
+            await self._runner.cleanup()
+            self._runner = None
+            return False
+        
+        paths = ', '.join(paths + [path for _, path, _ in self._routes])
+        self.logger.info(f"HTTP endpoints available on port {self.port} ({paths})")
+        return True
+    
+    async def stop(self) -> None:
+        """Stop listening"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
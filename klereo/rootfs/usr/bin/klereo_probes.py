@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Pool details parsing for Klereo Pool Manager
+Decodes API responses once and projects pool details into compact records
+"""
+
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    # Optional faster decoder; installed only where a prebuilt wheel exists
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decode a JSON document, raising ValueError when it is invalid"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class ProbeRecord:
+    """Read-only probe of a pool, holding only the fields the add-on uses
+    
+    Supports probe['name'] and probe.get('unit', '') with the API's field
+    names, so it can stand in for the probe dicts built elsewhere (statistics
+    probes).
+    """
+    
+    __slots__ = ('logical_id', 'name', 'value', 'unit', 'type')
+    
+    # API field name -> attribute
+    FIELDS = {
+        'logicalId': 'logical_id',
+        'name': 'name',
+        'filteredValue': 'value',
+        'unit': 'unit',
+        'type': 'type'
+    }
+    
+    def __init__(self, logical_id: Any, name: Optional[str], value: Any,
+                 unit: Optional[str] = None, type: Optional[str] = None):
+        """Initialize record"""
+        self.logical_id = logical_id
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.type = type
+    
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, self.FIELDS[key])
+        except KeyError:
+            raise KeyError(key) from None
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+    
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, ProbeRecord):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+    
+    def __repr__(self) -> str:
+        return f"ProbeRecord({self.logical_id!r}, {self.name!r}, {self.value!r}, {self.unit!r}, {self.type!r})"
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        """Field by API name, like dict.get"""
+        attribute = self.FIELDS.get(key)
+        return default if attribute is None else getattr(self, attribute)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Probe as a dict with the API's field names"""
+        return {key: getattr(self, attribute) for key, attribute in self.FIELDS.items()}
+    
+    def to_row(self) -> List[Any]:
+        """Compact JSON-serializable form, for cache persistence"""
+        return [self.logical_id, self.name, self.value, self.unit, self.type]
+    
+    @classmethod
+    def from_row(cls, row: List[Any]) -> 'ProbeRecord':
+        """Record from to_row() output"""
+        return cls(*row)
+
+class OutputRecord:
+    """Output (relay) of a pool such as filtration, lighting or heating"""
+    
+    __slots__ = ('index', 'name', 'mode', 'status')
+    
+    def __init__(self, index: int, name: str, mode: Optional[int] = None, status: Optional[int] = None):
+        """Initialize record"""
+        self.index = index
+        self.name = name
+        self.mode = mode
+        self.status = status
+    
+    @property
+    def is_on(self) -> bool:
+        return bool(self.status)
+    
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, OutputRecord):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+    
+    def __repr__(self) -> str:
+        return f"OutputRecord({self.index!r}, {self.name!r}, {self.mode!r}, {self.status!r})"
+    
+    def to_row(self) -> List[Any]:
+        """Compact JSON-serializable form, for cache persistence"""
+        return [self.index, self.name, self.mode, self.status]
+    
+    @classmethod
+    def from_row(cls, row: List[Any]) -> 'OutputRecord':
+        """Record from to_row() output"""
+        return cls(*row)
+
+class PoolDetails:
+    """Parsed details of a pool: probe records, outputs and setpoints
+    
+    Iterating yields the probe records, so code written for a plain probe
+    tuple keeps working.
+    """
+    
+    __slots__ = ('probes', 'outputs', 'setpoints')
+    
+    def __init__(self, probes: Tuple[ProbeRecord, ...] = (), outputs: Tuple[OutputRecord, ...] = (),
+                 setpoints: Optional[Dict[str, Any]] = None):
+        """Initialize details"""
+        self.probes = probes
+        self.outputs = outputs
+        self.setpoints = setpoints or {}
+    
+    def __iter__(self) -> Iterator[ProbeRecord]:
+        return iter(self.probes)
+    
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, PoolDetails):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+    
+    def __repr__(self) -> str:
+        return f"PoolDetails({len(self.probes)} probes, {len(self.outputs)} outputs, {self.setpoints!r})"
+    
+    def output(self, index: int) -> Optional[OutputRecord]:
+        """Output by index, None when the pool doesn't have it"""
+        for output in self.outputs:
+            if output.index == index:
+                return output
+        return None
+    
+    def to_row(self) -> List[Any]:
+        """Compact JSON-serializable form, for cache persistence"""
+        return [encode_probes(self.probes), [output.to_row() for output in self.outputs], self.setpoints]
+    
+    @classmethod
+    def from_row(cls, row: List[Any]) -> 'PoolDetails':
+        """Details from to_row() output"""
+        probes, outputs, setpoints = row
+        return cls(decode_probes(probes), tuple(OutputRecord.from_row(output) for output in outputs), setpoints)
+
+# Settable pool parameters kept from the params of GetPoolDetails.php
+SETPOINT_PARAMS = ('Heating_Setpoint', 'pH_Setpoint', 'ORP_Setpoint', 'Chlorine_Setpoint')
+
+# IORename type of outputs
+OUTPUT_IO_TYPE = 1
+
+def parse_probes(pool_details: Dict) -> Tuple[ProbeRecord, ...]:
+    """Project the probe list of a GetPoolDetails.php response into records"""
+    return tuple(
+        ProbeRecord(probe.get('logicalId'), probe.get('name'), probe.get('filteredValue'),
+                    probe.get('unit'), probe.get('type'))
+        for probe in pool_details.get('probes', ())
+    )
+
+def parse_outputs(pool_details: Dict) -> Tuple[OutputRecord, ...]:
+    """Project the outputs of a GetPoolDetails.php response into records, named from IORename"""
+    names = {io.get('ioIndex'): io.get('name') for io in pool_details.get('IORename') or ()
+             if io.get('ioType') == OUTPUT_IO_TYPE}
+    return tuple(
+        OutputRecord(out['index'], names.get(out['index']) or f"Output {out['index']}",
+                     out.get('mode'), out.get('status'))
+        for out in pool_details.get('outs') or () if out.get('index') is not None
+    )
+
+def parse_pool_details(pool_details: Dict) -> PoolDetails:
+    """Project a GetPoolDetails.php response into the parts the add-on uses"""
+    params = pool_details.get('params') or {}
+    return PoolDetails(parse_probes(pool_details), parse_outputs(pool_details),
+                       {param: params[param] for param in SETPOINT_PARAMS if params.get(param) is not None})
+
+def encode_probes(records: Iterable[ProbeRecord]) -> List[List[Any]]:
+    """Records as rows for cache persistence"""
+    return [record.to_row() for record in records]
+
+def decode_probes(rows: Iterable[List[Any]]) -> Tuple[ProbeRecord, ...]:
+    """Records from encode_probes() output"""
+    return tuple(ProbeRecord.from_row(row) for row in rows)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Profiling hooks for Klereo Pool Manager
+Timing spans around hot paths, a slow event loop callback detector and
+on-demand sampling profiles written to /share
+"""
+
+import asyncio
+import collections
+import ipaddress
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Counter, Deque, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from klereo_metrics import REGISTRY, SLOW_CALLBACKS, Counter as CounterMetric, Metric, _format_labels, _format_value
+
+class SpanRecorder(Metric):
+    """Count, total and maximum duration per span name
+    
+    Exposed as a summary without quantiles: spans wrap cache lookups too, so
+    recording one must stay far cheaper than a labelled histogram observation.
+    """
+    
+    TYPE = 'summary'
+    
+    def __init__(self, name: str, documentation: str):
+        """Initialize recorder"""
+        super().__init__(name, documentation, ['span'])
+        # span name -> [count, total seconds, max seconds]
+        self._totals: Dict[str, List[float]] = {}
+    
+    def record(self, name: str, duration: float) -> None:
+        """Record one run of a span"""
+        totals = self._totals.get(name)
+        if totals is None:
+            totals = self._totals[name] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += duration
+        if duration > totals[2]:
+            totals[2] = duration
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Runs, mean, max and total seconds per span"""
+        return {name: {'count': int(count), 'mean': round(total / count, 6),
+                       'max': round(maximum, 6), 'total': round(total, 3)}
+                for name, (count, total, maximum) in sorted(self._totals.items())}
+    
+    def clear(self) -> None:
+        """Forget all spans"""
+        self._totals.clear()
+    
+    def samples(self) -> List[str]:
+        lines = []
+        for name, (count, total, _) in sorted(self._totals.items()):
+            labels = _format_labels(self.label_names, (name,))
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {int(count)}")
+        return lines
+
+# Process-wide spans, exposed with the add-on's metrics
+SPANS: SpanRecorder = REGISTRY.register(
+    SpanRecorder('klereo_span_duration_seconds', 'Time spent in instrumented code paths'))
+
+class Span:
+    """Times a block, including any awaits inside it, into a SpanRecorder"""
+    
+    __slots__ = ('name', 'recorder', 'start', 'elapsed')
+    
+    def __init__(self, name: str, recorder: SpanRecorder):
+        self.name = name
+        self.recorder = recorder
+        self.start = 0.0
+        self.elapsed = 0.0
+    
+    def __enter__(self) -> 'Span':
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.start
+        self.recorder.record(self.name, self.elapsed)
+
+def span(name: str, recorder: SpanRecorder = SPANS) -> Span:
+    """Context manager timing its block as the named span"""
+    return Span(name, recorder)
+
+class SlowCallbackDetector:
+    """Reports event loop callbacks and task steps that block the loop
+    
+    Every callback, task steps included, runs through asyncio's Handle._run;
+    wrapping it costs two perf_counter() calls per callback, where asyncio's
+    debug mode would report the same but slow everything else down.
+    """
+    
+    DEFAULT_THRESHOLD = 0.1  # seconds, asyncio's own slow_callback_duration
+    
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, keep: int = 20,
+                 counter: CounterMetric = SLOW_CALLBACKS, logger: Optional[logging.Logger] = None):
+        """Initialize detector; keep is how many recent slow callbacks are remembered"""
+        self.threshold = threshold
+        self.counter = counter
+        self.logger = logger or logging.getLogger(__name__)
+        # (wall clock time, seconds, description), newest last
+        self.recent: Deque[Tuple[float, float, str]] = collections.deque(maxlen=keep)
+        self._original: Optional[Callable] = None
+    
+    @property
+    def installed(self) -> bool:
+        return self._original is not None
+    
+    def install(self) -> None:
+        """Start timing callbacks of every event loop in the process"""
+        if self._original is not None:
+            return
+        
+        original = asyncio.events.Handle._run
+        detector = self
+        
+        def _run(handle: asyncio.Handle) -> None:
+            start = time.perf_counter()
+            original(handle)
+            elapsed = time.perf_counter() - start
+            if elapsed >= detector.threshold:
+                detector.report(handle, elapsed)
+        
+        asyncio.events.Handle._run = _run
+        self._original = original
+    
+    def uninstall(self) -> None:
+        """Stop timing callbacks"""
+        if self._original is not None:
+            asyncio.events.Handle._run = self._original
+            self._original = None
+    
+    @staticmethod
+    def describe(handle: asyncio.Handle) -> str:
+        """Name the task or callback behind a handle"""
+        callback = handle._callback
+        # Task steps are bound to their task
+        task = getattr(callback, '__self__', None)
+        if isinstance(task, asyncio.Task):
+            coro = task.get_coro()
+            frame = getattr(coro, 'cr_frame', None)
+            where = f", now at {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}" if frame else ''
+            return f"task {task.get_name()} ({getattr(coro, '__qualname__', coro)}{where})"
+        return repr(handle)
+    
+    def report(self, handle: asyncio.Handle, elapsed: float) -> None:
+        """Log and remember a slow callback"""
+        try:
+            description = self.describe(handle)
+        except Exception:
+            description = object.__repr__(handle)
+        self.recent.append((time.time(), elapsed, description))
+        self.counter.inc()
+        self.logger.warning(f"Event loop blocked for {elapsed * 1000:.0f} ms by {description}")
+    
+    def info(self) -> Dict[str, Any]:
+        """Threshold and recent slow callbacks, for /status and profile reports"""
+        return {
+            'threshold': self.threshold,
+            'count': int(self.counter.value()),
+            'recent': [{'at': datetime.fromtimestamp(at).isoformat(timespec='seconds'),
+                        'ms': round(elapsed * 1000, 1), 'callback': description}
+                       for at, elapsed, description in self.recent]
+        }
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack on demand and writes a report
+    
+    A background thread reads sys._current_frames() every interval while a
+    profile is taken, so profiling costs nothing until it is requested and
+    works on a running add-on. Each profile is written to directory as
+    profile-<time>.txt (hottest functions, spans, slow callbacks, task
+    stacks, status) and profile-<time>.folded, collapsed stacks for flame
+    graph tools. Only the newest keep profiles are kept.
+    """
+    
+    DEFAULT_DIRECTORY = '/share/klereo'
+    DEFAULT_DURATION = 10.0  # seconds
+    MAX_DURATION = 120.0     # seconds
+    DEFAULT_INTERVAL = 0.005  # seconds between samples
+    MAX_DEPTH = 64
+    TOP = 25
+    
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, interval: float = DEFAULT_INTERVAL,
+                 keep: int = 10, spans: SpanRecorder = SPANS,
+                 detector: Optional[SlowCallbackDetector] = None,
+                 status: Optional[Callable[[], Dict]] = None,
+                 logger: Optional[logging.Logger] = None):
+        """Initialize profiler
+        
+        status is called to add the add-on's JSON status to each report.
+        """
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.spans = spans
+        self.detector = detector
+        self.status = status
+        self.logger = logger or logging.getLogger(__name__)
+        self.last_profile: Optional[Dict[str, Any]] = None
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._running
+    
+    async def profile(self, duration: float = DEFAULT_DURATION) -> Optional[Dict[str, Any]]:
+        """Sample the calling event loop's thread for duration seconds and write the report
+        
+        Returns a summary with the report paths (None when writing failed),
+        or None if a profile is already being taken.
+        """
+        if self._running:
+            return None
+        self._running = True
+        try:
+            duration = min(max(duration, self.interval), self.MAX_DURATION)
+            loop = asyncio.get_running_loop()
+            started = datetime.now()
+            tasks = self._task_stacks()
+            
+            # Sampling and writing run in worker threads; the summaries are
+            # read here, in the loop that updates them
+            stacks = await loop.run_in_executor(None, self._sample, threading.get_ident(), duration)
+            sections = {
+                'spans': self.spans.summary(),
+                'slow_callbacks': self.detector.info() if self.detector else None,
+                'status': self._status(),
+            }
+            result = await loop.run_in_executor(None, self._write, started, duration, stacks, tasks, sections)
+        finally:
+            self._running = False
+        
+        self.last_profile = result
+        if result['report']:
+            self.logger.info(f"Profile of {duration:.0f}s written to {result['report']} "
+                             f"(event loop busy {result['busy']:.1%})")
+        return result
+    
+    def trigger(self, duration: float = DEFAULT_DURATION) -> None:
+        """Take a profile in the background, e.g. from a signal handler"""
+        if self._running:
+            self.logger.info("A profile is already being taken")
+            return
+        self.logger.info(f"Profiling the event loop for {duration:.0f}s")
+        self._task = asyncio.get_running_loop().create_task(self.profile(duration))
+    
+    @staticmethod
+    def _is_local(request: web.Request) -> bool:
+        try:
+            return ipaddress.ip_address(request.remote or '').is_loopback
+        except ValueError:
+            return False
+    
+    async def handle_request(self, request: web.Request) -> web.Response:
+        """aiohttp handler: POST /profile?seconds=N takes a profile and answers with its summary
+        
+        The port is reachable from the network without authentication, so
+        only requests from inside the add-on container are served.
+        """
+        if not self._is_local(request):
+            return web.json_response({'error': 'profiles can only be requested from localhost'}, status=403)
+        
+        try:
+            duration = float(request.query.get('seconds', self.DEFAULT_DURATION))
+        except ValueError:
+            return web.json_response({'error': 'seconds must be a number'}, status=400)
+        
+        result = await self.profile(duration)
+        if result is None:
+            return web.json_response({'error': 'a profile is already being taken'}, status=409)
+        return web.json_response(result, status=200 if result['report'] else 500)
+    
+    def _status(self) -> Optional[Dict]:
+        if self.status is None:
+            return None
+        try:
+            return self.status()
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def _task_stacks(self) -> List[str]:
+        """Where every task of the running loop is suspended"""
+        lines = []
+        for task in sorted(asyncio.all_tasks(), key=lambda task: task.get_name()):
+            coro = task.get_coro()
+            lines.append(f"{task.get_name()}: {getattr(coro, '__qualname__', coro)}")
+            for frame in task.get_stack(limit=self.MAX_DEPTH):
+                lines.append(f"    {frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+        return lines
+    
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    
+    def _sample(self, thread_id: int, duration: float) -> Counter[Tuple[str, ...]]:
+        """Collapsed stacks of one thread, outermost frame first, with their sample counts"""
+        stacks: Counter[Tuple[str, ...]] = collections.Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.MAX_DEPTH:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+        return stacks
+    
+    def _write(self, started: datetime, duration: float, stacks: Counter[Tuple[str, ...]],
+               tasks: List[str], sections: Dict[str, Any]) -> Dict[str, Any]:
+        """Write the report and folded stacks, then prune old profiles"""
+        samples = sum(stacks.values())
+        # An idle loop waits in the selector
+        idle = sum(count for stack, count in stacks.items() if 'selectors.py' in stack[-1])
+        busy = (samples - idle) / samples if samples else 0.0
+        
+        own: Counter[str] = collections.Counter()
+        inclusive: Counter[str] = collections.Counter()
+        for stack, count in stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                inclusive[name] += count
+        
+        def table(counts: Counter[str]) -> List[str]:
+            return [f"{count:8d} {count / samples:7.1%}  {name}" for name, count in counts.most_common(self.TOP)]
+        
+        lines = [
+            "Klereo Pool Manager profile",
+            f"Started {started:%Y-%m-%d %H:%M:%S}, {duration:.1f}s, {samples} samples "
+            f"every {self.interval * 1000:.0f} ms, event loop busy {busy:.1%}",
+            "", "== Functions by own samples ==", *(table(own) if samples else []),
+            "", "== Functions by inclusive samples ==", *(table(inclusive) if samples else []),
+            "", "== Spans (since start) ==",
+            *(f"{name:<24} count={stats['count']:<8d} mean={stats['mean'] * 1000:9.2f} ms  "
+              f"max={stats['max'] * 1000:9.2f} ms  total={stats['total']:.1f} s"
+              for name, stats in sections['spans'].items()),
+            "", "== Slow callbacks ==",
+            json.dumps(sections['slow_callbacks'], indent=2),
+            "", "== Tasks at start ==", *tasks,
+            "", "== Status ==",
+            json.dumps(sections['status'], indent=2, default=str),
+        ]
+        
+        stem = os.path.join(self.directory, f"profile-{started:%Y%m%d-%H%M%S}")
+        result = {'report': None, 'folded': None, 'duration': round(duration, 3),
+                  'samples': samples, 'busy': round(busy, 4)}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f"{stem}.folded", 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{';'.join(stack)} {count}\n")
+            with open(f"{stem}.txt", 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        except OSError as e:
+            self.logger.error(f"Failed to write profile to {self.directory}: {e}")
+            return result
+        
+        result['report'], result['folded'] = f"{stem}.txt", f"{stem}.folded"
+        self._prune()
+        return result
+    
+    def _prune(self) -> None:
+        """Delete all but the newest keep profiles"""
+        reports = sorted(name for name in os.listdir(self.directory)
+                         if name.startswith('profile-') and name.endswith('.txt'))
+        for name in reports[:max(0, len(reports) - self.keep)]:
+            for suffix in ('.txt', '.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, name[:-len('.txt')] + suffix))
+                except OSError:
+                    pass
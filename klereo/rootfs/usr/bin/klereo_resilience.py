@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Retry policy and circuit breaker for the Klereo upstream
+"""
+
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+class RetryPolicy:
+    """Jittered exponential backoff for idempotent requests"""
+    
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0):
+        """Initialize retry policy"""
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def delay(self, attempt: int) -> float:
+        """Backoff before retrying after the given failed attempt (1-based)
+        
+        Uses "full jitter": a random delay up to the exponential cap, so
+        retries from several clients don't synchronize.
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing, then probes it again"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 300,
+                 logger: Optional[logging.Logger] = None):
+        """Initialize circuit breaker
+        
+        Opens after failure_threshold consecutive failures and allows a single
+        trial request once reset_timeout seconds have passed.
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.logger = logger or logging.getLogger(__name__)
+        
+        self._state = self.CLOSED
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.consecutive_failures = 0
+        self.times_opened = 0
+    
+    @property
+    def state(self) -> str:
+        """Current state, moving from open to half-open once the reset timeout expires"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+    
+    @property
+    def is_closed(self) -> bool:
+        return self.state == self.CLOSED
+    
+    def allow_request(self) -> bool:
+        """Check whether a request may be sent upstream"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+    
+    def record_success(self) -> None:
+        """Record a request that reached the upstream"""
+        if self._state != self.CLOSED:
+            self.logger.info("Circuit breaker closed, Klereo API reachable again")
+        self._state = self.CLOSED
+        self._trial_in_flight = False
+        self.consecutive_failures = 0
+    
+    def record_failure(self) -> None:
+        """Record a request that failed after all retries"""
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        
+        if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+            self.logger.warning(f"Circuit breaker opened after {self.consecutive_failures} consecutive failures, "
+                                f"pausing Klereo requests for {self.reset_timeout}s")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """State and counters for diagnostics"""
+        state = self.state
+        retry_in = None
+        if state == self.OPEN:
+            retry_in = max(0, round(self.reset_timeout - (time.monotonic() - self._opened_at)))
+        return {
+            'state': state,
+            'consecutive_failures': self.consecutive_failures,
+            'failure_threshold': self.failure_threshold,
+            'times_opened': self.times_opened,
+            'retry_in': retry_in
+        }
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Maintenance-aware poll scheduling for Klereo Pool Manager
+"""
+
+import logging
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+Window = Tuple[datetime, datetime]
+
+def stagger(count: int, span: float) -> List[float]:
+    """Offsets spreading count jobs evenly over span seconds"""
+    return [span * i / count for i in range(count)]
+
+class MaintenanceCalendar:
+    """Klereo maintenance windows resolved to concrete datetimes"""
+    
+    def __init__(self, windows: Dict[int, Dict[str, int]]):
+        """Initialize calendar
+        
+        windows maps the PHP day of week (0=Sunday) to {'from': HHMM, 'to': HHMM};
+        the 'to' minute is part of the window.
+        """
+        self.windows = windows
+    
+    def _window_on(self, day: date) -> Optional[Window]:
+        """Maintenance window on a given date as [start, end)"""
+        php_day = (day.weekday() + 1) % 7  # Python 0=Monday -> PHP 0=Sunday
+        window = self.windows.get(php_day)
+        if not window:
+            return None
+        
+        start = datetime.combine(day, dtime(window['from'] // 100, window['from'] % 100))
+        end = datetime.combine(day, dtime(window['to'] // 100, window['to'] % 100)) + timedelta(minutes=1)
+        return start, end
+    
+    def current_window(self, now: datetime) -> Optional[Window]:
+        """Window containing now, if any"""
+        window = self._window_on(now.date())
+        if window and window[0] <= now < window[1]:
+            return window
+        return None
+    
+    def next_window(self, now: datetime) -> Optional[Window]:
+        """Current or next upcoming window"""
+        for offset in range(8):
+            window = self._window_on(now.date() + timedelta(days=offset))
+            if window and window[1] > now:
+                return window
+        return None
+
+class PollScheduler:
+    """Decides when the next sensor update and health check should run
+    
+    Polls are never scheduled inside a maintenance window, and an update is
+    deferred while every pool's details are still cached, because polling then
+    would only re-read data that cannot have changed.
+    """
+    
+    # Wait this long past a cache expiry or window end before polling
+    SLACK = 1.0  # seconds
+    
+    def __init__(self, update_interval: float, health_check_interval: float,
+                 calendar: MaintenanceCalendar, logger: Optional[logging.Logger] = None):
+        """Initialize scheduler"""
+        self.update_interval = update_interval
+        self.health_check_interval = health_check_interval
+        self.calendar = calendar
+        self.logger = logger or logging.getLogger(__name__)
+        
+        self.last_update = 0.0
+        self.last_health_check = 0.0
+    
+    def mark_update(self, timestamp: Optional[float] = None) -> None:
+        """Record that an update cycle ran"""
+        self.last_update = time.time() if timestamp is None else timestamp
+    
+    def mark_health_check(self, timestamp: Optional[float] = None) -> None:
+        """Record that a health check ran"""
+        self.last_health_check = time.time() if timestamp is None else timestamp
+    
+    def _outside_maintenance(self, timestamp: float) -> float:
+        """Move a timestamp that falls inside a maintenance window to just after it"""
+        window = self.calendar.current_window(datetime.fromtimestamp(timestamp))
+        if window:
+            return window[1].timestamp() + self.SLACK
+        return timestamp
+    
+    def next_update_at(self, fresh_until: Optional[float] = None) -> float:
+        """Timestamp of the next useful update cycle
+        
+        fresh_until is when the first cached pool details expire, or None when
+        some pool has no cached details.
+        """
+        due = self.last_update + self.update_interval
+        if fresh_until is not None and fresh_until > due:
+            due = fresh_until + self.SLACK
+        return self._outside_maintenance(due)
+    
+    def next_health_check_at(self) -> float:
+        """Timestamp of the next health check"""
+        return self._outside_maintenance(self.last_health_check + self.health_check_interval)
+    
+    def in_maintenance(self, timestamp: Optional[float] = None) -> bool:
+        """Check whether a timestamp falls inside a maintenance window"""
+        timestamp = time.time() if timestamp is None else timestamp
+        return self.calendar.current_window(datetime.fromtimestamp(timestamp)) is not None